@@ -0,0 +1,103 @@
+import argparse
+import fastf1 as ff1
+import logging
+import os
+import pandas as pd
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from my_functions.instrumentation import enable_instrumentation, log_instrumentation_summary
+from my_functions.storage import StagingTransaction, get_store
+from my_functions.update_functions import LOAD_PROFILES, backfill_season, stage_sessions
+
+parser = argparse.ArgumentParser(description='Backfill the staging tables with a range of seasons, resuming an interrupted run.')
+parser.add_argument('--start-year', type=int, required=True,
+                    help='The first season to backfill.')
+parser.add_argument('--end-year', type=int, default=None,
+                    help='The last season to backfill (default is the start year).')
+parser.add_argument('--sessions', nargs='+', default=['R', 'Qualifying', 'Sprint'], choices=['R', 'Qualifying', 'Sprint'],
+                    help='The session types to backfill.')
+parser.add_argument('--parallel', type=int, default=1,
+                    help='The number of seasons to load at the same time, each in its own process.')
+parser.add_argument('--workers', type=int, default=None,
+                    help='The number of sessions of a season to load at the same time.')
+parser.add_argument('--profile', default='laps_results', choices=list(LOAD_PROFILES),
+                    help='The fastf1 load profile, decides which session data is parsed.')
+parser.add_argument('--standings', default='incremental', choices=['incremental', 'full'],
+                    help='Roll the persisted standings forward or rebuild them from the full history.')
+parser.add_argument('--checkpoints', default=None,
+                    help='The directory of the per session checkpoints (default is ../Data/cache/backfill).')
+parser.add_argument('--keep-checkpoints', action='store_true',
+                    help='Keep the checkpoints of the merged seasons instead of removing them.')
+parser.add_argument('--no-snapshots', action='store_true',
+                    help='Load every session with fastf1 instead of reading and writing the session snapshots.')
+parser.add_argument('--instrument', action='store_true',
+                    help='Measure the time, memory and rows of every step and log a summary table at the end.')
+parser.add_argument('--instrument-json', default=None,
+                    help='Also append every measurement to this file as a JSON line.')
+args = parser.parse_args()
+
+if args.instrument or args.instrument_json:
+    enable_instrumentation(args.instrument_json)
+
+current_dir = os.getcwd()
+cache_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'cache'))
+checkpoint_path = args.checkpoints or os.path.join(cache_path, 'backfill')
+ff1.Cache.enable_cache(cache_path)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger('fastf1').setLevel(logging.WARNING)
+
+end_year = args.end_year if args.end_year is not None else args.start_year
+years = list(range(args.start_year, end_year + 1))
+
+# Recovers an interrupted commit before anything is loaded
+store = get_store()
+transaction = StagingTransaction(store)
+
+# Every session is checkpointed as soon as it is loaded, a failed season is resumed by the next run
+loaded = {}
+failed = []
+if args.parallel <= 1:
+    for year in years:
+        try:
+            loaded[year] = backfill_season(year, args.sessions, checkpoint_path, args.workers, args.profile, not args.no_snapshots)
+        except Exception as e:
+            logging.error(f'Could not backfill {year}: {e}')
+            failed.append(year)
+else:
+    with ProcessPoolExecutor(max_workers=args.parallel) as pool:
+        futures = {pool.submit(backfill_season, year, args.sessions, checkpoint_path, args.workers, args.profile, not args.no_snapshots): year for year in years}
+        for future in as_completed(futures):
+            year = futures[future]
+            try:
+                loaded[year] = future.result()
+                logging.info(f'Loaded {year}')
+            except Exception as e:
+                logging.error(f'Could not backfill {year}: {e}')
+                failed.append(year)
+
+# Merge the seasons in chronological order so the new ids follow the calendar
+merged_years = sorted(loaded)
+if merged_years:
+    schedule = pd.concat([loaded[year][0] for year in merged_years], ignore_index=True)
+    sessions = {}
+    for racetype in args.sessions:
+        frames = [loaded[year][1][racetype] for year in merged_years if not loaded[year][1][racetype][1].empty]
+        sessions[racetype] = (pd.concat([laps for laps, _ in frames], ignore_index=True),
+                              pd.concat([results for _, results in frames], ignore_index=True)) if frames else (pd.DataFrame(), pd.DataFrame())
+
+    stage_sessions(transaction, sessions, schedule, standings=args.standings)
+    transaction.commit()
+    logging.info(f"Backfilled {', '.join(str(year) for year in merged_years)}")
+
+    # The merged sessions are in the watermark now, their checkpoints are not needed anymore
+    if not args.keep_checkpoints:
+        for year in merged_years:
+            shutil.rmtree(os.path.join(checkpoint_path, str(year)), ignore_errors=True)
+
+log_instrumentation_summary()
+
+if failed:
+    logging.error(f"Seasons left to backfill, rerun to resume them: {', '.join(str(year) for year in sorted(failed))}")
+    sys.exit(1)
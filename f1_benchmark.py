@@ -0,0 +1,52 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from my_functions.benchmarks import BENCHMARK_SEASONS, benchmark_report, compare_reports, run_benchmarks, save_report
+
+parser = argparse.ArgumentParser(description='Benchmark the update and preparation code on synthetic data.')
+parser.add_argument('--seasons', type=int, nargs='+', default=list(BENCHMARK_SEASONS),
+                    help='The sizes of the staged history to benchmark, in seasons.')
+parser.add_argument('--repeats', type=int, default=3,
+                    help='The number of timed runs per benchmark.')
+parser.add_argument('--output', default=None,
+                    help='The JSON report (default is ../Data/Benchmarks/benchmark_<timestamp>.json).')
+parser.add_argument('--baseline', default=None,
+                    help='A previous report, the run fails when a benchmark regressed against it.')
+parser.add_argument('--tolerance', type=float, default=0.25,
+                    help='The allowed relative increase of time and memory against the baseline.')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+current_dir = os.getcwd()
+output_path = args.output or os.path.normpath(os.path.join(current_dir, '..', 'Data', 'Benchmarks',
+                                                           f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+
+# The synthetic staging tables only live for the duration of the run
+work_path = tempfile.mkdtemp(prefix='f1_benchmark_')
+try:
+    measurements = []
+    for seasons in args.seasons:
+        measurements.extend(run_benchmarks(seasons, work_path, repeats=args.repeats))
+finally:
+    shutil.rmtree(work_path, ignore_errors=True)
+
+report = benchmark_report(measurements)
+save_report(report, output_path)
+
+for measurement in measurements:
+    logging.info(f"{measurement['benchmark']:<36} {measurement['seasons']:>3} seasons  "
+                 f"{measurement['wall_seconds_median']:8.3f} s  {measurement['peak_memory_mb']:8.1f} MB")
+
+if args.baseline is not None:
+    with open(args.baseline) as f:
+        regressions = compare_reports(report, json.load(f), args.tolerance)
+    for regression in regressions:
+        logging.error(f'Regression: {regression}')
+    if regressions:
+        sys.exit(1)
@@ -1,8 +1,32 @@
+import argparse
 import fastf1 as ff1
 import logging
-from my_functions.update_functions import ff1_retriever, Dim_Updater, load_dimension_tables, add_new_entries, update_qualifying, update_standings, update_laps, update_results
+from my_functions.instrumentation import enable_instrumentation, log_instrumentation_summary
+from my_functions.storage import get_store
+from my_functions.update_functions import LOAD_PROFILES, ff1_multi_retriever, get_event_schedule, mark_ingested, staged_rounds, update_dimension_tables, add_new_entries, update_qualifying, update_standings, update_standings_incremental, update_laps, update_results
 import os
-import pandas as pd
+
+parser = argparse.ArgumentParser(description='Update the staging tables with the latest fastf1 sessions.')
+parser.add_argument('--year', type=int, default=2024,
+                    help='The season to update, use f1_backfill.py for a range of seasons.')
+parser.add_argument('--profile', default='laps_results', choices=list(LOAD_PROFILES),
+                    help='The fastf1 load profile, decides which session data is parsed.')
+parser.add_argument('--workers', type=int, default=None,
+                    help='The number of sessions to load at the same time.')
+parser.add_argument('--executor', default='thread', choices=['thread', 'process'],
+                    help='The kind of worker pool used when --workers is given.')
+parser.add_argument('--standings', default='incremental', choices=['incremental', 'full'],
+                    help='Roll the persisted standings forward or rebuild them from the full history.')
+parser.add_argument('--no-snapshots', action='store_true',
+                    help='Load every session with fastf1 instead of reading and writing the session snapshots.')
+parser.add_argument('--instrument', action='store_true',
+                    help='Measure the time, memory and rows of every step and log a summary table at the end.')
+parser.add_argument('--instrument-json', default=None,
+                    help='Also append every measurement to this file as a JSON line.')
+args = parser.parse_args()
+
+if args.instrument or args.instrument_json:
+    enable_instrumentation(args.instrument_json)
 
 current_dir = os.getcwd()
 cache_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'cache'))
@@ -12,46 +36,56 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logging.getLogger('fastf1').setLevel(logging.WARNING)
 
 # Get the schedule of a given year
-schedule = ff1.get_event_schedule(2024)
+schedule = get_event_schedule(args.year, snapshots=not args.no_snapshots)
 
 # Retrieve lap data and results data 
-R_laps, R_results = ff1_retriever(2024, 'R')
-_, Q_results = ff1_retriever(2024, 'Qualifying')
-Sprint_laps, Sprint_results = ff1_retriever(2024, 'Sprint')
-
-dim_drivers, dim_constructors, dim_races = load_dimension_tables()
-
-updater = Dim_Updater(dim_drivers)
-updater.update_drivers(R_results)
-
-updater = Dim_Updater(dim_constructors)
-updater.update_constructors(R_results)
-
-updater = Dim_Updater(dim_races)
-updater.update_races(schedule)
-
-add_new_entries('qualifying.csv', update_qualifying(Q_results))
-
-R_laps, fastest_laps, laps_driven = update_laps(R_laps)
-R_results = update_results(R_results, fastest_laps, laps_driven)
-
-add_new_entries('results.csv', R_results, index_label = 'resultId')
-add_new_entries('lap_times.csv', R_laps, index_label = None)
-
-Sprint_laps, fastest_laps, laps_driven = update_laps(Sprint_laps)
-Sprint_results = update_results(Sprint_results, fastest_laps, laps_driven)
-
-add_new_entries('sprint_results.csv', Sprint_results, index_label = 'resultId')
-
-current_dir = os.getcwd()
-staging_path = os.path.join(current_dir, '..', 'Data', 'Staging')
-staging_path = os.path.normpath(staging_path)
-
-results = pd.read_csv(os.path.join(staging_path, 'results.csv'), on_bad_lines='skip', header=0, delimiter=',', index_col='resultId')
-races = pd.read_csv(os.path.join(staging_path, 'races.csv'), on_bad_lines='skip', header=0, delimiter=',')
-sprint_results = pd.read_csv(os.path.join(staging_path, 'sprint_results.csv'), on_bad_lines='skip', header=0, delimiter=',', index_col='resultId')
-
-driverpoint_df, constructorpoints_df = update_standings(results, sprint_results, races)
-
-add_new_entries('driver_standings.csv', driverpoint_df, index_label='driverStandingsId', staging_path= staging_path)
-add_new_entries('constructor_standings.csv', constructorpoints_df, index_label='constructorStandingsId', staging_path= staging_path)
\ No newline at end of file
+sessions = ff1_multi_retriever(args.year, ['R', 'Qualifying', 'Sprint'], workers=args.workers, executor=args.executor, schedule=schedule, profile=args.profile,
+                               snapshots=not args.no_snapshots)
+R_laps, R_results = sessions['R']
+_, Q_results = sessions['Qualifying']
+Sprint_laps, Sprint_results = sessions['Sprint']
+
+# Add new drivers, constructors and races, writing each changed table once
+drivers_data = R_results if not R_results.empty else None
+update_dimension_tables(drivers_data, drivers_data, schedule)
+
+if not Q_results.empty:
+    qualifying = update_qualifying(Q_results)
+    add_new_entries('qualifying.csv', qualifying)
+    mark_ingested(args.year, 'Qualifying', staged_rounds(Q_results, qualifying, 'Qualifying')['RoundNumber'])
+
+if not R_results.empty:
+    R_laps, fastest_laps, laps_driven = update_laps(R_laps)
+    staged_results = update_results(R_results, fastest_laps, laps_driven)
+
+    add_new_entries('results.csv', staged_results, index_label = 'resultId')
+    add_new_entries('lap_times.csv', R_laps, index_label = None)
+    # Rounds dropped while staging stay out of the watermark and are fetched again
+    mark_ingested(args.year, 'R', staged_rounds(R_results, staged_results, 'R')['RoundNumber'])
+
+if not Sprint_results.empty:
+    Sprint_laps, fastest_laps, laps_driven = update_laps(Sprint_laps)
+    staged_results = update_results(Sprint_results, fastest_laps, laps_driven)
+
+    add_new_entries('sprint_results.csv', staged_results, index_label = 'resultId')
+    mark_ingested(args.year, 'Sprint', staged_rounds(Sprint_results, staged_results, 'Sprint')['RoundNumber'])
+
+store = get_store()
+
+races = store.read('races.csv')
+
+if args.standings == 'incremental':
+    # Standings restart every season, so only the current season is needed to roll them forward
+    results = store.read('results.csv', index_col='resultId', years=[args.year])
+    sprint_results = store.read('sprint_results.csv', index_col='resultId', years=[args.year])
+    driver_standings = store.read('driver_standings.csv', index_col='driverStandingsId', years=[args.year])
+    driverpoint_df, constructorpoints_df = update_standings_incremental(results, sprint_results, races, driver_standings)
+else:
+    results = store.read('results.csv', index_col='resultId')
+    sprint_results = store.read('sprint_results.csv', index_col='resultId')
+    driverpoint_df, constructorpoints_df = update_standings(results, sprint_results, races)
+
+add_new_entries('driver_standings.csv', driverpoint_df, index_label='driverStandingsId', staging_path= store.root)
+add_new_entries('constructor_standings.csv', constructorpoints_df, index_label='constructorStandingsId', staging_path= store.root)
+
+log_instrumentation_summary()
@@ -0,0 +1,65 @@
+import argparse
+import fastf1 as ff1
+import logging
+from my_functions.instrumentation import enable_instrumentation, log_instrumentation_summary
+from my_functions.preparation_stages import preparation_graph, write_prepared_data
+from my_functions.storage import StagingTransaction, get_store
+from my_functions.update_functions import LOAD_PROFILES, ff1_multi_retriever, get_event_schedule, stage_sessions
+import os
+
+parser = argparse.ArgumentParser(description='Update the staging tables, the standings and the prepared data in one process.')
+parser.add_argument('--year', type=int, default=2024,
+                    help='The season to update.')
+parser.add_argument('--profile', default='laps_results', choices=list(LOAD_PROFILES),
+                    help='The fastf1 load profile, decides which session data is parsed.')
+parser.add_argument('--workers', type=int, default=None,
+                    help='The number of sessions to load at the same time.')
+parser.add_argument('--executor', default='thread', choices=['thread', 'process'],
+                    help='The kind of worker pool used when --workers is given.')
+parser.add_argument('--standings', default='incremental', choices=['incremental', 'full'],
+                    help='Roll the persisted standings forward or rebuild them from the full history.')
+parser.add_argument('--skip-preparation', action='store_true',
+                    help='Only update the staging tables.')
+parser.add_argument('--no-snapshots', action='store_true',
+                    help='Load every session with fastf1 instead of reading and writing the session snapshots.')
+parser.add_argument('--full-skills', action='store_true',
+                    help='Compute the skill features over the full history instead of only for the races after the saved skill feature state.')
+parser.add_argument('--instrument', action='store_true',
+                    help='Measure the time, memory and rows of every step and log a summary table at the end.')
+parser.add_argument('--instrument-json', default=None,
+                    help='Also append every measurement to this file as a JSON line.')
+args = parser.parse_args()
+
+if args.instrument or args.instrument_json:
+    enable_instrumentation(args.instrument_json)
+
+current_dir = os.getcwd()
+cache_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'cache'))
+prepared_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'Prepared'))
+ff1.Cache.enable_cache(cache_path)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger('fastf1').setLevel(logging.WARNING)
+
+# Every change is kept in memory and written to Staging in a single commit at the end
+store = get_store()
+transaction = StagingTransaction(store)
+
+schedule = get_event_schedule(args.year, snapshots=not args.no_snapshots)
+
+sessions = ff1_multi_retriever(args.year, ['R', 'Qualifying', 'Sprint'], workers=args.workers, executor=args.executor, schedule=schedule, profile=args.profile,
+                                snapshots=not args.no_snapshots)
+stage_sessions(transaction, sessions, schedule, standings=args.standings)
+
+# Hand the tables the preparation reads in full over in memory, only the lap times are streamed from Staging
+frames = None
+if not args.skip_preparation:
+    frames = {name: transaction.read(name) for name in ['results', 'driver_standings', 'constructor_standings', 'drivers', 'constructors', 'races']}
+
+transaction.commit()
+
+if not args.skip_preparation:
+    graph = preparation_graph(store, os.path.join(prepared_path, '.stage_cache'))
+    write_prepared_data(graph, get_store(prepared_path), frames=frames, full=args.full_skills)
+
+log_instrumentation_summary()
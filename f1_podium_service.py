@@ -0,0 +1,142 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from my_functions.prediction import PodiumPredictor, save_model, train_podium_model
+from my_functions.storage import get_store
+
+parser = argparse.ArgumentParser(description='Score the podium chances of the field of an upcoming race from the prepared data kept in memory.')
+action = parser.add_mutually_exclusive_group()
+action.add_argument('--train', action='store_true',
+                    help="Train the placeholder logistic podium model on the prepared data, save it and exit. "
+                         "It is not the notebook's LSTM, see the README to serve another model.")
+action.add_argument('--batch', default=None,
+                    help='Score a CSV with raceId, driverId and grid columns and exit instead of serving.')
+parser.add_argument('--output', default=None,
+                    help='The CSV the batch predictions are written to (default is writing them to stdout as JSON, '
+                         'in the format of the /predict_batch response).')
+parser.add_argument('--model', default=None,
+                    help='The pickled podium model (default is ../Data/Models/podium_model.pkl).')
+parser.add_argument('--host', default='127.0.0.1',
+                    help='The address the service listens on.')
+parser.add_argument('--port', type=int, default=8050,
+                    help='The port the service listens on.')
+parser.add_argument('--reload-interval', type=float, default=5.0,
+                    help='The seconds between checks for new staging data, prepared data or a new model.')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+current_dir = os.getcwd()
+prepared_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'Prepared'))
+model_path = args.model or os.path.normpath(os.path.join(current_dir, '..', 'Data', 'Models', 'podium_model.pkl'))
+prepared_store = get_store(prepared_path)
+
+if args.train:
+    save_model(train_podium_model(prepared_store.read('F1_prepared')), model_path)
+    logging.info(f'Saved the placeholder podium model to {model_path}')
+    sys.exit(0)
+
+predictor = PodiumPredictor(get_store(), prepared_store, model_path)
+
+if args.batch is not None:
+    predictions = predictor.predict_batch(pd.read_csv(args.batch))
+    if args.output is not None:
+        predictions.to_csv(args.output, index=False)
+        logging.info(f'Wrote {len(predictions)} predictions to {args.output}')
+    else:
+        # Machine readable output for piping, the log messages go to stderr
+        json.dump({'predictions': predictions.to_dict(orient='records')}, sys.stdout, default=str)
+        sys.stdout.write('\n')
+    sys.exit(0)
+
+def watch_sources():
+    """
+    Reloads the parts of the predictor whose source changed, keeping the loaded parts when a reload fails.
+    """
+    while True:
+        time.sleep(args.reload_interval)
+        try:
+            predictor.refresh()
+        except Exception as e:
+            logging.warning(f'Could not reload, still serving the loaded data: {e}')
+
+def grid_requests(race_id, grid):
+    """
+    Turns the grid of a race from a JSON request into rows of the batch API.
+
+    Parameters:
+        race_id (int): The raceId of the race.
+        grid (dict): The grid position per driverId, the keys are strings in JSON.
+
+    Returns:
+        pd.DataFrame: The raceId, driverId and grid of every driver.
+    """
+    return pd.DataFrame({'raceId': int(race_id), 'driverId': [int(driver_id) for driver_id in grid], 'grid': [float(position) for position in grid.values()]})
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    Answers the JSON requests of the prediction service.
+
+    GET /health returns the signatures of the loaded parts, POST /predict scores
+    {"raceId": ..., "grid": {driverId: position}}, POST /predict_batch scores
+    {"requests": [...]} of those and POST /refresh reloads the changed parts now.
+    """
+
+    def _respond(self, status, body):
+        """
+        Sends a JSON response.
+        """
+        payload = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._respond(200, {'status': 'ok', 'signatures': predictor.signatures()})
+        else:
+            self._respond(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/predict':
+                predictions = predictor.predict(int(body['raceId']), {int(driver_id): float(position) for driver_id, position in body['grid'].items()})
+                response = {'raceId': int(body['raceId']), 'predictions': predictions.to_dict(orient='records')}
+            elif self.path == '/predict_batch':
+                requests = pd.concat([grid_requests(request['raceId'], request['grid']) for request in body['requests']], ignore_index=True)
+                response = {'predictions': predictor.predict_batch(requests).to_dict(orient='records')}
+            elif self.path == '/refresh':
+                response = {'reloaded': predictor.refresh()}
+            else:
+                self._respond(404, {'error': f'Unknown path {self.path}'})
+                return
+        except KeyError as e:
+            self._respond(404, {'error': e.args[0] if e.args else str(e)})
+            return
+        except (ValueError, TypeError, AttributeError) as e:
+            self._respond(400, {'error': f'Invalid request: {e}'})
+            return
+        response['milliseconds'] = round((time.perf_counter() - start) * 1000, 3)
+        self._respond(200, response)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+threading.Thread(target=watch_sources, daemon=True).start()
+server = ThreadingHTTPServer((args.host, args.port), PredictionHandler)
+logging.info(f'Serving podium predictions on http://{args.host}:{args.port}')
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    server.server_close()
@@ -0,0 +1,48 @@
+import argparse
+import fastf1 as ff1
+import logging
+import os
+import sys
+from my_functions.snapshots import get_snapshot_path, invalidate_snapshots, list_snapshots
+from my_functions.update_functions import LOAD_PROFILES, refresh_snapshots
+
+parser = argparse.ArgumentParser(description='List, invalidate or refresh the per session snapshots in front of fastf1.')
+parser.add_argument('command', choices=['list', 'invalidate', 'refresh'],
+                    help='list the snapshots, invalidate them so the next update loads the sessions from fastf1, '
+                         'or refresh them from fastf1 right away. The staging tables are not changed.')
+parser.add_argument('--year', type=int, default=None,
+                    help='The season, required to invalidate or refresh.')
+parser.add_argument('--rounds', type=int, nargs='+', default=None,
+                    help='The rounds (default is every round, invalidating every round also removes the schedule).')
+parser.add_argument('--sessions', nargs='+', default=['R', 'Qualifying', 'Sprint'], choices=['R', 'Qualifying', 'Sprint'],
+                    help='The session types.')
+parser.add_argument('--workers', type=int, default=None,
+                    help='The number of sessions to refresh at the same time.')
+parser.add_argument('--profile', default='laps_results', choices=list(LOAD_PROFILES),
+                    help='The fastf1 load profile used to refresh.')
+args = parser.parse_args()
+
+current_dir = os.getcwd()
+cache_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'cache'))
+snapshot_path = get_snapshot_path()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger('fastf1').setLevel(logging.WARNING)
+
+if args.command != 'list' and args.year is None:
+    parser.error(f'{args.command} needs --year')
+
+if args.command == 'list':
+    snapshots = list_snapshots(snapshot_path, args.year)
+    if args.rounds is not None:
+        snapshots = snapshots[snapshots['round'].isin(args.rounds)]
+    logging.info(f"{len(snapshots)} snapshots, {snapshots['bytes'].sum() / 2 ** 20:.2f} MB:\n{snapshots.to_string(index=False)}")
+elif args.command == 'invalidate':
+    removed = invalidate_snapshots(snapshot_path, args.year, args.rounds, args.sessions)
+    logging.info(f'Removed {removed} snapshots of {args.year}')
+else:
+    ff1.Cache.enable_cache(cache_path)
+    refreshed = refresh_snapshots(args.year, args.sessions, args.rounds, args.workers, args.profile)
+    logging.info(f'Refreshed {refreshed} snapshots of {args.year}')
+    if refreshed == 0:
+        sys.exit(1)
@@ -0,0 +1,57 @@
+import argparse
+import json
+import logging
+import os
+from my_functions.sequence_dataset import SequenceDataset
+from my_functions.storage import get_store
+from my_functions.tuning import DEFAULT_GRIDS, default_factory, walk_forward_search
+
+parser = argparse.ArgumentParser(description='Tune the podium model on walk-forward folds across a pool of processes.')
+parser.add_argument('--grid', default=None,
+                    help="The values to try per parameter as JSON, passed to the model factory (default is the notebook's grid for the LSTM).")
+parser.add_argument('--model', default=None,
+                    help="The model factory as 'module:function', building a model with fit and predict_proba on a SequenceDataset "
+                         "(default is the notebook's LSTM, the logistic baseline when Keras is not installed).")
+parser.add_argument('--window', type=int, default=20,
+                    help='The number of races per sequence.')
+parser.add_argument('--splits', type=int, default=3,
+                    help='The number of walk-forward folds.')
+parser.add_argument('--first-year', type=int, default=1991,
+                    help='The first season of the sequences, by their last race.')
+parser.add_argument('--last-year', type=int, default=2022,
+                    help='The last season of the sequences, by their last race.')
+parser.add_argument('--workers', type=int, default=None,
+                    help='The number of processes, 1 evaluates in this process (default is one per CPU).')
+parser.add_argument('--abandon-margin', type=float, default=None,
+                    help='Abandon a configuration trailing the best one by more than this precision over the same folds.')
+parser.add_argument('--report', default=None,
+                    help='The CSV of the summary per configuration (default is ../Data/Prepared/tuning_report.csv), '
+                         'the precision per race is written next to it.')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+factory = args.model or default_factory()
+if args.grid is None and factory not in DEFAULT_GRIDS:
+    parser.error(f'--grid is required for the model {factory}')
+grid = json.loads(args.grid) if args.grid is not None else DEFAULT_GRIDS[factory]
+
+current_dir = os.getcwd()
+prepared_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'Prepared'))
+dataset_path = os.path.join(prepared_path, '.sequences', f'window_{args.window}')
+report_path = args.report or os.path.join(prepared_path, 'tuning_report.csv')
+
+# The workers memory-map the saved sequences, an unchanged dataset keeps its fingerprint and the cached folds stay valid
+dataset = SequenceDataset.from_prepared(get_store(prepared_path).read('F1_prepared'), window=args.window)
+dataset = dataset.between_years(args.first_year, args.last_year)
+dataset.save(dataset_path)
+logging.info(f'Saved {len(dataset)} sequences of {args.window} races to {dataset_path}')
+
+summary, races = walk_forward_search(dataset_path, grid, factory=factory, n_splits=args.splits, workers=args.workers,
+                                     cache_path=os.path.join(prepared_path, '.tuning_cache'), abandon_margin=args.abandon_margin)
+
+summary.to_csv(report_path, index=False)
+races.to_csv(os.path.join(os.path.dirname(report_path), 'tuning_race_precision.csv'), index=False)
+logging.info(f'Search results:\n{summary.to_string(index=False)}')
+if not summary.empty:
+    logging.info(f"Best configuration {summary.loc[0, 'params']} with a podium precision of {summary.loc[0, 'mean_precision']:.3f}")
@@ -0,0 +1,223 @@
+import copy
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from my_functions.preparation_stages import preparation_graph
+from my_functions.storage import get_store, load_key_index
+from my_functions.synthetic_data import make_fastf1_season, make_staging_tables
+from my_functions.update_functions import (Dim_Updater, add_new_entries, build_dimension_lookups, load_event_session, update_laps,
+                                           update_qualifying, update_results, update_standings, update_standings_incremental)
+
+BENCHMARK_SEASONS = (1, 10, 75)
+
+def measure(function, setup=None, repeats=3):
+    """
+    Times a function and measures its peak memory use.
+
+    The function is timed repeats times without tracing and then run once more
+    under tracemalloc, which sees the allocations of Python, numpy and pandas
+    but not those of pyarrow. The setup is called before every run and is not measured.
+
+    Parameters:
+        function (callable): The function to measure, called with the arguments returned by setup.
+        setup (callable, optional): Returns the arguments of the function as a tuple (default is None, no arguments).
+        repeats (int): The number of timed runs (default is 3).
+
+    Returns:
+        tuple: The measurements as a dictionary and the output of the last run.
+    """
+    timings = []
+    for _ in range(repeats):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        output = function(*args)
+        timings.append(time.perf_counter() - start)
+
+    args = setup() if setup is not None else ()
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    rows = output[0] if isinstance(output, tuple) else output
+    return {
+        'wall_seconds_min': min(timings),
+        'wall_seconds_median': statistics.median(timings),
+        'peak_memory_mb': peak / 2 ** 20,
+        'rows_out': len(rows) if isinstance(rows, pd.DataFrame) else None,
+        'repeats': repeats
+    }, output
+
+def write_staging_tables(tables, root):
+    """
+    Writes generated staging tables to a store, the dimension tables first.
+
+    Parameters:
+        tables (dict): The tables from make_staging_tables.
+        root (str): The staging directory.
+
+    Returns:
+        CsvStore or ParquetStore: The store, its backend comes from F1_STORAGE_BACKEND.
+    """
+    store = get_store(root)
+    for name in ['races', 'drivers', 'constructors'] + [name for name in tables if name not in ('races', 'drivers', 'constructors')]:
+        store.write(name, tables[name])
+    return store
+
+def run_benchmarks(seasons, work_path, repeats=3, seed=0):
+    """
+    Runs the benchmark suite on synthetic data of the given number of seasons.
+
+    The staged history has the given number of seasons and one new fastf1 season
+    is processed on top of it, like a production refresh.
+
+    Parameters:
+        seasons (int): The number of seasons in the staged history.
+        work_path (str): The directory the synthetic staging tables are written to.
+        repeats (int): The number of timed runs per benchmark (default is 3).
+        seed (int): The seed of the synthetic data (default is 0).
+
+    Returns:
+        list: The measurements of every benchmark.
+    """
+    logging.info(f'Generating {seasons} seasons of synthetic data')
+    tables = make_staging_tables(seasons, seed=seed)
+    root = os.path.join(work_path, f'seasons_{seasons}', 'Staging')
+    store = write_staging_tables(tables, root)
+    new_year = int(tables['races']['year'].max()) + 1
+    schedule, events = make_fastf1_season(new_year, tables['drivers'], tables['constructors'], seed=seed)
+
+    measurements = []
+
+    def record(name, function, setup=None):
+        logging.info(f'Benchmarking {name} on {seasons} seasons')
+        result, output = measure(function, setup, repeats)
+        measurements.append({'benchmark': name, 'seasons': seasons, **result})
+        return output
+
+    # Update: post-processing of the loaded sessions, as done by ff1_retriever
+    def retrieve():
+        sessions = [load_event_session(event, 'R') for event in events]
+        return pd.concat([laps for laps, _ in sessions], ignore_index=True), pd.concat([results for _, results in sessions], ignore_index=True)
+    R_laps, R_results = record('ff1_retriever_postprocessing', retrieve)
+
+    def update_dimensions():
+        return (Dim_Updater(tables['drivers']).update_drivers(R_results, write=False),
+                Dim_Updater(tables['constructors']).update_constructors(R_results, write=False),
+                Dim_Updater(tables['races']).update_races(schedule.copy(), write=False))
+    drivers, constructors, races = record('dim_updater', update_dimensions)
+    lookups = {**build_dimension_lookups('drivers', drivers), **build_dimension_lookups('constructors', constructors),
+               **build_dimension_lookups('races', races)}
+
+    laps, fastest_laps, laps_driven = record('update_laps', lambda: update_laps(R_laps, lookups))
+    results = record('update_results', lambda: update_results(R_results, fastest_laps, laps_driven, lookups))
+    record('update_qualifying', lambda: update_qualifying(R_results, lookups))
+
+    record('update_standings', lambda: update_standings(tables['results'], tables['sprint_results'], tables['races']))
+
+    # Roll the last five races of the history forward from the standings before them
+    last_season = tables['races'][tables['races']['year'] == new_year - 1]
+    rolled_races = last_season['raceId'].iloc[-5:]
+    season_results = tables['results'][tables['results']['raceId'].isin(last_season['raceId'])]
+    season_sprints = tables['sprint_results'][tables['sprint_results']['raceId'].isin(last_season['raceId'])]
+    season_standings = tables['driver_standings'][tables['driver_standings']['raceId'].isin(last_season['raceId'])
+                                                  & ~tables['driver_standings']['raceId'].isin(rolled_races)]
+    record('update_standings_incremental',
+           lambda: update_standings_incremental(season_results, season_sprints, tables['races'], season_standings))
+
+    # Appending the new season to the staged history, the table is restored before every run
+    for name, new_data, index_label in [('results', results, 'resultId'), ('lap_times', laps, None)]:
+        def restore(name=name, index_label=index_label):
+            data = tables[name].set_index(index_label) if index_label else tables[name]
+            store.write(name, data, index_label=index_label)
+            load_key_index(store, name, index_label=index_label)
+            return ()
+        record(f'add_new_entries_{name}', lambda name=name, new_data=new_data, index_label=index_label:
+               add_new_entries(name, new_data, staging_path=root, index_label=index_label), restore)
+        restore()
+
+    # Preparation: every stage of f1_data_preparation.py, including reading its tables
+    graph = preparation_graph(store, os.path.join(work_path, f'seasons_{seasons}', 'stage_cache'))
+    outputs = {}
+    for stage in graph.stages.values():
+        def run_stage(upstream, stage=stage):
+            kwargs = dict(upstream)
+            for table, columns in stage.tables.items():
+                if stage.chunksize:
+                    kwargs[table] = store.iter_chunks(table, columns=columns, chunksize=stage.chunksize)
+                else:
+                    kwargs[table] = store.read(table, columns=columns)
+            return stage.function(**kwargs, **stage.params)
+        upstream_setup = lambda stage=stage: ({argument: copy.deepcopy(outputs[upstream]) for argument, upstream in stage.depends.items()},)
+        outputs[stage.name] = record(f'preparation_{stage.name}', run_stage, upstream_setup)
+
+    return measurements
+
+def benchmark_report(measurements):
+    """
+    Builds the machine readable benchmark report.
+
+    Parameters:
+        measurements (list): The measurements from run_benchmarks.
+
+    Returns:
+        dict: The report with the environment and the measurements.
+    """
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'storage_backend': os.environ.get('F1_STORAGE_BACKEND', 'csv')
+        },
+        'measurements': measurements
+    }
+
+def save_report(report, file_path):
+    """
+    Saves a benchmark report as JSON.
+
+    Parameters:
+        report (dict): The report from benchmark_report.
+        file_path (str): The path of the JSON file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f'Saved the benchmark report to {file_path}')
+
+def compare_reports(report, baseline, tolerance=0.25):
+    """
+    Finds the benchmarks that got slower or use more memory than in a baseline report.
+
+    Parameters:
+        report (dict): The new report.
+        baseline (dict): The baseline report.
+        tolerance (float): The allowed relative increase (default is 0.25).
+
+    Returns:
+        list: A description of every regression, empty if there are none.
+    """
+    baseline_measurements = {(measurement['benchmark'], measurement['seasons']): measurement for measurement in baseline['measurements']}
+    regressions = []
+    for measurement in report['measurements']:
+        previous = baseline_measurements.get((measurement['benchmark'], measurement['seasons']))
+        if previous is None:
+            continue
+        for metric in ['wall_seconds_median', 'peak_memory_mb']:
+            if measurement[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{measurement['benchmark']} on {measurement['seasons']} seasons: "
+                                   f"{metric} went from {previous[metric]:.3f} to {measurement[metric]:.3f}")
+    return regressions
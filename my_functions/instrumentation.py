@@ -0,0 +1,211 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module, the peak RSS is not reported there
+    resource = None
+
+# Instrumentation is off unless enabled, the environment variables also switch it on in worker processes
+_STATE = {
+    'enabled': os.environ.get('F1_INSTRUMENTATION', '') not in ('', '0'),
+    'json_path': os.environ.get('F1_INSTRUMENTATION_JSON') or None,
+    'records': []
+}
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+def enable_instrumentation(json_path=None):
+    """
+    Switches the instrumentation on for this process and the worker processes it starts.
+
+    Parameters:
+        json_path (str, optional): A file every measurement is appended to as a JSON line (default is None).
+    """
+    _STATE['enabled'] = True
+    _STATE['json_path'] = json_path
+    os.environ['F1_INSTRUMENTATION'] = '1'
+    if json_path is not None:
+        os.environ['F1_INSTRUMENTATION_JSON'] = json_path
+
+def disable_instrumentation():
+    """
+    Switches the instrumentation off and forgets the collected measurements.
+    """
+    _STATE['enabled'] = False
+    _STATE['json_path'] = None
+    _STATE['records'] = []
+    os.environ.pop('F1_INSTRUMENTATION', None)
+    os.environ.pop('F1_INSTRUMENTATION_JSON', None)
+
+def is_instrumentation_enabled():
+    """
+    Checks whether the instrumentation is on.
+
+    Returns:
+        bool: True if the instrumentation is on.
+    """
+    return _STATE['enabled']
+
+def _peak_rss_mb():
+    """
+    Retrieves the peak resident set size of the process so far.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def count_rows(*values):
+    """
+    Counts the rows of the dataframes among some values, also inside tuples, lists and dicts.
+
+    Parameters:
+        *values: The values to count.
+
+    Returns:
+        int: The total number of rows, None if there is no dataframe.
+    """
+    rows = None
+    for value in values:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            count = len(value)
+        elif isinstance(value, (tuple, list)):
+            count = count_rows(*value)
+        elif isinstance(value, dict):
+            count = count_rows(*value.values())
+        else:
+            count = None
+        if count is not None:
+            rows = (rows or 0) + count
+    return rows
+
+def _emit(record):
+    """
+    Keeps a measurement for the summary and writes it to the JSON lines file.
+    """
+    with _LOCK:
+        _STATE['records'].append(record)
+        if _STATE['json_path'] is not None:
+            with open(_STATE['json_path'], 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+@contextmanager
+def instrument_block(name, **fields):
+    """
+    Measures a block of code when the instrumentation is on.
+
+    The yielded dictionary is part of the measurement, set rows_in and rows_out
+    or any other field on it inside the block.
+
+    Parameters:
+        name (str): The name of the block.
+        **fields: Extra fields of the measurement, e.g. the table or the round.
+
+    Yields:
+        dict: The measurement, filled in when the block ends.
+    """
+    record = {'name': name, **fields}
+    if not _STATE['enabled']:
+        yield record
+        return
+
+    depth = getattr(_LOCAL, 'depth', 0)
+    _LOCAL.depth = depth + 1
+    peak_before = _peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        _LOCAL.depth = depth
+        peak_after = _peak_rss_mb()
+        record.update({
+            'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+            'wall_seconds': time.perf_counter() - wall_start,
+            'cpu_seconds': time.process_time() - cpu_start,
+            'peak_rss_mb': peak_after,
+            'peak_rss_growth_mb': None if peak_after is None else peak_after - peak_before,
+            'depth': depth,
+            'pid': os.getpid()
+        })
+        _emit(record)
+
+def instrumented(name=None, fields=None):
+    """
+    Decorates a function so every call is measured when the instrumentation is on.
+
+    The rows of the dataframes among the arguments and the return value are
+    counted as rows_in and rows_out. A disabled instrumentation only costs a
+    flag check per call.
+
+    Parameters:
+        name (str, optional): The name of the measurement (default is None, the qualified function name).
+        fields (callable, optional): Returns extra fields from the bound arguments of a call (default is None).
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(function):
+        measurement_name = name or function.__qualname__
+        signature = inspect.signature(function) if fields is not None else None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _STATE['enabled']:
+                return function(*args, **kwargs)
+            extra = {}
+            if fields is not None:
+                arguments = signature.bind(*args, **kwargs)
+                arguments.apply_defaults()
+                extra = fields(arguments.arguments)
+            with instrument_block(measurement_name, **extra) as record:
+                record['rows_in'] = count_rows(args, kwargs)
+                output = function(*args, **kwargs)
+                record['rows_out'] = count_rows(output)
+            return output
+        return wrapper
+    return decorator
+
+def instrumentation_summary():
+    """
+    Aggregates the measurements of this process by name.
+
+    Returns:
+        pd.DataFrame: The calls, total wall and CPU time, largest peak RSS growth and total rows per name,
+                      slowest first.
+    """
+    records = pd.DataFrame(_STATE['records'])
+    if records.empty:
+        return pd.DataFrame(columns=['calls', 'wall_seconds', 'cpu_seconds', 'peak_rss_growth_mb', 'rows_in', 'rows_out'])
+    for column in ['rows_in', 'rows_out', 'peak_rss_growth_mb']:
+        if column not in records.columns:
+            records[column] = None
+    summary = records.groupby('name').agg(calls=('name', 'size'),
+                                          wall_seconds=('wall_seconds', 'sum'),
+                                          cpu_seconds=('cpu_seconds', 'sum'),
+                                          peak_rss_growth_mb=('peak_rss_growth_mb', 'max'),
+                                          rows_in=('rows_in', lambda rows: rows.sum(min_count=1)),
+                                          rows_out=('rows_out', lambda rows: rows.sum(min_count=1)))
+    summary[['rows_in', 'rows_out']] = summary[['rows_in', 'rows_out']].astype('Int64')
+    return summary.sort_values('wall_seconds', ascending=False)
+
+def log_instrumentation_summary():
+    """
+    Logs the summary table of the measurements when the instrumentation is on.
+    """
+    if not _STATE['enabled']:
+        return
+    peak = _peak_rss_mb()
+    table = instrumentation_summary().to_string(float_format=lambda value: f'{value:.3f}')
+    logging.info(f'Instrumentation summary, peak RSS {peak if peak is None else round(peak, 1)} MB:\n{table}')
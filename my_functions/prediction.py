@@ -0,0 +1,447 @@
+import logging
+import os
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+
+# The model inputs in the order of the training notebook, the model sees them as columns of a float matrix
+MODEL_FEATURES = ['drivers_takeover_chance', 'grid_t1', 'grid', 'diff_grid_standing', 'teammates_driverstanding', 'overtakes_per_track_t1',
+                  'drivers_defense', 'driverstandings_wins', 'constructorstandings_wins', 'driverstandings_position', 'teammates_defense',
+                  'teammates_takeover_chance', 'date_diff', 'is_round_1', 'driverId', 'round']
+TARGET = 'results_position_t1'
+
+# The features that only exist once the next race is known, the rest is taken from the last race of a driver
+NEXT_RACE_FEATURES = ['grid_t1', 'overtakes_per_track_t1', 'diff_grid_standing']
+DRIVER_STATE_COLUMNS = [feature for feature in MODEL_FEATURES if feature not in NEXT_RACE_FEATURES + ['driverId']] + ['raceId', 'year', 'constructorId']
+
+class PredictionFeatureState:
+    """
+    A class holding everything the podium prediction of an upcoming race needs from the prepared data.
+
+    The prepared row of the last race of a driver holds all features of the next
+    race except the grid of that race and the overtakes at its circuit, so only
+    those rows and the grid to finish differences per circuit and season are kept.
+
+    Attributes:
+        drivers (pd.DataFrame): The DRIVER_STATE_COLUMNS of the last race of every driver, indexed by driverId.
+        circuits (pd.DataFrame): The sum and count of grid_end_diff per circuitId and year.
+    """
+
+    def __init__(self, drivers, circuits):
+        """
+        Initializes the PredictionFeatureState class.
+
+        Parameters:
+            drivers (pd.DataFrame): The last race of every driver as built by from_prepared.
+            circuits (pd.DataFrame): The grid to finish differences per circuit and season as built by from_prepared.
+        """
+        self.drivers = drivers
+        self.circuits = circuits
+
+    @classmethod
+    def from_prepared(cls, data):
+        """
+        Builds the state from the prepared data.
+
+        Parameters:
+            data (pd.DataFrame): The prepared data.
+
+        Returns:
+            PredictionFeatureState: The state after the last race in data.
+        """
+        drivers = (data.sort_values(['year', 'round'], kind='stable')
+                   .groupby('driverId').tail(1)
+                   .set_index('driverId')[DRIVER_STATE_COLUMNS]
+                   .sort_index())
+        circuits = data.groupby(['circuitId', 'year'])['grid_end_diff'].agg(['sum', 'count']).reset_index()
+        return cls(drivers, circuits)
+
+    @staticmethod
+    def table_names(name):
+        """
+        Retrieves the table names of a stored state.
+
+        Parameters:
+            name (str): The name of the state.
+
+        Returns:
+            tuple: The table names of the drivers and the circuits.
+        """
+        return f'{name}_drivers', f'{name}_circuits'
+
+    @classmethod
+    def signature(cls, store, name='prediction_feature_state'):
+        """
+        Retrieves a value that changes whenever the stored state is rewritten.
+
+        Parameters:
+            store (CsvStore, ParquetStore or SqliteStore): The store holding the state.
+            name (str): The name of the state (default is 'prediction_feature_state').
+
+        Returns:
+            tuple: The signatures of both tables.
+        """
+        return tuple(store.signature(table) for table in cls.table_names(name))
+
+    @classmethod
+    def load(cls, store, name='prediction_feature_state'):
+        """
+        Loads the state from a store, building it from F1_prepared when it was never saved.
+
+        Parameters:
+            store (CsvStore, ParquetStore or SqliteStore): The store holding the state.
+            name (str): The name of the state (default is 'prediction_feature_state').
+
+        Returns:
+            PredictionFeatureState: The stored state.
+        """
+        drivers_table, circuits_table = cls.table_names(name)
+        if not (store.exists(drivers_table) and store.exists(circuits_table)):
+            logging.info(f'No {name} in {store.root}, building it from F1_prepared')
+            return cls.from_prepared(store.read('F1_prepared'))
+        return cls(store.read(drivers_table, index_col='driverId'), store.read(circuits_table))
+
+    def save(self, store, name='prediction_feature_state'):
+        """
+        Saves the state to a store.
+
+        Parameters:
+            store (CsvStore, ParquetStore or SqliteStore): The store to write the state to.
+            name (str): The name of the state (default is 'prediction_feature_state').
+        """
+        drivers_table, circuits_table = self.table_names(name)
+        store.write(drivers_table, self.drivers, index_label='driverId')
+        store.write(circuits_table, self.circuits)
+
+    def overtakes_per_track(self, races):
+        """
+        Calculates the overtakes_per_track of upcoming races, the same value the preparation gives them.
+
+        Parameters:
+            races (pd.DataFrame): The races with circuitId and year.
+
+        Returns:
+            np.ndarray: The average grid to finish difference of the circuit over all earlier seasons, NaN without earlier seasons.
+        """
+        values = []
+        for circuit_id, year in zip(races['circuitId'], races['year']):
+            earlier = self.circuits[(self.circuits['circuitId'] == circuit_id) & (self.circuits['year'] < year)]
+            count = earlier['count'].sum()
+            values.append(earlier['sum'].sum() / count if count > 0 else np.nan)
+        return np.asarray(values, dtype='float64')
+
+class LogisticPodiumModel:
+    """
+    A logistic regression of the podium target on the model features, the placeholder model of the prediction service.
+
+    Missing features are filled with their training mean and all features are
+    standardized, the weights are fitted with an L2 penalty by Newton's method.
+    It is not the LSTM of the training notebook, which scores windows of earlier
+    races while the feature state only keeps the last race of every driver. Any
+    model with a predict_proba over the MODEL_FEATURES matrix can be served
+    instead by saving it with save_model to the model file of the service.
+
+    Attributes:
+        l2 (float): The L2 penalty of the weights, the intercept is not penalized.
+        iterations (int): The maximum number of Newton steps.
+        means_ (np.ndarray): The training mean of every feature.
+        scales_ (np.ndarray): The training standard deviation of every feature.
+        coef_ (np.ndarray): The intercept followed by the weight of every standardized feature.
+    """
+
+    def __init__(self, l2=1.0, iterations=50):
+        """
+        Initializes the LogisticPodiumModel class.
+
+        Parameters:
+            l2 (float, optional): The L2 penalty of the weights (default is 1.0).
+            iterations (int, optional): The maximum number of Newton steps (default is 50).
+        """
+        self.l2 = l2
+        self.iterations = iterations
+
+    def _standardize(self, features):
+        """
+        Fills the missing features and standardizes them with the training statistics.
+        """
+        features = np.asarray(features, dtype='float64')
+        features = np.where(np.isnan(features), self.means_, features)
+        return (features - self.means_) / self.scales_
+
+    def fit(self, features, target):
+        """
+        Fits the model.
+
+        Parameters:
+            features (np.ndarray): The MODEL_FEATURES matrix of the training rows.
+            target (np.ndarray): 1 for a podium in the next race, 0 otherwise.
+
+        Returns:
+            LogisticPodiumModel: The fitted model.
+        """
+        features = np.asarray(features, dtype='float64')
+        target = np.asarray(target, dtype='float64')
+        self.means_ = np.nan_to_num(np.nanmean(features, axis=0))
+        self.scales_ = np.nanstd(features, axis=0)
+        self.scales_[~(self.scales_ > 0)] = 1.0
+
+        design = np.column_stack([np.ones(len(features)), self._standardize(features)])
+        penalty = np.full(design.shape[1], float(self.l2))
+        penalty[0] = 0.0
+        coef = np.zeros(design.shape[1])
+        for _ in range(self.iterations):
+            probability = 1.0 / (1.0 + np.exp(-(design @ coef)))
+            gradient = design.T @ (probability - target) + penalty * coef
+            hessian = (design * (probability * (1.0 - probability))[:, None]).T @ design + np.diag(penalty)
+            step = np.linalg.solve(hessian, gradient)
+            coef -= step
+            if np.abs(step).max() < 1e-8:
+                break
+        self.coef_ = coef
+        return self
+
+    def predict_proba(self, features):
+        """
+        Predicts the podium probabilities.
+
+        Parameters:
+            features (np.ndarray): The MODEL_FEATURES matrix of the rows to score.
+
+        Returns:
+            np.ndarray: The probability of no podium and of a podium per row.
+        """
+        probability = 1.0 / (1.0 + np.exp(-(self.coef_[0] + self._standardize(features) @ self.coef_[1:])))
+        return np.column_stack([1.0 - probability, probability])
+
+def train_podium_model(data, l2=1.0):
+    """
+    Trains the placeholder podium model of the prediction service on the prepared data.
+
+    Parameters:
+        data (pd.DataFrame): The prepared data.
+        l2 (float, optional): The L2 penalty of the weights (default is 1.0).
+
+    Returns:
+        LogisticPodiumModel: The fitted model.
+    """
+    # The last race of a driver has no next race to learn from
+    rows = data[data['grid_t1'].notna()]
+    logging.info(f'Training the podium model on {len(rows)} rows')
+    return LogisticPodiumModel(l2).fit(rows[MODEL_FEATURES].to_numpy(dtype='float64', na_value=np.nan), rows[TARGET].to_numpy())
+
+def save_model(model, path):
+    """
+    Pickles a model, replacing the file at once so a running service never reads half a model.
+
+    Parameters:
+        model (object): The model, anything with a predict_proba over the MODEL_FEATURES matrix.
+        path (str): The file of the model.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(temporary_path, path)
+
+def load_model(path):
+    """
+    Loads a pickled model.
+
+    Parameters:
+        path (str): The file of the model.
+
+    Returns:
+        object: The model.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No podium model at {path}, train one first.')
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def file_signature(path):
+    """
+    Retrieves a value that changes whenever a file is replaced.
+
+    Parameters:
+        path (str): The file.
+
+    Returns:
+        tuple: The modification time and size of the file, None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+class PodiumPredictor:
+    """
+    A class keeping the feature state, the races and the model in memory to score upcoming races.
+
+    Every part remembers the signature of its source, refresh only reloads the
+    parts whose source changed. A refresh swaps the parts at once, so requests
+    scored at the same time see either the old or the new parts.
+
+    Attributes:
+        staging_store (CsvStore, ParquetStore or SqliteStore): The store of the staging tables, the races are read from it.
+        prepared_store (CsvStore, ParquetStore or SqliteStore): The store of the prepared data and the feature state.
+        model_path (str): The file of the pickled model.
+        state_name (str): The name of the stored feature state.
+    """
+
+    def __init__(self, staging_store, prepared_store, model_path, state_name='prediction_feature_state'):
+        """
+        Initializes the PodiumPredictor class and loads every part.
+
+        Parameters:
+            staging_store (CsvStore, ParquetStore or SqliteStore): The store of the staging tables.
+            prepared_store (CsvStore, ParquetStore or SqliteStore): The store of the prepared data.
+            model_path (str): The file of the pickled model.
+            state_name (str, optional): The name of the stored feature state (default is 'prediction_feature_state').
+        """
+        self.staging_store = staging_store
+        self.prepared_store = prepared_store
+        self.model_path = model_path
+        self.state_name = state_name
+        self._parts = {}
+        self._signatures = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def signatures(self):
+        """
+        Retrieves the current signature of the source of every part.
+
+        Returns:
+            dict: The signature per part.
+        """
+        return {
+            'state': PredictionFeatureState.signature(self.prepared_store, self.state_name) + (self.prepared_store.signature('F1_prepared'),),
+            'races': self.staging_store.signature('races.csv'),
+            'model': file_signature(self.model_path)
+        }
+
+    def _load_state(self):
+        """
+        Loads the feature state and lays the driver rows out as a MODEL_FEATURES matrix.
+        """
+        state = PredictionFeatureState.load(self.prepared_store, self.state_name)
+        # The extra last row stays empty, it is the row of every driver without a race so far
+        matrix = np.full((len(state.drivers) + 1, len(MODEL_FEATURES)), np.nan)
+        for position, feature in enumerate(MODEL_FEATURES):
+            if feature in state.drivers.columns:
+                matrix[:-1, position] = state.drivers[feature].to_numpy(dtype='float64', na_value=np.nan)
+        return {'state': state, 'drivers': pd.Index(state.drivers.index), 'matrix': matrix}
+
+    def _load_races(self):
+        """
+        Loads the season, round and circuit of every race.
+        """
+        races = self.staging_store.read('races.csv', columns=['raceId', 'year', 'round', 'circuitId'])
+        return {'races': races.set_index('raceId')}
+
+    def _load_model(self):
+        """
+        Loads the model.
+        """
+        return {'model': load_model(self.model_path)}
+
+    def refresh(self):
+        """
+        Reloads the parts whose source changed since they were loaded.
+
+        Returns:
+            list: The reloaded parts.
+        """
+        loaders = {'state': self._load_state, 'races': self._load_races, 'model': self._load_model}
+        with self._lock:
+            signatures = self.signatures()
+            changed = [part for part, signature in signatures.items() if part not in self._signatures or signature != self._signatures[part]]
+            if not changed:
+                return []
+
+            parts = dict(self._parts)
+            for part in changed:
+                parts.update(loaders[part]())
+            # The overtakes of a race depend on the state and the races, they are cached per race until either changes
+            parts['overtakes'] = self._parts['overtakes'] if {'state', 'races'}.isdisjoint(changed) else {}
+
+            self._parts = parts
+            self._signatures.update({part: signatures[part] for part in changed})
+        logging.info(f"Loaded {', '.join(changed)}")
+        return changed
+
+    def _overtakes(self, parts, race_ids):
+        """
+        Retrieves the overtakes_per_track of races, computing the races not seen before.
+        """
+        cache = parts['overtakes']
+        missing = [race_id for race_id in pd.unique(race_ids) if race_id not in cache]
+        if missing:
+            values = parts['state'].overtakes_per_track(parts['races'].loc[missing])
+            cache.update(zip(missing, values))
+        return np.fromiter((cache[race_id] for race_id in race_ids), dtype='float64', count=len(race_ids))
+
+    def score(self, race_ids, driver_ids, grids):
+        """
+        Scores grid positions of drivers in upcoming races.
+
+        Parameters:
+            race_ids (np.ndarray): The raceId of every row.
+            driver_ids (np.ndarray): The driverId of every row.
+            grids (np.ndarray): The grid position of every row.
+
+        Returns:
+            np.ndarray: The podium probability of every row.
+        """
+        parts = self._parts
+        race_ids = np.asarray(race_ids, dtype='int64')
+        driver_ids = np.asarray(driver_ids, dtype='int64')
+        grids = np.asarray(grids, dtype='float64')
+
+        unknown = np.unique(race_ids[parts['races'].index.get_indexer(race_ids) < 0])
+        if len(unknown):
+            raise KeyError(f"Unknown raceId {', '.join(str(race_id) for race_id in unknown)}, update the staging tables first.")
+
+        # Unknown drivers get index -1, the empty last row of the matrix
+        features = parts['matrix'][parts['drivers'].get_indexer(driver_ids)]
+        features[:, MODEL_FEATURES.index('grid_t1')] = grids
+        features[:, MODEL_FEATURES.index('diff_grid_standing')] = grids - features[:, MODEL_FEATURES.index('driverstandings_position')]
+        features[:, MODEL_FEATURES.index('overtakes_per_track_t1')] = self._overtakes(parts, race_ids)
+        features[:, MODEL_FEATURES.index('driverId')] = driver_ids
+        return parts['model'].predict_proba(features)[:, 1]
+
+    def predict_batch(self, requests):
+        """
+        Scores the fields of several upcoming races at once.
+
+        Parameters:
+            requests (pd.DataFrame): The raceId, driverId and grid of every driver in every race.
+
+        Returns:
+            pd.DataFrame: The requests with podium_probability and predicted_podium, the three most likely drivers
+                          of every race, sorted by raceId and probability.
+        """
+        predictions = requests[['raceId', 'driverId', 'grid']].copy()
+        predictions['podium_probability'] = self.score(predictions['raceId'].to_numpy(), predictions['driverId'].to_numpy(), predictions['grid'].to_numpy())
+        predictions = predictions.sort_values(['raceId', 'podium_probability'], ascending=[True, False], kind='stable', ignore_index=True)
+        predictions['predicted_podium'] = predictions.groupby('raceId').cumcount() < 3
+        return predictions
+
+    def predict(self, race_id, grid):
+        """
+        Scores the field of an upcoming race.
+
+        Parameters:
+            race_id (int): The raceId of the race.
+            grid (dict): The grid position per driverId.
+
+        Returns:
+            pd.DataFrame: The driverId, grid, podium_probability and predicted_podium of every driver, most likely first.
+        """
+        driver_ids = np.fromiter(grid.keys(), dtype='int64', count=len(grid))
+        grids = np.fromiter(grid.values(), dtype='float64', count=len(grid))
+        probabilities = self.score(np.full(len(grid), race_id, dtype='int64'), driver_ids, grids)
+        order = np.argsort(-probabilities, kind='stable')
+        return pd.DataFrame({'driverId': driver_ids[order], 'grid': grids[order], 'podium_probability': probabilities[order],
+                             'predicted_podium': np.arange(len(order)) < 3})
@@ -0,0 +1,552 @@
+import numpy as np
+import pandas as pd
+
+# The columns of the staging tables that would clash in the merge
+STAGING_RENAMES = {
+    'results': {'positionOrder': 'results_position', 'points': 'results_points'},
+    'driver_standings': {'position': 'driverstandings_position', 'positionText': 'driverstandings_positionText', 'points': 'driverstandings_points', 'wins': 'driverstandings_wins'},
+    'constructor_standings': {'position': 'constructorstandings_position', 'positionText': 'constructorstandings_positionText', 'points': 'constructorstandings_points', 'wins': 'constructorstandings_wins'},
+    'drivers': {'number': 'drivernumber'},
+    'constructors': {'name': 'constructorname'}
+}
+
+def rename_staging_tables(results, driver_standings, constructor_standings, drivers, constructors):
+    """
+    Renames the columns of the staging tables that would clash in the merge.
+
+    Parameters:
+        results (pd.DataFrame): The results table.
+        driver_standings (pd.DataFrame): The driver standings table.
+        constructor_standings (pd.DataFrame): The constructor standings table.
+        drivers (pd.DataFrame): The drivers table.
+        constructors (pd.DataFrame): The constructors table.
+
+    Returns:
+        dict: A dictionary with the renamed tables by table name.
+    """
+    return {
+        'results': results.rename(columns=STAGING_RENAMES['results']),
+        'driver_standings': driver_standings.rename(columns=STAGING_RENAMES['driver_standings']),
+        'constructor_standings': constructor_standings.rename(columns=STAGING_RENAMES['constructor_standings']),
+        'drivers': drivers.rename(columns=STAGING_RENAMES['drivers']),
+        'constructors': constructors.rename(columns=STAGING_RENAMES['constructors'])
+    }
+
+def race_calendar_features(races):
+    """
+    Adds the calendar features to the races table.
+
+    Parameters:
+        races (pd.DataFrame): The races table.
+
+    Returns:
+        pd.DataFrame: The races sorted by year and round with quarter, date_diff and is_round_1.
+    """
+    races = races.rename(columns={'name': 'racename'})
+
+    # Create 'quarter' column
+    races = races.astype({'date': 'datetime64[ns]'})
+    races["quarter"] = races.groupby(['year'])['round'].transform(lambda x: pd.qcut(x, 4, labels=range(1, 5)))
+
+    races = races.sort_values(by=['year', 'round'])
+    races['date_diff'] = races['date'].diff().dt.days
+    races['is_round_1'] = (races['round'] == 1).astype(int)
+    return races
+
+class GroupedAccumulator:
+    """
+    Streams chunks of a table into per-key running statistics of one value column.
+
+    Only the count, sum and sum of squared deviations of every key are kept, so
+    the memory use depends on the number of keys and not on the number of rows.
+    Chunks are merged with the parallel variance update, so the mean and the
+    variance match a single groupby over all rows.
+
+    Attributes:
+        keys (list): The columns to group by.
+        value (str): The column to aggregate.
+        state (pd.DataFrame): The count, sum and m2 of every key, None before the first chunk.
+    """
+
+    def __init__(self, keys, value):
+        """
+        Initializes the GroupedAccumulator class.
+
+        Parameters:
+            keys (list): The columns to group by.
+            value (str): The column to aggregate.
+        """
+        self.keys = list(keys)
+        self.value = value
+        self.state = None
+
+    def update(self, chunk):
+        """
+        Adds the rows of a chunk to the running statistics.
+
+        Parameters:
+            chunk (pd.DataFrame): The rows, with the key and value columns.
+
+        Returns:
+            GroupedAccumulator: The accumulator itself.
+        """
+        grouped = chunk.groupby(self.keys)[self.value]
+        count = grouped.count()
+        part = pd.DataFrame({'count': count, 'sum': grouped.sum(), 'm2': (grouped.var(ddof=0) * count).fillna(0.0)})
+        if self.state is None:
+            self.state = part
+            return self
+
+        old, new = self.state.align(part, join='outer', fill_value=0)
+        count = old['count'] + new['count']
+        delta = (new['sum'] / new['count'] - old['sum'] / old['count']).fillna(0.0)
+        m2 = old['m2'] + new['m2'] + (delta ** 2 * old['count'] * new['count'] / count).fillna(0.0)
+        self.state = pd.DataFrame({'count': count, 'sum': old['sum'] + new['sum'], 'm2': m2})
+        return self
+
+    def consume(self, chunks):
+        """
+        Adds every chunk of an iterable, or a single dataframe, to the running statistics.
+
+        Parameters:
+            chunks (pd.DataFrame or iterable): A dataframe or the chunks of a table.
+
+        Returns:
+            GroupedAccumulator: The accumulator itself.
+        """
+        for chunk in [chunks] if isinstance(chunks, pd.DataFrame) else chunks:
+            self.update(chunk)
+        return self
+
+    def _statistics(self):
+        if self.state is None:
+            return pd.DataFrame(columns=['count', 'sum', 'm2'], index=pd.MultiIndex.from_tuples([], names=self.keys))
+        return self.state
+
+    def count(self):
+        """
+        Retrieves the number of values of every key.
+
+        Returns:
+            pd.Series: The number of non-missing values of every key.
+        """
+        return self._statistics()['count']
+
+    def mean(self):
+        """
+        Retrieves the mean value of every key.
+
+        Returns:
+            pd.Series: The mean of every key, missing when a key only has missing values.
+        """
+        state = self._statistics()
+        return state['sum'] / state['count'].where(state['count'] > 0)
+
+    def variance(self, ddof=1):
+        """
+        Retrieves the variance of the values of every key.
+
+        Parameters:
+            ddof (int, optional): The delta degrees of freedom (default is 1).
+
+        Returns:
+            pd.Series: The variance of every key, missing when a key has ddof values or fewer.
+        """
+        state = self._statistics()
+        return state['m2'] / (state['count'] - ddof).where(state['count'] > ddof)
+
+def average_lap_times(lap_times):
+    """
+    Calculates the average lap time of every driver in every race.
+
+    Parameters:
+        lap_times (pd.DataFrame or iterable): The lap times with raceId, driverId and milliseconds,
+            or chunks of them so the whole table is never held in memory.
+
+    Returns:
+        pd.DataFrame: A dataframe with raceId, driverId and laptime_avg.
+    """
+    accumulator = GroupedAccumulator(['raceId', 'driverId'], 'milliseconds').consume(lap_times)
+    laps_gr = accumulator.mean().rename('laptime_avg').reset_index()
+    return laps_gr
+
+def merge_tables(tables, races, laps_gr):
+    """
+    Merges the staging tables into one row per driver per race.
+
+    Parameters:
+        tables (dict): The renamed tables as returned by rename_staging_tables.
+        races (pd.DataFrame): The races with the calendar features.
+        laps_gr (pd.DataFrame): The average lap times.
+
+    Returns:
+        pd.DataFrame: The merged data with grid_end_diff.
+    """
+    data = (tables['results']
+            .merge(tables['driver_standings'], on=["raceId", "driverId"], how="left")
+            .merge(tables['constructor_standings'], on=["raceId", "constructorId"], how="left")
+            .merge(races, on="raceId", how="left")
+            .merge(tables['drivers'], on="driverId", how="left")
+            .merge(tables['constructors'], on="constructorId", how="left")
+            .merge(laps_gr, on=['raceId', 'driverId'], how='left'))
+    return clean_merged_data(data)
+
+def join_staging_tables(store, races, laps_gr):
+    """
+    Merges the staging tables into one row per driver per race with an indexed SQL join.
+
+    Gives the same data as rename_staging_tables followed by merge_tables,
+    including the _x and _y names of overlapping columns, but the join runs in the
+    store on its raceId, driverId and constructorId indexes instead of on loaded tables.
+
+    Parameters:
+        store (SqliteStore): The store holding the staging tables.
+        races (pd.DataFrame): The races with the calendar features.
+        laps_gr (pd.DataFrame): The average lap times.
+
+    Returns:
+        pd.DataFrame: The merged data with grid_end_diff.
+    """
+    frames = {'race_calendar': races, 'laps_gr': laps_gr}
+    joins = [('results', []), ('driver_standings', ['raceId', 'driverId']), ('constructor_standings', ['raceId', 'constructorId']),
+             ('race_calendar', ['raceId']), ('drivers', ['driverId']), ('constructors', ['constructorId']), ('laps_gr', ['raceId', 'driverId'])]
+
+    # Every selected column as [output name, table alias, stored name, column], in the column order of merge_tables
+    selected = []
+    tables = []
+    for number, (name, keys) in enumerate(joins):
+        alias = f't{number}'
+        renames = STAGING_RENAMES.get(name, {})
+        if name in frames:
+            column_map = dict(zip(frames[name].columns, store.stored_names(frames[name].columns)))
+        else:
+            column_map = store.column_map(name)
+        added = [[renames.get(column, column), alias, stored, (name, column)] for column, stored in column_map.items()
+                 if renames.get(column, column) not in keys]
+        sources = {output: f'{source_alias}."{stored}"' for output, source_alias, stored, _ in selected}
+        condition = ' AND '.join(f'{alias}."{key}" = {sources[key]}' for key in keys)
+        tables.append(f'"{name}" AS {alias}' + (f' ON {condition}' if keys else ''))
+
+        # Like pandas, overlapping columns get the suffix of their side
+        overlap = {column[0] for column in added} & {column[0] for column in selected}
+        for column in selected:
+            column[0] += '_x' if column[0] in overlap else ''
+        for column in added:
+            column[0] += '_y' if column[0] in overlap else ''
+        selected += added
+
+    select = ', '.join(f'{alias}."{stored}" AS "{output}"' for output, alias, stored, _ in selected)
+    order = ', '.join(f't{number}.rowid' for number in range(len(joins)))
+    data = store.query(f'SELECT {select} FROM {" LEFT JOIN ".join(tables)} ORDER BY {order}', frames=frames)
+
+    # SQLite has no categorical type, the calendar quarter gets its type back
+    for output, _, _, (name, column) in selected:
+        if name in frames and isinstance(frames[name][column].dtype, pd.CategoricalDtype):
+            data[output] = data[output].astype(frames[name][column].dtype)
+    return clean_merged_data(data)
+
+def clean_merged_data(data):
+    """
+    Replaces the null markers of the merged data, sets its types and adds grid_end_diff.
+
+    Parameters:
+        data (pd.DataFrame): The merged data.
+
+    Returns:
+        pd.DataFrame: The cleaned data.
+    """
+    # Replace null values, only text columns hold them and their types are inferred afterwards as replace used to
+    text = data.select_dtypes(include='object').columns
+    data[text] = data[text].mask(data[text].isin([r"\N", r"\\N"]))
+    data = data.infer_objects()
+
+    # Change data types
+    data = data.astype({
+        'fastestLap': "float",
+        'milliseconds': "float",
+        'rank': "float",
+        'date': "datetime64[ns]",
+        'results_position': 'int64'
+    })
+
+    # Compute grid_end_diff
+    data["grid_end_diff"] = abs(data["results_position"] - data["grid"]).astype(int)
+    return data
+
+def add_overtakes_per_track(data):
+    """
+    Adds the average grid to finish difference of the circuit over all earlier seasons.
+
+    Parameters:
+        data (pd.DataFrame): The merged data.
+
+    Returns:
+        pd.DataFrame: The data with overtakes_per_track.
+    """
+    return data.merge(overtakes_per_track(data), on=["circuitId", "year"], how="left")
+
+def add_targets(data):
+    """
+    Adds the next race columns, the podium targets and the per race skill values.
+
+    Parameters:
+        data (pd.DataFrame): The data with overtakes_per_track.
+
+    Returns:
+        pd.DataFrame: The data sorted by driverId, year and round with the shifted columns and targets.
+    """
+    # Sort the data by year, driverId, and round
+    data = data.sort_values(['driverId', 'year', 'round'])
+
+    # Columns to be shifted
+    columns_to_shift = ["grid", "results_position", "overtakes_per_track"]
+
+    # Group the data and shift the columns
+    data_gr = data.groupby(['driverId'])[columns_to_shift]
+    data_shifted = data_gr.shift(periods=-1)
+    data_shifted.columns = [f"{col}_t1" for col in data_shifted.columns]
+    data = data.join(data_shifted)
+
+    data["diff_grid_standing"] = data["grid_t1"] - data["driverstandings_position"]
+
+    # Conditions and values for results_position_t1
+    conditions_top3 = [(data['results_position_t1'] <= 3), (data['results_position_t1'] > 3)]
+    conditions_top2 = [(data['results_position_t1'] <= 2), (data['results_position_t1'] > 2)]
+    conditions_top1 = [(data['results_position_t1'] <= 1), (data['results_position_t1'] > 1)]
+    values = [1, 0]
+
+    # Calculate results_position_t1 top values
+    data['results_position_t1_num'] = data['results_position_t1']
+    data['results_position_t1_top1'] = np.select(conditions_top1, values)
+    data['results_position_t1_top2'] = np.select(conditions_top2, values)
+    data['results_position_t1'] = np.select(conditions_top3, values)
+
+    # Calculate grid_end_diff_overtakes and grid_end_diff_defense
+    data["grid_end_diff_overtakes"] = (data["results_position"] - data["grid"]).astype(int).clip(lower=0).astype(int)
+    data["grid_end_diff_defense"] = (data["results_position"] - data["grid"]).astype(int).clip(upper=0).astype(int)
+
+    # Calculate the sum of driver standings per constructor, year, and race
+    total_driverstanding = data.groupby(['constructorId', 'raceId'])['driverstandings_position'].transform('sum')
+    data['teammates_driverstanding'] = total_driverstanding - data['driverstandings_position']
+    return data
+
+def overtakes_per_track(data):
+    """
+    Calculates the average grid to finish difference per circuit over all earlier seasons.
+
+    The sum and count of grid_end_diff are aggregated per circuit and season once,
+    a cumulative sum over the sorted seasons minus the season itself gives the
+    aggregates of all earlier seasons in a single pass.
+
+    Parameters:
+        data (pd.DataFrame): The race results with circuitId, year and grid_end_diff.
+
+    Returns:
+        pd.DataFrame: A dataframe with overtakes_per_track, circuitId and year for every circuit
+                      and season that has earlier seasons at the circuit.
+    """
+    per_season = (data.groupby(['circuitId', 'year'])['grid_end_diff']
+                  .agg(['sum', 'count'])
+                  .reset_index()
+                  .sort_values(['circuitId', 'year']))
+
+    # Aggregates up to and excluding the season itself
+    earlier = per_season.groupby('circuitId')[['sum', 'count']].cumsum() - per_season[['sum', 'count']]
+    per_season['overtakes_per_track'] = earlier['sum'] / earlier['count']
+
+    return per_season.loc[earlier['count'] > 0, ['overtakes_per_track', 'circuitId', 'year']].reset_index(drop=True)
+
+# Driver skill feature, the per race value it averages and its teammate aggregate
+SKILL_FEATURES = {
+    'drivers_takeover_chance': ('grid_end_diff_overtakes', 'teammates_takeover_chance'),
+    'drivers_defense': ('grid_end_diff_defense', 'teammates_defense')
+}
+SKILL_FEATURE_COLUMNS = [column for feature, (_, teammate_feature) in SKILL_FEATURES.items() for column in (feature, teammate_feature)]
+
+def add_teammate_feature(data, feature):
+    """
+    Adds the teammate aggregate of a driver skill feature.
+
+    The teammate value is the sum of the skill over the drivers of the same
+    constructor in the same race, minus the driver's own skill.
+
+    Parameters:
+        data (pd.DataFrame): The data with the driver skill feature.
+        feature (str): The driver skill feature, one of SKILL_FEATURES.
+    """
+    _, teammate_feature = SKILL_FEATURES[feature]
+    total = data.groupby(['constructorId', 'raceId'])[feature].transform('sum')
+    data[teammate_feature] = total - data[feature]
+
+def skill_features(data):
+    """
+    Computes the driver skill features and their teammate aggregates over the full history.
+
+    The driver skill is the expanding mean of the per race value over all races
+    of the driver so far, including the current one.
+
+    Parameters:
+        data (pd.DataFrame): The data with driverId, constructorId, raceId, grid_end_diff_overtakes and grid_end_diff_defense.
+
+    Returns:
+        pd.DataFrame: The data sorted by driverId and raceId with the skill features added.
+    """
+    data = data.sort_values(['driverId', 'raceId'])
+    for feature, (value, _) in SKILL_FEATURES.items():
+        data[feature] = data.groupby('driverId')[value].transform(lambda x: x.expanding().mean())
+        data[feature] = data[feature].fillna(0)
+        add_teammate_feature(data, feature)
+    return data
+
+class SkillFeatureState:
+    """
+    A class holding the running sums and counts behind the driver skill features.
+
+    With the state of all races so far, the skill features of a new race only
+    need the rows of that race.
+
+    Attributes:
+        drivers (pd.DataFrame): The running sum and count of every skill value and the last raceId, indexed by driverId.
+    """
+
+    def __init__(self, drivers=None):
+        """
+        Initializes the SkillFeatureState class.
+
+        Parameters:
+            drivers (pd.DataFrame, optional): The state per driver as built by from_history (default is None, an empty state).
+        """
+        if drivers is None:
+            columns = [f'{value}_{aggregate}' for value, _ in SKILL_FEATURES.values() for aggregate in ('sum', 'count')]
+            drivers = pd.DataFrame(columns=columns + ['last_raceId'], dtype='float64').rename_axis('driverId')
+        self.drivers = drivers
+
+    @classmethod
+    def from_history(cls, data):
+        """
+        Builds the state from all races so far.
+
+        Parameters:
+            data (pd.DataFrame): The data with driverId, raceId and the per race skill values.
+
+        Returns:
+            SkillFeatureState: The state after the last race in data.
+        """
+        grouped = data.groupby('driverId')
+        drivers = pd.DataFrame(index=grouped.size().index)
+        for value, _ in SKILL_FEATURES.values():
+            drivers[f'{value}_sum'] = grouped[value].sum()
+            drivers[f'{value}_count'] = grouped[value].count()
+        drivers['last_raceId'] = grouped['raceId'].max()
+        return cls(drivers)
+
+    @classmethod
+    def load(cls, store, name='skill_feature_state'):
+        """
+        Loads the state from a store.
+
+        Parameters:
+            store (CsvStore or ParquetStore): The store holding the state.
+            name (str): The table name of the state (default is 'skill_feature_state').
+
+        Returns:
+            SkillFeatureState: The stored state.
+        """
+        return cls(store.read(name, index_col='driverId'))
+
+    def save(self, store, name='skill_feature_state'):
+        """
+        Saves the state to a store.
+
+        Parameters:
+            store (CsvStore or ParquetStore): The store to write the state to.
+            name (str): The table name of the state (default is 'skill_feature_state').
+        """
+        store.write(name, self.drivers, index_label='driverId')
+
+    def new_race_rows(self, data):
+        """
+        Finds the rows of the races after the state.
+
+        Only the drivers of the new races are checked, their earlier rows have to
+        add up to their state. The earlier rows of the other drivers are not read,
+        a rewrite of their history needs a full recompute.
+
+        Parameters:
+            data (pd.DataFrame): The data of all races with driverId, raceId and the per race skill values.
+
+        Returns:
+            pd.Series: A mask of the rows after the last race of their driver in the state, None if the earlier
+                       rows of the drivers of the new races do not add up to the state, e.g. because their history was rewritten.
+        """
+        new = ~(data['raceId'] <= data['driverId'].map(self.drivers['last_raceId']))
+        drivers = self.drivers.index.intersection(data.loc[new, 'driverId'].unique())
+        earlier = data[~new & data['driverId'].isin(drivers)]
+        history = SkillFeatureState.from_history(earlier).drivers.reindex(drivers)
+        state = self.drivers.reindex(drivers)[history.columns]
+        if not np.allclose(history.to_numpy(dtype=float), state.to_numpy(dtype=float), equal_nan=True):
+            return None
+        return new
+
+    def update(self, data):
+        """
+        Computes the skill features of new races and adds the races to the state.
+
+        The result equals the rows of the new races in skill_features over the full
+        history. All rows of a new race have to be passed at once and every race
+        has to come after the last race of its drivers in the state.
+
+        Parameters:
+            data (pd.DataFrame): The rows of the new races with driverId, constructorId, raceId and the per race skill values.
+
+        Returns:
+            pd.DataFrame: The rows sorted by driverId and raceId with the skill features added.
+        """
+        data = data.sort_values(['driverId', 'raceId'], kind='stable')
+        state = self.drivers.reindex(data['driverId'].unique())
+        last_race_ids = data['driverId'].map(state['last_raceId'])
+        if (data['raceId'] <= last_race_ids).any():
+            raise ValueError('The state already contains races of these drivers, recompute the skill features over the full history.')
+
+        grouped = data.groupby('driverId', sort=False)
+        for feature, (value, _) in SKILL_FEATURES.items():
+            running_sum = data['driverId'].map(state[f'{value}_sum']).fillna(0) + data[value].fillna(0).groupby(data['driverId']).cumsum()
+            running_count = data['driverId'].map(state[f'{value}_count']).fillna(0) + data[value].notna().groupby(data['driverId']).cumsum()
+            data[feature] = (running_sum / running_count).where(running_count > 0).fillna(0)
+            add_teammate_feature(data, feature)
+
+            state[f'{value}_sum'] = state[f'{value}_sum'].fillna(0) + grouped[value].sum()
+            state[f'{value}_count'] = state[f'{value}_count'].fillna(0) + grouped[value].count()
+        state['last_raceId'] = grouped['raceId'].max()
+
+        self.drivers = pd.concat([self.drivers.drop(state.index, errors='ignore'), state]).rename_axis('driverId')
+        return data
+
+def incremental_skill_features(data, state, previous):
+    """
+    Computes the driver skill features of the new races only, the earlier races keep their stored features.
+
+    Only the expanding means of the rows of the new races are computed, the state
+    is updated from those rows. The result equals skill_features over the full
+    history as long as the history of the drivers of the new races adds up to the
+    state and the earlier rows are the rows of previous, otherwise nothing is computed.
+
+    Parameters:
+        data (pd.DataFrame): The data of all races, see skill_features.
+        state (SkillFeatureState): The state after the earlier races, the new races are added to it.
+        previous (pd.DataFrame): The raceId, driverId and skill features of the earlier races.
+
+    Returns:
+        pd.DataFrame: The data sorted by driverId and raceId with the skill features added, None if the earlier races differ.
+    """
+    new = state.new_race_rows(data)
+    if new is None:
+        return None
+
+    earlier = data[~new]
+    features = previous.set_index(['raceId', 'driverId'])[SKILL_FEATURE_COLUMNS].reindex(pd.MultiIndex.from_frame(earlier[['raceId', 'driverId']]))
+    if len(earlier) != len(previous) or features.isna().any(axis=None):
+        return None
+    earlier = earlier.assign(**{column: features[column].to_numpy() for column in SKILL_FEATURE_COLUMNS})
+
+    return pd.concat([earlier, state.update(data[new])]).sort_values(['driverId', 'raceId'])
@@ -0,0 +1,318 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pandas as pd
+from my_functions.instrumentation import count_rows, instrument_block
+from my_functions.preparation_functions import (SKILL_FEATURE_COLUMNS, SkillFeatureState, add_overtakes_per_track, add_targets,
+                                                average_lap_times, incremental_skill_features, join_staging_tables, merge_tables,
+                                                race_calendar_features, rename_staging_tables, skill_features)
+from my_functions.prediction import PredictionFeatureState
+from my_functions.storage import SqliteStore
+
+# The lap times are streamed in chunks of this many rows, the largest staging table is never fully in memory
+LAP_CHUNK_SIZE = 250000
+
+def module_source_hash(function):
+    """
+    Hashes the source of the module defining a function.
+
+    Parameters:
+        function (callable): The function.
+
+    Returns:
+        str: The hash of the module source.
+    """
+    return hashlib.sha256(inspect.getsource(inspect.getmodule(function)).encode()).hexdigest()
+
+class Stage:
+    """
+    A named step of the preparation pipeline.
+
+    Attributes:
+        name (str): The name of the stage.
+        function (callable): The function computing the output, called with the input tables and upstream outputs as keyword arguments.
+        tables (dict): The staging tables the stage reads, mapping the keyword argument to the columns to read (None for all).
+        depends (dict): The upstream stages, mapping the keyword argument to the name of the stage.
+        params (dict): Extra keyword arguments for the function, part of the fingerprint.
+        chunksize (int): The number of rows per chunk when the tables are streamed, None to pass whole tables.
+        queries (list): The staging tables the function queries itself, they are only part of the fingerprint.
+    """
+
+    def __init__(self, name, function, tables=None, depends=None, params=None, chunksize=None, queries=None):
+        """
+        Initializes the Stage class.
+
+        Parameters:
+            name (str): The name of the stage.
+            function (callable): The function computing the output.
+            tables (dict, optional): The staging tables the stage reads (default is None).
+            depends (dict, optional): The upstream stages, a list passes every stage by its own name (default is None).
+            params (dict, optional): Extra keyword arguments for the function (default is None).
+            chunksize (int, optional): Pass the tables as iterators of chunks of this many rows (default is None).
+            queries (list, optional): The staging tables the function queries itself, e.g. through a store in params (default is None).
+        """
+        self.name = name
+        self.function = function
+        self.tables = tables or {}
+        self.depends = dict(zip(depends, depends)) if isinstance(depends, list) else depends or {}
+        self.params = params or {}
+        self.chunksize = chunksize
+        self.queries = queries or []
+
+class StageGraph:
+    """
+    A dependency graph of stages whose outputs are cached on disk.
+
+    Every output is stored under a fingerprint of the module of the stage function, its parameters,
+    the signatures of the tables it reads and the fingerprints of its upstream
+    stages, so a run only recomputes the stages downstream of what changed.
+
+    Attributes:
+        stages (dict): The stages by name, in the order they were added.
+        store (CsvStore or ParquetStore): The store holding the input tables.
+        cache_path (str): The directory holding the cached outputs.
+    """
+
+    def __init__(self, stages, store, cache_path):
+        """
+        Initializes the StageGraph class.
+
+        Parameters:
+            stages (list): The stages, every stage after the stages it depends on.
+            store (CsvStore or ParquetStore): The store holding the input tables.
+            cache_path (str): The directory holding the cached outputs.
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.store = store
+        self.cache_path = cache_path
+        self._fingerprints = {}
+
+    def fingerprint(self, name):
+        """
+        Computes the fingerprint of a stage.
+
+        Parameters:
+            name (str): The name of the stage.
+
+        Returns:
+            str: The fingerprint.
+        """
+        if name not in self._fingerprints:
+            stage = self.stages[name]
+            description = {
+                'name': name,
+                # The whole module, a change to a helper the function calls changes the fingerprint as well
+                'code': [stage.function.__qualname__, module_source_hash(stage.function)],
+                'params': repr(sorted(stage.params.items())),
+                'tables': {table: [columns, self.store.signature(table)] for table, columns in stage.tables.items()},
+                'queries': {table: self.store.signature(table) for table in stage.queries},
+                'depends': {argument: self.fingerprint(upstream) for argument, upstream in stage.depends.items()}
+            }
+            self._fingerprints[name] = hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return self._fingerprints[name]
+
+    def _cache_file(self, name):
+        return os.path.join(self.cache_path, f'{name}.{self.fingerprint(name)}.pkl')
+
+    def is_cached(self, name):
+        """
+        Checks whether the output of a stage is cached for its current fingerprint.
+
+        Parameters:
+            name (str): The name of the stage.
+
+        Returns:
+            bool: True if the cached output is up to date.
+        """
+        return os.path.exists(self._cache_file(name))
+
+    def run(self, name, outputs=None, frames=None):
+        """
+        Retrieves the output of a stage, computing it and its upstream stages when their cache is stale.
+
+        Parameters:
+            name (str): The name of the stage.
+            outputs (dict, optional): The outputs computed in this run so far, filled in place (default is None).
+            frames (dict, optional): Tables already in memory, used instead of reading them from the store.
+                They must hold the stored content, the fingerprints still come from the store (default is None).
+
+        Returns:
+            object: The output of the stage.
+        """
+        if frames is None:
+            frames = {}
+        if outputs is None:
+            outputs = {}
+        if name in outputs:
+            return outputs[name]
+
+        if self.is_cached(name):
+            logging.info(f'Using the cached output of stage {name}')
+            with instrument_block(f'stage.{name}', cached=True) as record:
+                output = pd.read_pickle(self._cache_file(name))
+                record['rows_out'] = count_rows(output)
+        else:
+            stage = self.stages[name]
+            kwargs = {argument: self.run(upstream, outputs, frames) for argument, upstream in stage.depends.items()}
+            for table, columns in stage.tables.items():
+                if table in frames:
+                    kwargs[table] = frames[table] if columns is None else frames[table][columns]
+                elif stage.chunksize:
+                    kwargs[table] = self.store.iter_chunks(table, columns=columns, chunksize=stage.chunksize)
+                else:
+                    kwargs[table] = self.store.read(table, columns=columns)
+            logging.info(f'Computing stage {name}')
+            with instrument_block(f'stage.{name}', cached=False) as record:
+                record['rows_in'] = count_rows(kwargs)
+                output = stage.function(**kwargs, **stage.params)
+                record['rows_out'] = count_rows(output)
+            self._save(name, output)
+
+        outputs[name] = output
+        return output
+
+    def _save(self, name, output):
+        os.makedirs(self.cache_path, exist_ok=True)
+        self._remove_cache(name)
+        temp_file = self._cache_file(name) + '.tmp'
+        pd.to_pickle(output, temp_file)
+        os.replace(temp_file, self._cache_file(name))
+
+    def _remove_cache(self, name):
+        if not os.path.isdir(self.cache_path):
+            return
+        for file in os.listdir(self.cache_path):
+            if file.startswith(f'{name}.') and file.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_path, file))
+
+    def downstream(self, name):
+        """
+        Lists a stage and every stage that depends on it directly or indirectly.
+
+        Parameters:
+            name (str): The name of the stage.
+
+        Returns:
+            list: The stage names in graph order.
+        """
+        affected = {name}
+        for stage in self.stages.values():
+            if any(upstream in affected for upstream in stage.depends.values()):
+                affected.add(stage.name)
+        return [stage_name for stage_name in self.stages if stage_name in affected]
+
+    def invalidate(self, name=None):
+        """
+        Removes the cached outputs of a stage and every stage downstream of it.
+
+        Parameters:
+            name (str, optional): The name of the stage (default is None, all stages).
+        """
+        names = list(self.stages) if name is None else self.downstream(name)
+        for stage_name in names:
+            self._remove_cache(stage_name)
+        logging.info(f'Invalidated the stages {names}')
+
+def preparation_graph(store, cache_path):
+    """
+    Builds the stage graph of the preparation pipeline.
+
+    Parameters:
+        store (CsvStore, ParquetStore or SqliteStore): The store holding the staging tables.
+        cache_path (str): The directory holding the cached stage outputs.
+
+    Returns:
+        StageGraph: The graph, its final stage is 'skills'.
+    """
+    if isinstance(store, SqliteStore):
+        # The staging tables are joined in the database on its indexes instead of being loaded
+        load = []
+        merge = Stage('merge', join_staging_tables, depends={'races': 'race_calendar', 'laps_gr': 'lap_aggregation'}, params={'store': store},
+                      queries=['results', 'driver_standings', 'constructor_standings', 'drivers', 'constructors'])
+    else:
+        load = [Stage('load', rename_staging_tables,
+                      tables={'results': None, 'driver_standings': None, 'constructor_standings': None, 'drivers': None, 'constructors': None})]
+        merge = Stage('merge', merge_tables, depends={'tables': 'load', 'races': 'race_calendar', 'laps_gr': 'lap_aggregation'})
+    stages = [
+        *load,
+        Stage('race_calendar', race_calendar_features, tables={'races': None}),
+        Stage('lap_aggregation', average_lap_times, tables={'lap_times': ['raceId', 'driverId', 'milliseconds']},
+              chunksize=LAP_CHUNK_SIZE),
+        merge,
+        Stage('overtakes', add_overtakes_per_track, depends={'data': 'merge'}),
+        Stage('targets', add_targets, depends={'data': 'overtakes'}),
+        Stage('skills', skill_features, depends={'data': 'targets'})
+    ]
+    return StageGraph(stages, store, cache_path)
+
+def update_skill_features(data, prepared_store):
+    """
+    Adds the skill features of the races after the saved skill feature state, the earlier races keep those in the stored prepared data.
+
+    Only the keys and the skill features of the stored prepared data are read, the
+    state is updated from the rows of the new races.
+
+    Parameters:
+        data (pd.DataFrame): The output of the targets stage.
+        prepared_store (CsvStore, ParquetStore or SqliteStore): The store of the prepared data and the skill feature state.
+
+    Returns:
+        tuple: The data like the skills stage and the updated SkillFeatureState, None if there is no state or
+               the earlier races no longer match it.
+    """
+    if not (prepared_store.exists('F1_prepared') and prepared_store.exists('skill_feature_state')):
+        logging.info('No skill feature state yet, computing the skill features over the full history')
+        return None
+
+    previous = prepared_store.read('F1_prepared', columns=['raceId', 'driverId'] + SKILL_FEATURE_COLUMNS)
+    state = SkillFeatureState.load(prepared_store)
+    with instrument_block('stage.skills', cached=False, incremental=True) as record:
+        record['rows_in'] = len(data)
+        output = incremental_skill_features(data, state, previous)
+        record['rows_out'] = count_rows(output)
+    if output is None:
+        logging.info('The earlier races changed since the skill feature state was saved, computing the skill features over the full history')
+        return None
+    logging.info(f'Computed the skill features of {len(output) - len(previous)} new rows, the other rows keep their stored features')
+    return output, state
+
+def write_prepared_data(graph, prepared_store, frames=None, full=False):
+    """
+    Runs the preparation graph and writes the prepared data, the skill feature state and the prediction feature state.
+
+    The skill features are only computed for the races after the saved skill
+    feature state, over the full history when full is set, there is no state yet
+    or the history of the drivers of the new races changed. Only this expanding
+    mean work scales with the new races: the stages up to targets still run over
+    the full history when the staging tables change, and the prepared data is
+    rewritten as a whole since a new race also changes the next race columns of
+    the previous race of its drivers.
+
+    Parameters:
+        graph (StageGraph): The graph from preparation_graph.
+        prepared_store (CsvStore or ParquetStore): The store of the prepared data.
+        frames (dict, optional): Staging tables already in memory, see StageGraph.run (default is None).
+        full (bool, optional): Compute the skill features over the full history (default is False).
+
+    Returns:
+        pd.DataFrame: The prepared data.
+    """
+    outputs = {}
+    updated = None
+    if not full:
+        updated = update_skill_features(graph.run('targets', outputs, frames), prepared_store)
+    if updated is None:
+        data = graph.run('skills', outputs, frames)
+        state = SkillFeatureState.from_history(data)
+    else:
+        data, state = updated
+    prepared_store.write('F1_prepared', data)
+
+    # Store the running sums behind the skill features so new races can be added incrementally
+    state.save(prepared_store)
+
+    # Store the last race of every driver so the prediction service does not read the full prepared data
+    PredictionFeatureState.from_prepared(data).save(prepared_store)
+    return data
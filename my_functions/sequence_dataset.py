@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import as_strided
+from my_functions.prediction import MODEL_FEATURES, TARGET
+
+# The arrays of a saved dataset, one .npy file each so they can be memory-mapped
+DATASET_ARRAYS = ['values', 'target', 'race_ids', 'years', 'race_numbers', 'starts']
+
+class SequenceDataset:
+    """
+    A class holding the LSTM sequences of the prepared data without copying them.
+
+    The feature rows are sorted by driver and race into one contiguous float32
+    array, every sequence is a window of consecutive races of one driver and
+    only its first row is stored. The windows are strided views on the array,
+    subsets and folds share the array and only keep their own first rows, so
+    the memory stays at one copy of the features whatever the window length or
+    the number of folds. Only the batches handed to the model are copied.
+
+    Attributes:
+        values (np.ndarray): The feature rows, sorted by driverId, year and round.
+        target (np.ndarray): The target of every row.
+        race_ids (np.ndarray): The raceId of every row.
+        years (np.ndarray): The season of every row.
+        race_numbers (np.ndarray): The chronological number of the race of every row, 0 for the first race.
+        window (int): The number of races per sequence.
+        starts (np.ndarray): The first row of every sequence of the dataset.
+        features (list): The names of the feature columns.
+    """
+
+    def __init__(self, values, target, race_ids, years, race_numbers, window, starts, features):
+        """
+        Initializes the SequenceDataset class.
+
+        Parameters:
+            values (np.ndarray): The feature rows, a contiguous float32 array.
+            target (np.ndarray): The target of every row.
+            race_ids (np.ndarray): The raceId of every row.
+            years (np.ndarray): The season of every row.
+            race_numbers (np.ndarray): The chronological number of the race of every row.
+            window (int): The number of races per sequence.
+            starts (np.ndarray): The first row of every sequence.
+            features (list): The names of the feature columns.
+        """
+        self.values = values
+        self.target = target
+        self.race_ids = race_ids
+        self.years = years
+        self.race_numbers = race_numbers
+        self.window = window
+        self.starts = starts
+        self.features = features
+
+    @classmethod
+    def from_prepared(cls, data, window=20, features=None, target=TARGET):
+        """
+        Builds the sequences of every driver from the prepared data.
+
+        Rows with a missing feature or target are dropped like in the training
+        notebook, every run of window consecutive remaining races of a driver
+        is a sequence labelled with the target of its last race.
+
+        Parameters:
+            data (pd.DataFrame): The prepared data.
+            window (int, optional): The number of races per sequence (default is 20).
+            features (list, optional): The feature columns (default is None, the MODEL_FEATURES).
+            target (str, optional): The target column (default is TARGET).
+
+        Returns:
+            SequenceDataset: The sequences.
+        """
+        if window < 1:
+            raise ValueError('The window needs at least one race.')
+        features = list(features or MODEL_FEATURES)
+        columns = list(dict.fromkeys(features + [target, 'driverId', 'raceId', 'year', 'round']))
+        rows = data[columns].dropna(subset=features + [target]).sort_values(['driverId', 'year', 'round'], kind='stable')
+
+        values = np.ascontiguousarray(rows[features].to_numpy(dtype='float32'))
+        race_numbers = rows.groupby(['year', 'round'], sort=True).ngroup().to_numpy(dtype='int64')
+
+        # A sequence ends at every row with at least window - 1 earlier rows of the same driver
+        position = rows.groupby('driverId', sort=False).cumcount().to_numpy(dtype='int64')
+        starts = np.flatnonzero(position >= window - 1) - (window - 1)
+        return cls(values, rows[target].to_numpy(dtype='float32'), rows['raceId'].to_numpy(dtype='int64'),
+                   rows['year'].to_numpy(dtype='int64'), race_numbers, window, starts, features)
+
+    def save(self, directory):
+        """
+        Saves the dataset as .npy files, other processes can memory-map them with load instead of receiving a copy.
+
+        Parameters:
+            directory (str): The directory of the dataset, replaced if it exists.
+
+        Returns:
+            str: The fingerprint of the saved arrays.
+        """
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        for name in DATASET_ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            digest.update(name.encode())
+            digest.update(array.tobytes())
+            np.save(os.path.join(directory, f'{name}.npy'), array)
+        fingerprint = digest.hexdigest()[:16]
+        with open(os.path.join(directory, 'dataset.json'), 'w') as f:
+            json.dump({'window': self.window, 'features': self.features, 'fingerprint': fingerprint}, f)
+        return fingerprint
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Loads a saved dataset.
+
+        Parameters:
+            directory (str): The directory of the dataset.
+            mmap (bool, optional): Memory-map the arrays read-only instead of reading them (default is True).
+
+        Returns:
+            SequenceDataset: The dataset.
+        """
+        with open(os.path.join(directory, 'dataset.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None) for name in DATASET_ARRAYS}
+        return cls(window=meta['window'], features=meta['features'], **arrays)
+
+    @staticmethod
+    def saved_fingerprint(directory):
+        """
+        Retrieves the fingerprint of a saved dataset.
+
+        Parameters:
+            directory (str): The directory of the dataset.
+
+        Returns:
+            str: The fingerprint written by save.
+        """
+        with open(os.path.join(directory, 'dataset.json')) as f:
+            return json.load(f)['fingerprint']
+
+    def __len__(self):
+        """
+        Retrieves the number of sequences.
+
+        Returns:
+            int: The number of sequences.
+        """
+        return len(self.starts)
+
+    @property
+    def windows(self):
+        """
+        Retrieves every window of the feature rows as a read-only view, including windows spanning two drivers.
+
+        Returns:
+            np.ndarray: A view with the shape (rows - window + 1, window, features), index it with starts.
+        """
+        rows, columns = self.values.shape
+        count = max(rows - self.window + 1, 0)
+        row_stride, column_stride = self.values.strides
+        return as_strided(self.values, shape=(count, self.window, columns), strides=(row_stride, row_stride, column_stride), writeable=False)
+
+    @property
+    def end_rows(self):
+        """
+        Retrieves the last row of every sequence.
+
+        Returns:
+            np.ndarray: The row the target and race of every sequence are taken from.
+        """
+        return self.starts + self.window - 1
+
+    @property
+    def labels(self):
+        """
+        Retrieves the target of every sequence.
+
+        Returns:
+            np.ndarray: The target of the last race of every sequence.
+        """
+        return self.target[self.end_rows]
+
+    def subset(self, selection):
+        """
+        Selects sequences, sharing the feature rows with this dataset.
+
+        Parameters:
+            selection (np.ndarray): A boolean mask or the positions of the sequences.
+
+        Returns:
+            SequenceDataset: The selected sequences.
+        """
+        return SequenceDataset(self.values, self.target, self.race_ids, self.years, self.race_numbers, self.window,
+                               self.starts[selection], self.features)
+
+    def between_years(self, first=None, last=None):
+        """
+        Selects the sequences whose last race is in a range of seasons.
+
+        Parameters:
+            first (int, optional): The first season (default is None, no lower bound).
+            last (int, optional): The last season (default is None, no upper bound).
+
+        Returns:
+            SequenceDataset: The selected sequences.
+        """
+        years = self.years[self.end_rows]
+        mask = np.ones(len(years), dtype=bool)
+        if first is not None:
+            mask &= years >= first
+        if last is not None:
+            mask &= years <= last
+        return self.subset(mask)
+
+    def time_series_splits(self, n_splits=3):
+        """
+        Splits the sequences by race like TimeSeriesSplit, every fold trains on all races before its test races.
+
+        Parameters:
+            n_splits (int, optional): The number of folds (default is 3).
+
+        Yields:
+            tuple: The train and test SequenceDataset of every fold, both sharing the feature rows.
+        """
+        end_races = self.race_numbers[self.end_rows]
+        races = np.unique(end_races)
+        test_size = len(races) // (n_splits + 1)
+        if test_size == 0:
+            raise ValueError(f'{len(races)} races are too few for {n_splits} splits.')
+        for fold in range(n_splits):
+            test_start = races[len(races) - (n_splits - fold) * test_size]
+            test_end = races[len(races) - (n_splits - fold - 1) * test_size - 1]
+            yield (self.subset(end_races < test_start),
+                   self.subset((end_races >= test_start) & (end_races <= test_end)))
+
+    def covered_rows(self):
+        """
+        Retrieves the rows inside at least one sequence of the dataset.
+
+        Returns:
+            np.ndarray: A boolean mask over the feature rows.
+        """
+        # Count the windows open at every row with a difference array instead of marking every window
+        changes = np.zeros(len(self.values) + 1, dtype='int64')
+        np.add.at(changes, self.starts, 1)
+        np.add.at(changes, self.starts + self.window, -1)
+        return np.cumsum(changes[:-1]) > 0
+
+    def fit_scaler(self, chunksize=65536):
+        """
+        Calculates the minimum and range of every feature over the rows of the sequences, the MinMaxScaler of the notebook.
+
+        Parameters:
+            chunksize (int, optional): The number of rows reduced at a time, bounding the temporary memory (default is 65536).
+
+        Returns:
+            tuple: The minimum and the range of every feature, a range of 0 is replaced by 1.
+        """
+        covered = self.covered_rows()
+        minimum = np.full(self.values.shape[1], np.inf, dtype='float32')
+        maximum = np.full(self.values.shape[1], -np.inf, dtype='float32')
+        for start in range(0, len(self.values), chunksize):
+            rows = self.values[start:start + chunksize][covered[start:start + chunksize]]
+            if len(rows):
+                minimum = np.minimum(minimum, rows.min(axis=0))
+                maximum = np.maximum(maximum, rows.max(axis=0))
+        scale = maximum - minimum
+        scale[~(scale > 0)] = 1
+        return minimum, scale
+
+    def batch(self, positions, scaler=None):
+        """
+        Copies some sequences into a batch.
+
+        Parameters:
+            positions (np.ndarray): The positions of the sequences in the dataset.
+            scaler (tuple, optional): The minimum and range from fit_scaler to scale the batch with (default is None).
+
+        Returns:
+            tuple: The sequences with the shape (len(positions), window, features) and their targets.
+        """
+        starts = self.starts[positions]
+        sequences = np.take(self.windows, starts, axis=0)
+        if scaler is not None:
+            minimum, scale = scaler
+            sequences -= minimum
+            sequences /= scale
+        return sequences, self.target[starts + self.window - 1]
+
+    def batches(self, batch_size=32, shuffle=False, seed=None, scaler=None):
+        """
+        Streams the sequences to the model one batch at a time.
+
+        Parameters:
+            batch_size (int, optional): The number of sequences per batch (default is 32).
+            shuffle (bool, optional): Shuffle the sequences instead of keeping their order (default is False).
+            seed (int, optional): The seed of the shuffle (default is None).
+            scaler (tuple, optional): The minimum and range from fit_scaler to scale the batches with (default is None).
+
+        Yields:
+            tuple: The sequences and targets of every batch.
+        """
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(order), batch_size):
+            yield self.batch(order[start:start + batch_size], scaler)
+
+    def to_frame(self):
+        """
+        Retrieves the raceId, season and target of every sequence, e.g. to group the predictions per race.
+
+        Returns:
+            pd.DataFrame: The raceId, year and target of the last race of every sequence.
+        """
+        end_rows = self.end_rows
+        return pd.DataFrame({'raceId': self.race_ids[end_rows], 'year': self.years[end_rows], 'target': self.target[end_rows]})
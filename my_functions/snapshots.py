@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+import pandas as pd
+
+# The columns of a loaded session the update uses, a snapshot keeps only these
+SNAPSHOT_LAP_COLUMNS = ['Driver', 'DriverId', 'LapNumber', 'Position', 'LapTime', 'year', 'race_name']
+SNAPSHOT_RESULT_COLUMNS = ['DriverNumber', 'Abbreviation', 'DriverId', 'FirstName', 'LastName', 'TeamId', 'TeamName', 'Position',
+                           'ClassifiedPosition', 'GridPosition', 'Q1', 'Q2', 'Q3', 'Time', 'Points', 'year', 'RoundNumber']
+
+# The event fields every row of a session carries, a snapshot stores them once in the file metadata
+SESSION_INFO_FIELDS = ['race_name', 'Location', 'Country_Name', 'Country_Code', 'Circuit_ShortName']
+SESSION_CONSTANT_COLUMNS = ['year', 'RoundNumber'] + SESSION_INFO_FIELDS
+
+SNAPSHOT_FORMAT_VERSION = 1
+_METADATA_KEY = b'f1_snapshot'
+
+def snapshots_available():
+    """
+    Checks whether snapshots can be read and written, they are Parquet files and need pyarrow.
+
+    Returns:
+        bool: True if pyarrow is installed.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def get_snapshot_path():
+    """
+    Retrieves the directory of the session snapshots.
+
+    Returns:
+        str: The snapshots directory inside the cache path.
+    """
+    return os.path.normpath(os.path.join(os.getcwd(), '..', 'Data', 'cache', 'snapshots'))
+
+def session_snapshot_dir(snapshot_path, year, round_number, racetype):
+    """
+    Retrieves the directory of the snapshot of a session.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int): The season.
+        round_number (int): The round.
+        racetype (str): The session type.
+
+    Returns:
+        str: The directory holding the laps and results files of the session.
+    """
+    return os.path.join(snapshot_path, str(year), f'{int(round_number):02d}_{racetype}')
+
+def schedule_snapshot_file(snapshot_path, year):
+    """
+    Retrieves the file of the snapshot of a season schedule.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int): The season.
+
+    Returns:
+        str: The Parquet file of the schedule.
+    """
+    return os.path.join(snapshot_path, str(year), 'schedule.parquet')
+
+def distill_session(laps, results):
+    """
+    Reduces a loaded session to the columns the update uses.
+
+    Parameters:
+        laps (pd.DataFrame): The laps from load_event_session.
+        results (pd.DataFrame): The results from load_event_session.
+
+    Returns:
+        tuple: The laps and results with the snapshot columns and the session info fields.
+    """
+    def keep(frame, columns):
+        return frame[[column for column in dict.fromkeys(columns + SESSION_INFO_FIELDS) if column in frame.columns]].reset_index(drop=True)
+
+    return keep(laps, SNAPSHOT_LAP_COLUMNS), keep(results, SNAPSHOT_RESULT_COLUMNS)
+
+def _write_frame(frame, file_path, metadata):
+    """
+    Writes a frame as a zstd compressed Parquet file, the columns with a single value only go into the metadata.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    constants = {}
+    if len(frame):
+        for column in SESSION_CONSTANT_COLUMNS:
+            if column in frame.columns and frame[column].nunique(dropna=False) == 1:
+                value = frame[column].iloc[0]
+                constants[column] = value.item() if hasattr(value, 'item') else value
+    table = pa.Table.from_pandas(frame.drop(columns=list(constants)), preserve_index=False)
+    description = {**metadata, 'columns': list(frame.columns), 'constants': constants, 'version': SNAPSHOT_FORMAT_VERSION}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _METADATA_KEY: json.dumps(description, default=str).encode()})
+    pq.write_table(table, file_path, compression='zstd')
+
+def _read_frame(file_path):
+    """
+    Reads a frame written by _write_frame, broadcasting the metadata columns back to every row.
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(file_path)
+    description = json.loads(table.schema.metadata[_METADATA_KEY])
+    if description.get('version') != SNAPSHOT_FORMAT_VERSION:
+        return None, description
+    frame = table.to_pandas()
+    for column, value in description['constants'].items():
+        frame[column] = value
+    return frame[description['columns']], description
+
+def write_session_snapshot(snapshot_path, year, round_number, racetype, laps, results):
+    """
+    Writes the snapshot of a session, replacing an existing one.
+
+    The files are written to a new directory that is renamed into place, a reader
+    sees the old snapshot, the new one or none but never a mix of them.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int): The season.
+        round_number (int): The round.
+        racetype (str): The session type.
+        laps (pd.DataFrame): The distilled laps.
+        results (pd.DataFrame): The distilled results.
+    """
+    directory = session_snapshot_dir(snapshot_path, year, round_number, racetype)
+    temporary = f'{directory}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(temporary)
+    metadata = {'year': int(year), 'round': int(round_number), 'session': racetype, 'created': datetime.now().isoformat(timespec='seconds')}
+    _write_frame(laps, os.path.join(temporary, 'laps.parquet'), metadata)
+    _write_frame(results, os.path.join(temporary, 'results.parquet'), metadata)
+
+    if os.path.exists(directory):
+        retired = f'{directory}.old-{uuid.uuid4().hex}'
+        os.rename(directory, retired)
+        os.rename(temporary, directory)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        os.rename(temporary, directory)
+
+def read_session_snapshot(snapshot_path, year, round_number, racetype):
+    """
+    Reads the snapshot of a session.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int): The season.
+        round_number (int): The round.
+        racetype (str): The session type.
+
+    Returns:
+        tuple: The laps and results of the session, None if there is no snapshot of the current format.
+    """
+    directory = session_snapshot_dir(snapshot_path, year, round_number, racetype)
+    if not os.path.isdir(directory):
+        return None
+    try:
+        laps, _ = _read_frame(os.path.join(directory, 'laps.parquet'))
+        results, _ = _read_frame(os.path.join(directory, 'results.parquet'))
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f'Could not read the snapshot {directory}, loading the session again: {e}')
+        return None
+    if laps is None or results is None:
+        return None
+    return laps, results
+
+def write_schedule_snapshot(snapshot_path, year, schedule):
+    """
+    Writes the snapshot of a season schedule.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int): The season.
+        schedule (fastf1.events.EventSchedule): The schedule.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    file_path = schedule_snapshot_file(snapshot_path, year)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # A schedule of a season still running may change, only a complete season is reused
+    complete = bool((pd.DataFrame(schedule)['EventDate'] < datetime.now()).all())
+    table = pa.Table.from_pandas(pd.DataFrame(schedule), preserve_index=False)
+    description = {'year': int(year), 'complete': complete, 'created': datetime.now().isoformat(timespec='seconds'), 'version': SNAPSHOT_FORMAT_VERSION}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _METADATA_KEY: json.dumps(description).encode()})
+    pq.write_table(table, f'{file_path}.tmp', compression='zstd')
+    os.replace(f'{file_path}.tmp', file_path)
+
+def read_schedule_snapshot(snapshot_path, year):
+    """
+    Reads the snapshot of a season schedule, only if the season was complete when it was written.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int): The season.
+
+    Returns:
+        fastf1.events.EventSchedule: The schedule, None if there is no reusable snapshot.
+    """
+    import fastf1 as ff1
+    import pyarrow.parquet as pq
+
+    file_path = schedule_snapshot_file(snapshot_path, year)
+    if not os.path.exists(file_path):
+        return None
+    table = pq.read_table(file_path)
+    description = json.loads(table.schema.metadata[_METADATA_KEY])
+    if description.get('version') != SNAPSHOT_FORMAT_VERSION or not description['complete']:
+        return None
+    return ff1.events.EventSchedule(table.to_pandas(), year=year)
+
+def list_snapshots(snapshot_path, year=None):
+    """
+    Lists the session snapshots.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int, optional): Only list this season (default is None, every season).
+
+    Returns:
+        pd.DataFrame: The year, round, session, rows, size in bytes and creation time of every snapshot.
+    """
+    import pyarrow.parquet as pq
+
+    rows = []
+    years = [str(year)] if year is not None else sorted(os.listdir(snapshot_path)) if os.path.isdir(snapshot_path) else []
+    for season in years:
+        season_path = os.path.join(snapshot_path, season)
+        if not os.path.isdir(season_path):
+            continue
+        for entry in sorted(os.listdir(season_path)):
+            directory = os.path.join(season_path, entry)
+            if not os.path.isdir(directory) or '.tmp-' in entry or '.old-' in entry:
+                continue
+            files = {name: os.path.join(directory, f'{name}.parquet') for name in ('laps', 'results')}
+            description = json.loads(pq.read_schema(files['results']).metadata[_METADATA_KEY])
+            rows.append({'year': int(season), 'round': description['round'], 'session': description['session'],
+                         'laps': pq.ParquetFile(files['laps']).metadata.num_rows, 'results': pq.ParquetFile(files['results']).metadata.num_rows,
+                         'bytes': sum(os.path.getsize(file) for file in files.values()), 'created': description['created']})
+    return pd.DataFrame(rows, columns=['year', 'round', 'session', 'laps', 'results', 'bytes', 'created'])
+
+def invalidate_snapshots(snapshot_path, year, rounds=None, racetypes=None):
+    """
+    Removes snapshots so the next update loads the sessions from fastf1 again.
+
+    Parameters:
+        snapshot_path (str): The directory of the snapshots.
+        year (int): The season.
+        rounds (list, optional): The rounds (default is None, every round and the schedule of the season).
+        racetypes (list, optional): The session types (default is None, every session type).
+
+    Returns:
+        int: The number of removed snapshots.
+    """
+    season_path = os.path.join(snapshot_path, str(year))
+    if not os.path.isdir(season_path):
+        return 0
+    removed = 0
+    for entry in os.listdir(season_path):
+        directory = os.path.join(season_path, entry)
+        if not os.path.isdir(directory):
+            continue
+        round_number, _, racetype = entry.partition('_')
+        racetype = racetype.split('.')[0]
+        if rounds is not None and int(round_number) not in rounds:
+            continue
+        if racetypes is not None and racetype not in racetypes:
+            continue
+        shutil.rmtree(directory, ignore_errors=True)
+        removed += 1
+    if rounds is None and os.path.exists(schedule_snapshot_file(snapshot_path, year)):
+        os.remove(schedule_snapshot_file(snapshot_path, year))
+    return removed
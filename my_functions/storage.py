@@ -0,0 +1,1489 @@
+import argparse
+import logging
+import os
+import json
+import re
+import shutil
+import sqlite3
+import uuid
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import pandas as pd
+from my_functions.instrumentation import instrumented
+
+FACT_TABLES = ['lap_times', 'results', 'sprint_results', 'qualifying', 'driver_standings', 'constructor_standings']
+DIMENSION_TABLES = ['drivers', 'constructors', 'races']
+
+# The natural key of every staging table, a row with the key of a stored row replaces it in a keyed store
+TABLE_KEYS = {
+    'drivers': ['driverId'],
+    'constructors': ['constructorId'],
+    'races': ['raceId'],
+    'results': ['raceId', 'driverId'],
+    'sprint_results': ['raceId', 'driverId'],
+    'qualifying': ['raceId', 'driverId'],
+    'lap_times': ['raceId', 'driverId', 'lap'],
+    'driver_standings': ['raceId', 'driverId'],
+    'constructor_standings': ['raceId', 'constructorId']
+}
+
+def get_staging_path():
+    """
+    Retrieves the staging path.
+
+    Returns:
+        str: The path to the staging directory.
+    """
+    current_dir = os.getcwd()
+    return os.path.normpath(os.path.join(current_dir, '..', 'Data', 'Staging'))
+
+def table_name(filename):
+    """
+    Strips the file extension from a table filename.
+
+    Parameters:
+        filename (str): The table name or filename, e.g. 'results.csv'.
+
+    Returns:
+        str: The table name, e.g. 'results'.
+    """
+    name, extension = os.path.splitext(os.path.basename(filename))
+    return name if extension in ('.csv', '.parquet') else os.path.basename(filename)
+
+def coerce_types(data):
+    """
+    Converts the Ergast style text columns of a table to typed columns.
+
+    The '\\N' null markers become missing values and text columns that only hold
+    numbers become numeric columns.
+
+    Parameters:
+        data (pd.DataFrame): The table to convert.
+
+    Returns:
+        pd.DataFrame: The table with typed columns.
+    """
+    data = data.copy()
+    for column in data.columns[data.dtypes == object]:
+        values = data[column].replace([r'\N', r'\\N'], pd.NA)
+        try:
+            values = pd.to_numeric(values)
+        except (TypeError, ValueError):
+            values = values.where(values.isna(), values.astype(str))
+        data[column] = values
+    return data
+
+def conform_types(data, schema):
+    """
+    Converts a batch of rows to the column types a table already has, so every partition of a table has the same schema.
+
+    Parameters:
+        data (pd.DataFrame): The rows to convert.
+        schema (pyarrow.Schema): The schema of the table's existing files.
+
+    Returns:
+        pyarrow.Table: The rows with the existing columns and types, new columns keep their inferred type.
+    """
+    import pyarrow as pa
+
+    # Columns the batch lacks are written as missing values so every file has every column
+    data = coerce_types(data).reindex(columns=list(dict.fromkeys(schema.names + list(data.columns))))
+    types = {field.name: field.type for field in schema if not pa.types.is_null(field.type)}
+    for column in data.columns:
+        if column not in types:
+            continue
+        if pa.types.is_string(types[column]) or pa.types.is_large_string(types[column]):
+            # E.g. the timedelta race times of fastf1 next to the Ergast text times
+            values = data[column]
+            data[column] = values.astype(str).where(values.notna(), None).astype(object)
+        elif pa.types.is_integer(types[column]) or pa.types.is_floating(types[column]):
+            data[column] = pd.to_numeric(data[column], errors='coerce')
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    target = pa.schema([pa.field(field.name, types.get(field.name, field.type)) for field in table.schema])
+    return table.cast(target)
+
+class CsvStore:
+    """
+    Stores every staging table as a single CSV file.
+
+    Attributes:
+        root (str): The directory holding the tables.
+        keyed (bool): Whether appends are keyed upserts, False since rows are only appended.
+    """
+    keyed = False
+
+    def __init__(self, root):
+        """
+        Initializes the CsvStore class.
+
+        Parameters:
+            root (str): The directory holding the tables.
+        """
+        self.root = root
+
+    def path(self, name):
+        """
+        Retrieves the path of a table.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            str: The path of the CSV file.
+        """
+        return os.path.join(self.root, f'{table_name(name)}.csv')
+
+    def exists(self, name):
+        """
+        Checks whether a table exists.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            bool: True if the table exists.
+        """
+        return os.path.exists(self.path(name))
+
+    def signature(self, name):
+        """
+        Retrieves a value that changes whenever the table is rewritten.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            tuple: The modification time and size of the file, None if the table does not exist.
+        """
+        if not self.exists(name):
+            return None
+        stat = os.stat(self.path(name))
+        return stat.st_mtime_ns, stat.st_size
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def read(self, name, columns=None, years=None, index_col=None):
+        """
+        Reads a table.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            years (list, optional): The seasons to keep (default is None, all seasons).
+            index_col (str, optional): The column to use as index (default is None).
+
+        Returns:
+            pd.DataFrame: The table.
+        """
+        usecols = None
+        if columns is not None:
+            usecols = list(columns)
+            for column in [index_col] + (['year', 'raceId'] if years is not None else []):
+                if column is not None and column not in usecols:
+                    usecols.append(column)
+            header = pd.read_csv(self.path(name), nrows=0).columns
+            usecols = [column for column in usecols if column in header]
+        data = pd.read_csv(self.path(name), on_bad_lines='skip', header=0, delimiter=',', usecols=usecols, index_col=index_col)
+        if years is not None:
+            data = filter_years(data, years, self)
+        if columns is not None:
+            data = data[[column for column in columns if column != index_col]]
+        return data
+
+    def iter_chunks(self, name, columns=None, chunksize=100000):
+        """
+        Reads a table in chunks of rows, so only one chunk is held in memory at a time.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            chunksize (int, optional): The number of rows per chunk (default is 100000).
+
+        Yields:
+            pd.DataFrame: The next chunk of the table.
+        """
+        usecols = None
+        if columns is not None:
+            header = pd.read_csv(self.path(name), nrows=0).columns
+            usecols = [column for column in columns if column in header]
+        with pd.read_csv(self.path(name), on_bad_lines='skip', header=0, delimiter=',', usecols=usecols, chunksize=chunksize) as reader:
+            for chunk in reader:
+                yield chunk if usecols is None else chunk[usecols]
+
+    def lookup(self, name, columns=None, **keys):
+        """
+        Reads the rows of a table with the given key values, e.g. one race or the history of one driver.
+
+        A CSV file has no index, so the whole table is read and filtered.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            **keys: The value of every key column, e.g. driverId=1.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        read_columns = None if columns is None else list(columns) + [key for key in keys if key not in columns]
+        data = select_keys(self.read(name, columns=read_columns), keys)
+        return data if columns is None else data[list(columns)]
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def write(self, name, data, index_label=None):
+        """
+        Writes a table, replacing its previous content.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The table to write.
+            index_label (str, optional): The label of the index column, the index is not written if None (default is None).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        file_path = self.path(name)
+        temp_path = file_path + '.tmp'
+        data.to_csv(temp_path, header=True, index=True if index_label else False, index_label=index_label)
+        os.replace(temp_path, file_path)
+
+    def columns(self, name):
+        """
+        Retrieves the column names of a table without reading its rows.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            list: The column names, including the index column.
+        """
+        return list(pd.read_csv(self.path(name), nrows=0).columns)
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def append(self, name, data, index_label=None):
+        """
+        Appends rows to the end of a table without rewriting it.
+
+        The rows are written in the column order of the existing file, columns the
+        file does not have are dropped.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The rows to append.
+            index_label (str, optional): The label of the index column, the index is not written if None (default is None).
+        """
+        file_path = self.path(name)
+        columns = [column for column in self.columns(name) if column != index_label]
+        with open(file_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        data.reindex(columns=columns).to_csv(file_path, mode='a', header=False, index=True if index_label else False)
+
+class ParquetStore:
+    """
+    Stores the staging tables as typed Parquet files.
+
+    Fact tables are partitioned by season in year=<year> directories, dimension
+    tables are a single file. Requires pyarrow.
+
+    Attributes:
+        root (str): The directory holding the tables.
+        keyed (bool): Whether appends are keyed upserts, False since rows are only appended.
+    """
+    keyed = False
+
+    def __init__(self, root):
+        """
+        Initializes the ParquetStore class.
+
+        Parameters:
+            root (str): The directory holding the tables.
+        """
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("The parquet storage backend requires pyarrow, install it with 'pip install pyarrow'.") from e
+        self.root = root
+
+    def path(self, name):
+        """
+        Retrieves the path of a table.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            str: The directory of a fact table or the file of any other table.
+        """
+        name = table_name(name)
+        if name in FACT_TABLES:
+            return os.path.join(self.root, name)
+        return os.path.join(self.root, f'{name}.parquet')
+
+    def exists(self, name):
+        """
+        Checks whether a table exists.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            bool: True if the table exists.
+        """
+        return os.path.exists(self.path(name))
+
+    def partitions(self, name, years=None):
+        """
+        Lists the files of a table.
+
+        Parameters:
+            name (str): The table name or filename.
+            years (list, optional): The seasons to keep (default is None, all seasons).
+
+        Returns:
+            list: The paths of the Parquet files, ordered by season.
+        """
+        path = self.path(name)
+        if not os.path.isdir(path):
+            return [path]
+        wanted = None if years is None else {f'year={int(year)}' for year in years}
+        files = []
+        for partition in sorted(os.listdir(path), key=_partition_sort_key):
+            if not partition.startswith('year=') or (wanted is not None and partition not in wanted):
+                continue
+            partition_path = os.path.join(path, partition)
+            files.extend(os.path.join(partition_path, file) for file in sorted(os.listdir(partition_path)) if file.endswith('.parquet'))
+        return files
+
+    def signature(self, name):
+        """
+        Retrieves a value that changes whenever the table is rewritten.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            tuple: The latest modification time, total size and number of files, None if the table does not exist.
+        """
+        if not self.exists(name):
+            return None
+        stats = [os.stat(file) for file in self.partitions(name)]
+        return max((stat.st_mtime_ns for stat in stats), default=0), sum(stat.st_size for stat in stats), len(stats)
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def read(self, name, columns=None, years=None, index_col=None):
+        """
+        Reads a table, only opening the partitions of the requested seasons.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            years (list, optional): The seasons to keep (default is None, all seasons).
+            index_col (str, optional): The column to use as index (default is None).
+
+        Returns:
+            pd.DataFrame: The table.
+        """
+        read_columns = None
+        if columns is not None:
+            read_columns = list(columns)
+            if index_col is not None and index_col not in read_columns:
+                read_columns.append(index_col)
+        is_partitioned = table_name(name) in FACT_TABLES
+        files = self.partitions(name, years if is_partitioned else None)
+        if files:
+            data = pd.concat([pd.read_parquet(file, columns=read_columns) for file in files], ignore_index=True)
+        else:
+            # Keep the schema of the table when none of the requested seasons is stored
+            all_files = self.partitions(name)
+            data = pd.read_parquet(all_files[0], columns=read_columns).iloc[0:0] if all_files else pd.DataFrame(columns=read_columns)
+        if years is not None and not is_partitioned:
+            data = filter_years(data, years, self)
+        if index_col is not None:
+            data = data.set_index(index_col)
+        return data
+
+    def iter_chunks(self, name, columns=None, chunksize=100000):
+        """
+        Reads a table in batches of rows, file by file, so only one batch is held in memory at a time.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            chunksize (int, optional): The maximum number of rows per batch (default is 100000).
+
+        Yields:
+            pd.DataFrame: The next batch of the table.
+        """
+        import pyarrow.parquet as pq
+        for file in self.partitions(name):
+            parquet_file = pq.ParquetFile(file)
+            read_columns = None if columns is None else [column for column in columns if column in parquet_file.schema_arrow.names]
+            for batch in parquet_file.iter_batches(batch_size=chunksize, columns=read_columns):
+                yield batch.to_pandas()
+
+    def lookup(self, name, columns=None, **keys):
+        """
+        Reads the rows of a table with the given key values, e.g. one race or the history of one driver.
+
+        The key values are pushed down to pyarrow, which skips the row groups whose statistics exclude them.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            **keys: The value of every key column, e.g. driverId=1.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        filters = [(key, '==', value) for key, value in keys.items()] or None
+        frames = [pd.read_parquet(file, columns=columns, filters=filters) for file in self.partitions(name)]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def write(self, name, data, index_label=None):
+        """
+        Writes a table, replacing its previous content.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The table to write.
+            index_label (str, optional): The label of the index column, the index is not written if None (default is None).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        data = data.rename_axis(index_label).reset_index() if index_label else data.reset_index(drop=True)
+        data = coerce_types(data)
+        path = self.path(name)
+        temp_path = path + '.tmp'
+        if os.path.isdir(temp_path):
+            shutil.rmtree(temp_path)
+
+        if table_name(name) in FACT_TABLES:
+            self._write_partitions(temp_path, data)
+            os.makedirs(temp_path, exist_ok=True)
+            old_path = path + '.old'
+            if os.path.exists(path):
+                os.replace(path, old_path)
+            os.replace(temp_path, path)
+            if os.path.exists(old_path):
+                shutil.rmtree(old_path)
+        else:
+            data.to_parquet(temp_path, index=False)
+            os.replace(temp_path, path)
+
+    def _write_partitions(self, path, data, schema=None):
+        """
+        Writes the rows of a fact table as a new file in each of their season partitions, with the types of schema if given.
+        """
+        import pyarrow.parquet as pq
+        seasons = race_years(data, self)
+        for season, partition in data.groupby(seasons.fillna(-1).astype(int), sort=True):
+            partition_path = os.path.join(path, f'year={season}' if season >= 0 else 'year=unknown')
+            os.makedirs(partition_path, exist_ok=True)
+            part_number = len([file for file in os.listdir(partition_path) if file.endswith('.parquet')])
+            file_path = os.path.join(partition_path, f'part-{part_number:05d}.parquet')
+            if schema is None:
+                partition.to_parquet(file_path, index=False)
+            else:
+                pq.write_table(conform_types(partition, schema), file_path)
+
+    def columns(self, name):
+        """
+        Retrieves the column names of a table without reading its rows.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            list: The column names, including the index column.
+        """
+        import pyarrow.parquet as pq
+        files = self.partitions(name)
+        return list(pq.read_schema(files[0]).names) if files else []
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def append(self, name, data, index_label=None):
+        """
+        Appends rows to a table without rewriting it.
+
+        Rows of a fact table are written as new files in their season partitions,
+        other tables are rewritten since they are a single file.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The rows to append.
+            index_label (str, optional): The label of the index column, the index is not written if None (default is None).
+        """
+        if table_name(name) not in FACT_TABLES:
+            existing_data = self.read(name, index_col=index_label)
+            self.write(name, pd.concat([existing_data, data]), index_label=index_label)
+            return
+        import pyarrow.parquet as pq
+        data = data.rename_axis(index_label).reset_index() if index_label else data.reset_index(drop=True)
+        # Types inferred from one batch can differ from those of the stored seasons, the first partition decides
+        files = self.partitions(name) if self.exists(name) else []
+        if files:
+            self._write_partitions(self.path(name), data, pq.read_schema(files[0]))
+        else:
+            self._write_partitions(self.path(name), coerce_types(data))
+
+class SqliteStore:
+    """
+    Stores the staging tables in an embedded SQLite database.
+
+    Every table has a primary key, its surrogate id or else its natural key, and
+    indexes on its raceId, driverId, constructorId and year columns. Appends are
+    keyed upserts, the rows of one race or one driver are read through the indexes
+    and several writes can share one SQLite transaction. Uses the sqlite3 module
+    of the standard library.
+
+    Attributes:
+        root (str): The directory holding the database.
+        keyed (bool): Whether appends are keyed upserts, True since a row replaces the stored row with its primary key.
+    """
+    keyed = True
+    DATABASE = 'staging.sqlite'
+    INDEXED_COLUMNS = ['raceId', 'driverId', 'constructorId', 'year']
+
+    def __init__(self, root):
+        """
+        Initializes the SqliteStore class.
+
+        Parameters:
+            root (str): The directory holding the database.
+        """
+        self.root = root
+        self._connection = None
+        self._depth = 0
+
+    def __repr__(self):
+        return f'SqliteStore({self.root!r})'
+
+    def __getstate__(self):
+        # A connection can not be shared between processes, the copy opens its own
+        return {'root': self.root, '_connection': None, '_depth': 0}
+
+    def connection(self):
+        """
+        Retrieves the connection to the database, creating the database when it does not exist.
+
+        Returns:
+            sqlite3.Connection: The connection, in autocommit mode outside of atomic.
+        """
+        if self._connection is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(self.root, self.DATABASE), isolation_level=None, check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS _signatures (name TEXT PRIMARY KEY, token TEXT)')
+        return self._connection
+
+    def close(self):
+        """
+        Closes the connection to the database, it is opened again on the next use.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @contextmanager
+    def atomic(self):
+        """
+        Runs the writes of a block in one SQLite transaction, either all of them are stored or none.
+
+        Blocks can be nested, only the outermost one commits.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        connection = self.connection()
+        if self._depth == 0:
+            connection.execute('BEGIN')
+        self._depth += 1
+        try:
+            yield connection
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                connection.execute('ROLLBACK')
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            connection.execute('COMMIT')
+
+    def path(self, name):
+        """
+        Retrieves the path of a table.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            str: The path of the database file, which holds every table.
+        """
+        return os.path.join(self.root, self.DATABASE)
+
+    def exists(self, name):
+        """
+        Checks whether a table exists.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            bool: True if the table exists.
+        """
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+        return self.connection().execute(query, [table_name(name)]).fetchone() is not None
+
+    def signature(self, name):
+        """
+        Retrieves a value that changes whenever the table is written to.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            tuple: A random token drawn on every write, None if the table does not exist.
+        """
+        if not self.exists(name):
+            return None
+        row = self.connection().execute('SELECT token FROM _signatures WHERE name = ?', [table_name(name)]).fetchone()
+        return (row[0] if row is not None else '',)
+
+    def columns(self, name):
+        """
+        Retrieves the column names of a table without reading its rows.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            list: The column names, including the index column.
+        """
+        return list(self.column_map(name))
+
+    def column_map(self, name):
+        """
+        Maps the column names of a table to the names they are stored under, see stored_names.
+
+        Parameters:
+            name (str): The table name or filename.
+
+        Returns:
+            dict: The stored name of every column, in column order.
+        """
+        stored = [row[1] for row in self.connection().execute(f'PRAGMA table_info({_quote(table_name(name))})')]
+        return {re.sub(r'#\d+$', '', column): column for column in stored}
+
+    @staticmethod
+    def stored_names(columns):
+        """
+        Maps column names to names SQLite can store.
+
+        SQLite compares names case insensitively, so a name that only differs in
+        case from an earlier one, like CircuitId after circuitId, gets a #<n> suffix.
+
+        Parameters:
+            columns (list): The column names.
+
+        Returns:
+            list: The stored names, in the same order.
+        """
+        seen = {}
+        stored = []
+        for column in columns:
+            count = seen.get(str(column).casefold(), 0)
+            stored.append(str(column) if count == 0 else f'{column}#{count}')
+            seen[str(column).casefold()] = count + 1
+        return stored
+
+    def primary_key(self, name, columns):
+        """
+        Retrieves the primary key of a table, its surrogate id or else its natural key.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list): The columns of the table.
+
+        Returns:
+            list: The key columns, empty if the table has no primary key.
+        """
+        name = table_name(name)
+        key = [TABLE_INDEX_LABELS[name]] if name in TABLE_INDEX_LABELS else TABLE_KEYS.get(name, [])
+        return key if key and all(column in columns for column in key) else []
+
+    def _select(self, name, columns, extra=()):
+        """
+        Builds the column list of a query, leaving out the columns the table does not have.
+        """
+        column_map = self.column_map(name)
+        wanted = list(column_map) if columns is None else list(columns) + [column for column in extra if column is not None and column not in columns]
+        return ', '.join(f'{_quote(column_map[column])} AS {_quote(column)}' for column in wanted if column in column_map)
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def read(self, name, columns=None, years=None, index_col=None):
+        """
+        Reads a table, the seasons are selected through the indexes.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            years (list, optional): The seasons to keep (default is None, all seasons).
+            index_col (str, optional): The column to use as index (default is None).
+
+        Returns:
+            pd.DataFrame: The table.
+        """
+        name = table_name(name)
+        query = f'SELECT {self._select(name, columns, [index_col])} FROM {_quote(name)}'
+        params = []
+        if years is not None:
+            params = [json.dumps([int(year) for year in years])]
+            if 'year' in self.columns(name):
+                query += ' WHERE "year" IN (SELECT value FROM json_each(?))'
+            else:
+                query += ' WHERE "raceId" IN (SELECT "raceId" FROM "races" WHERE "year" IN (SELECT value FROM json_each(?)))'
+        return pd.read_sql_query(query + ' ORDER BY rowid', self.connection(), params=params, index_col=index_col)
+
+    def iter_chunks(self, name, columns=None, chunksize=100000):
+        """
+        Reads a table in chunks of rows, so only one chunk is held in memory at a time.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            chunksize (int, optional): The number of rows per chunk (default is 100000).
+
+        Yields:
+            pd.DataFrame: The next chunk of the table.
+        """
+        name = table_name(name)
+        query = f'SELECT {self._select(name, columns)} FROM {_quote(name)} ORDER BY rowid'
+        yield from pd.read_sql_query(query, self.connection(), chunksize=chunksize)
+
+    def lookup(self, name, columns=None, **keys):
+        """
+        Reads the rows of a table with the given key values, e.g. one race or the history of one driver.
+
+        The rows are found through the indexes, the rest of the table is not read.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            **keys: The value of every key column, e.g. driverId=1.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        name = table_name(name)
+        query = f'SELECT {self._select(name, columns)} FROM {_quote(name)}'
+        if keys:
+            column_map = self.column_map(name)
+            query += ' WHERE ' + ' AND '.join(f'{_quote(column_map[key])} = ?' for key in keys)
+        params = [value.item() if hasattr(value, 'item') else value for value in keys.values()]
+        return pd.read_sql_query(query + ' ORDER BY rowid', self.connection(), params=params)
+
+    def query(self, sql, params=None, frames=None):
+        """
+        Runs a SQL query on the tables.
+
+        Parameters:
+            sql (str): The query.
+            params (list, optional): The parameters of the query (default is None).
+            frames (dict, optional): Dataframes by name, available to the query as indexed temporary tables (default is None).
+
+        Returns:
+            pd.DataFrame: The result of the query.
+        """
+        frames = frames or {}
+        with self.atomic() as connection:
+            try:
+                for name, frame in frames.items():
+                    frame = frame.reset_index(drop=True)
+                    self._create(connection, name, frame, temporary=True)
+                    self._insert(connection, name, frame)
+                return pd.read_sql_query(sql, connection, params=params)
+            finally:
+                for name in frames:
+                    connection.execute(f'DROP TABLE IF EXISTS temp.{_quote(name)}')
+
+    def _create(self, connection, name, data, temporary=False):
+        """
+        Creates a table with the columns of a dataframe, its primary key and its indexes.
+        """
+        primary_key = self.primary_key(name, data.columns)
+        column_map = dict(zip(data.columns, self.stored_names(data.columns)))
+        definitions = [f'{_quote(column_map[column])} {_sql_type(data[column])}' for column in data.columns]
+        if len(primary_key) == 1 and _sql_type(data[primary_key[0]]) == 'INTEGER':
+            # A single integer key is the rowid, so the rows are stored in key order
+            position = list(data.columns).index(primary_key[0])
+            definitions[position] += ' PRIMARY KEY'
+        elif primary_key:
+            definitions.append(f"PRIMARY KEY ({', '.join(_quote(column_map[column]) for column in primary_key)})")
+        connection.execute(f"CREATE {'TEMP ' if temporary else ''}TABLE {_quote(name)} ({', '.join(definitions)})")
+        for column in self.INDEXED_COLUMNS:
+            if column in data.columns and primary_key[:1] != [column]:
+                index_name = f"{'temp.' if temporary else ''}{_quote(f'{name}_{column}')}"
+                connection.execute(f'CREATE INDEX {index_name} ON {_quote(name)} ({_quote(column_map[column])})')
+
+    def _insert(self, connection, name, data, replace=False):
+        """
+        Inserts the rows of a dataframe, replacing the rows with the same primary key if replace is True.
+        """
+        column_map = self.column_map(name)
+        columns = ', '.join(_quote(column_map[column]) for column in data.columns)
+        placeholders = ', '.join('?' for _ in data.columns)
+        connection.executemany(f"INSERT {'OR REPLACE ' if replace else ''}INTO {_quote(name)} ({columns}) VALUES ({placeholders})",
+                               _sql_rows(data))
+
+    def _touch(self, connection, name):
+        """
+        Draws a new signature token for a table.
+        """
+        connection.execute('INSERT INTO _signatures VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET token = excluded.token',
+                           [name, uuid.uuid4().hex])
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def write(self, name, data, index_label=None):
+        """
+        Writes a table, replacing its previous content.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The table to write.
+            index_label (str, optional): The label of the index column, the index is not written if None (default is None).
+        """
+        name = table_name(name)
+        data = data.rename_axis(index_label).reset_index() if index_label else data.reset_index(drop=True)
+        data = coerce_types(data)
+        with self.atomic() as connection:
+            connection.execute(f'DROP TABLE IF EXISTS {_quote(name)}')
+            self._create(connection, name, data)
+            self._insert(connection, name, data)
+            self._touch(connection, name)
+
+    @instrumented(fields=lambda arguments: {'table': table_name(arguments['name'])})
+    def append(self, name, data, index_label=None):
+        """
+        Upserts rows into a table, a row replaces the stored row with the same primary key.
+
+        Columns the table does not have yet are added to it.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The rows to upsert, see match_keys for numbering them.
+            index_label (str, optional): The label of the index column, the index is not written if None (default is None).
+        """
+        name = table_name(name)
+        data = data.rename_axis(index_label).reset_index() if index_label else data.reset_index(drop=True)
+        data = coerce_types(data)
+        with self.atomic() as connection:
+            if not self.exists(name):
+                self._create(connection, name, data)
+            else:
+                table_columns = self.columns(name)
+                new_columns = [column for column in data.columns if column not in table_columns]
+                for column, stored in zip(new_columns, self.stored_names(table_columns + new_columns)[len(table_columns):]):
+                    connection.execute(f'ALTER TABLE {_quote(name)} ADD COLUMN {_quote(stored)} {_sql_type(data[column])}')
+            self._insert(connection, name, data, replace=True)
+            self._touch(connection, name)
+
+    def match_keys(self, name, data, index_label=None, pending=None):
+        """
+        Numbers rows for an upsert by their natural key.
+
+        Rows whose natural key is stored, or pending, take the index of that row so
+        they replace it, the other rows are numbered after the highest index. Only
+        the stored rows of the races in the data are looked up.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The rows to number.
+            index_label (str, optional): The label of the index column, rows are only matched by their primary key if None (default is None).
+            pending (pd.DataFrame, optional): Numbered rows that are not stored yet (default is None).
+
+        Returns:
+            pd.DataFrame: The rows with their index.
+        """
+        name = table_name(name)
+        if index_label is None:
+            return data.reset_index(drop=True)
+        key = TABLE_KEYS[name]
+        existing = pd.DataFrame(columns=key)
+        max_index = None
+        if self.exists(name):
+            race_ids = json.dumps(sorted(int(race_id) for race_id in data['raceId'].dropna().unique()))
+            column_map = self.column_map(name)
+            query = f'SELECT {self._select(name, key + [index_label])} FROM {_quote(name)} WHERE {_quote(column_map["raceId"])} IN (SELECT value FROM json_each(?))'
+            existing = pd.read_sql_query(query + ' ORDER BY rowid', self.connection(), params=[race_ids], index_col=index_label)
+            max_index = self.connection().execute(f'SELECT MAX({_quote(column_map[index_label])}) FROM {_quote(name)}').fetchone()[0]
+        if pending is not None and not pending.empty:
+            existing = pd.concat([existing[~existing.index.isin(pending.index)], pending[key]])
+            max_index = max(int(pending.index.max()), -1 if max_index is None else max_index)
+        return assign_keyed_index(data, existing, key, max_index)
+
+def _quote(identifier):
+    """
+    Quotes a table or column name for SQLite.
+    """
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+def _sql_type(values):
+    """
+    Retrieves the SQLite column type of a column.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.categories
+    if pd.api.types.is_bool_dtype(values.dtype) or pd.api.types.is_integer_dtype(values.dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(values.dtype):
+        return 'REAL'
+    return 'TEXT'
+
+def _sql_rows(data):
+    """
+    Converts the rows of a dataframe to tuples of Python values, missing values become None.
+    """
+    columns = []
+    for column in data.columns:
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        if pd.api.types.is_datetime64_any_dtype(values.dtype) or pd.api.types.is_timedelta64_dtype(values.dtype):
+            values = values.astype(str).where(values.notna())
+        columns.append([None if pd.isna(value) else value for value in values.tolist()])
+    return zip(*columns)
+
+def assign_keyed_index(data, existing, key, max_index):
+    """
+    Numbers rows by their natural key.
+
+    Rows take the index of the existing row with the same key, the other rows are
+    numbered after max_index. Repeated keys, like shared drives in early seasons,
+    are matched by their order of occurrence.
+
+    Parameters:
+        data (pd.DataFrame): The rows to number.
+        existing (pd.DataFrame): The existing rows with their index and at least the key columns.
+        key (list): The key columns.
+        max_index (int): The highest index in use, None if there is none.
+
+    Returns:
+        pd.DataFrame: The rows with their index.
+    """
+    left = data[key].assign(_occurrence=data.groupby(key, dropna=False).cumcount().to_numpy())
+    right = existing[key].assign(_occurrence=existing.groupby(key, dropna=False).cumcount().to_numpy(), _index=existing.index)
+    matched = left.reset_index(drop=True).merge(right, on=key + ['_occurrence'], how='left')['_index'].to_numpy(dtype=float)
+    new = np.isnan(matched)
+    first_index = 0 if max_index is None else int(max_index) + 1
+    matched[new] = np.arange(first_index, first_index + new.sum())
+    return data.set_axis(matched.astype(np.int64))
+
+def drop_missing_keys(data, name, key='raceId'):
+    """
+    Drops the rows without a key, they cannot be matched against the key index of the table.
+
+    Parameters:
+        data (pd.DataFrame): The rows to add to the table.
+        name (str): The table name, used in the warning.
+        key (str): The key column (default is 'raceId').
+
+    Returns:
+        pd.DataFrame: The rows with a key.
+    """
+    missing = data[key].isna()
+    if missing.any():
+        logging.warning(f'Dropping {missing.sum()} rows of the {table_name(name)} without a {key}')
+        return data[~missing]
+    return data
+
+def select_keys(data, keys):
+    """
+    Keeps the rows of a table with the given key values.
+
+    Parameters:
+        data (pd.DataFrame): The table.
+        keys (dict): The value of every key column.
+
+    Returns:
+        pd.DataFrame: The matching rows.
+    """
+    mask = pd.Series(True, index=data.index)
+    for key, value in keys.items():
+        mask &= data[key] == value
+    return data[mask]
+
+def _partition_sort_key(partition):
+    """
+    Sorts year=<year> partitions numerically with the unknown partition last.
+    """
+    season = partition.split('=', 1)[-1]
+    return (0, int(season)) if season.isdigit() else (1, 0)
+
+def race_years(data, store):
+    """
+    Retrieves the season of every row of a table.
+
+    Parameters:
+        data (pd.DataFrame): A table with a year or raceId column.
+        store (CsvStore or ParquetStore): The store holding the races table.
+
+    Returns:
+        pd.Series: The season of every row, missing if the race is unknown.
+    """
+    if 'year' in data.columns:
+        return pd.to_numeric(data['year'], errors='coerce')
+    if 'raceId' in data.columns and store.exists('races'):
+        races = store.read('races', columns=['raceId', 'year'])
+        return pd.to_numeric(data['raceId'].map(races.set_index('raceId')['year']), errors='coerce')
+    return pd.Series(float('nan'), index=data.index)
+
+def filter_years(data, years, store):
+    """
+    Keeps the rows of a table that belong to the given seasons.
+
+    Parameters:
+        data (pd.DataFrame): A table with a year or raceId column.
+        years (list): The seasons to keep.
+        store (CsvStore or ParquetStore): The store holding the races table.
+
+    Returns:
+        pd.DataFrame: The rows of the requested seasons.
+    """
+    return data[race_years(data, store).isin([int(year) for year in years])]
+
+def load_key_index(store, name, key='raceId', index_label=None):
+    """
+    Loads the keys of a table from its sidecar index, rebuilding the index when it is missing or stale.
+
+    The sidecar is stored next to the table as .<table>.<key>.json together with
+    the table signature it was built from, any rewrite of the table makes it stale.
+
+    Parameters:
+        store (CsvStore or ParquetStore): The store holding the table.
+        name (str): The table name or filename.
+        key (str): The key column (default is 'raceId').
+        index_label (str, optional): The label of the index column (default is None).
+
+    Returns:
+        tuple: The set of keys in the table and the highest index value, None without an index column.
+    """
+    index_path = os.path.join(store.root, f'.{table_name(name)}.{key}.json')
+    signature = store.signature(name)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            key_index = json.load(f)
+        if key_index['signature'] == list(signature) and key_index['index_label'] == index_label:
+            return set(key_index['keys']), key_index['max_index']
+
+    logging.info(f'Rebuilding the {key} index of {table_name(name)}')
+    columns = [key] if index_label is None else [key, index_label]
+    existing_data = store.read(name, columns=columns, index_col=index_label)
+    keys = set(existing_data[key].dropna().tolist())
+    max_index = int(existing_data.index.max()) if index_label is not None and not existing_data.empty else None
+    save_key_index(store, name, keys, max_index, key=key, index_label=index_label)
+    return keys, max_index
+
+def save_key_index(store, name, keys, max_index, key='raceId', index_label=None):
+    """
+    Saves the sidecar key index of a table for its current signature.
+
+    Parameters:
+        store (CsvStore or ParquetStore): The store holding the table.
+        name (str): The table name or filename.
+        keys (set): The keys in the table.
+        max_index (int): The highest index value, None without an index column.
+        key (str): The key column (default is 'raceId').
+        index_label (str, optional): The label of the index column (default is None).
+    """
+    index_path = os.path.join(store.root, f'.{table_name(name)}.{key}.json')
+    key_index = {
+        'signature': list(store.signature(name)),
+        'index_label': index_label,
+        'max_index': max_index,
+        'keys': sorted(int(value) for value in keys if not pd.isna(value))
+    }
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(key_index, f)
+    os.replace(temp_path, index_path)
+
+STORAGE_BACKENDS = {
+    'csv': CsvStore,
+    'parquet': ParquetStore,
+    'sqlite': SqliteStore
+}
+
+def get_store(root=None, backend=None):
+    """
+    Retrieves the store of the staging tables.
+
+    The backend is taken from the F1_STORAGE_BACKEND environment variable when not
+    given, so the backend can be switched without changing any call site.
+
+    Parameters:
+        root (str, optional): The directory holding the tables (default is None, the staging path).
+        backend (str, optional): The storage backend, one of STORAGE_BACKENDS (default is None).
+
+    Returns:
+        CsvStore, ParquetStore or SqliteStore: The store.
+    """
+    if root is None:
+        root = get_staging_path()
+    if backend is None:
+        backend = os.environ.get('F1_STORAGE_BACKEND', 'csv')
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}', expected one of {', '.join(STORAGE_BACKENDS)}.")
+    return STORAGE_BACKENDS[backend](root)
+
+TABLE_INDEX_LABELS = {
+    'results': 'resultId',
+    'sprint_results': 'resultId',
+    'driver_standings': 'driverStandingsId',
+    'constructor_standings': 'constructorStandingsId'
+}
+
+def convert_store(source, target, tables=None):
+    """
+    Copies the staging tables from one store to another.
+
+    Dimension tables are copied first so the fact tables can be partitioned by season.
+
+    Parameters:
+        source (CsvStore, ParquetStore or SqliteStore): The store to read from.
+        target (CsvStore, ParquetStore or SqliteStore): The store to write to.
+        tables (list, optional): The tables to copy (default is None, all staging tables).
+    """
+    for name in tables or DIMENSION_TABLES + FACT_TABLES:
+        if not source.exists(name):
+            logging.info(f'Skipping {name}, it does not exist in the source store')
+            continue
+        index_label = TABLE_INDEX_LABELS.get(name)
+        target.write(name, source.read(name, index_col=index_label), index_label=index_label)
+        logging.info(f'Copied {name}')
+
+class StagingTransaction:
+    """
+    Collects the changes of a run in memory and writes them to a store at once.
+
+    Reads through the transaction see the pending changes while nothing reaches
+    the store before commit. The commit first journals a hard linked backup of
+    every table it touches, so a commit that fails halfway, or a process that
+    dies during it, is rolled back when the next transaction on the store starts.
+    The tables of a SqliteStore are written in one SQLite transaction instead.
+
+    Attributes:
+        store (CsvStore, ParquetStore or SqliteStore): The store the changes are written to.
+    """
+
+    def __init__(self, store):
+        """
+        Initializes the StagingTransaction class, rolling back an interrupted commit first.
+
+        Parameters:
+            store (CsvStore, ParquetStore or SqliteStore): The store the changes are written to.
+        """
+        self.store = store
+        self._base = {}
+        self._tables = {}
+        self._appends = {}
+        self._files = {}
+        self.recover()
+
+    def _transaction_path(self, *parts):
+        return os.path.join(self.store.root, '.transaction', *parts)
+
+    def _table(self, name):
+        """
+        Retrieves the full content of a table as it will be after the commit.
+        """
+        if name in self._tables:
+            data, index_label = self._tables[name]
+            data = data.rename_axis(index_label).reset_index() if index_label else data.reset_index(drop=True)
+        else:
+            if name not in self._base:
+                self._base[name] = self.store.read(name) if self.store.exists(name) else pd.DataFrame()
+            data = self._base[name]
+        if name in self._appends:
+            rows, index_label = self._appends[name]
+            rows = rows.rename_axis(index_label).reset_index() if index_label else rows.reset_index(drop=True)
+            data = pd.concat([data, rows], ignore_index=True) if len(data.columns) else rows
+            if self.store.keyed:
+                # Upserted rows replace the stored rows with their primary key
+                key = [index_label] if index_label else self.store.primary_key(name, data.columns)
+                data = data.drop_duplicates(subset=key, keep='last')
+                if index_label:
+                    data = data.sort_values(index_label, kind='stable')
+                data = data.reset_index(drop=True)
+        return data
+
+    def read(self, name, columns=None, years=None, index_col=None):
+        """
+        Reads a table including the pending changes.
+
+        Every table is read from the store at most once per transaction.
+
+        Parameters:
+            name (str): The table name or filename.
+            columns (list, optional): The columns to read (default is None, all columns).
+            years (list, optional): The seasons to keep (default is None, all seasons).
+            index_col (str, optional): The column to use as index (default is None).
+
+        Returns:
+            pd.DataFrame: The table.
+        """
+        data = self._table(table_name(name))
+        if years is not None:
+            if 'year' in data.columns:
+                seasons = data['year']
+            else:
+                races = self._table('races')
+                seasons = data['raceId'].map(races.set_index('raceId')['year'])
+            data = data[pd.to_numeric(seasons, errors='coerce').isin([int(year) for year in years])]
+        if index_col is not None:
+            data = data.set_index(index_col)
+        if columns is not None:
+            data = data[[column for column in columns if column != index_col]]
+        return data.copy()
+
+    def write(self, name, data, index_label=None):
+        """
+        Replaces the content of a table on commit.
+
+        Parameters:
+            name (str): The table name or filename.
+            data (pd.DataFrame): The table to write.
+            index_label (str, optional): The label of the index column, the index is not written if None (default is None).
+        """
+        name = table_name(name)
+        self._tables[name] = (data, index_label)
+        self._appends.pop(name, None)
+
+    def add_new_entries(self, name, new_data, index_label=None):
+        """
+        Adds the rows of races a table does not have yet on commit.
+
+        The raceIds of the stored table come from its sidecar key index, so the
+        table itself is not read. The rows are numbered after the last index value.
+        A keyed store upserts every row instead, see SqliteStore.match_keys.
+
+        Parameters:
+            name (str): The table name or filename.
+            new_data (pd.DataFrame): The new data entries to be added.
+            index_label (str, optional): The label for the index column (default is None).
+
+        Returns:
+            pd.DataFrame: The rows that will be added.
+        """
+        name = table_name(name)
+        new_data = drop_missing_keys(new_data, name)
+        if self.store.keyed and name not in self._tables:
+            pending = self._appends[name][0] if name in self._appends else None
+            new_entries = self.store.match_keys(name, new_data, index_label=index_label, pending=pending)
+            rows = new_entries if pending is None else pd.concat([pending, new_entries])
+            key = None if index_label else self.store.primary_key(name, rows.columns)
+            rows = rows[~rows.index.duplicated(keep='last')] if index_label else rows.drop_duplicates(subset=key, keep='last')
+            self._appends[name] = (rows, index_label)
+            logging.info(f'Staged upserts for the {name}: {set(new_entries["raceId"].to_list())}')
+            return new_entries
+
+        if name in self._tables:
+            existing = self._table(name)
+            existing_race_ids = set(existing['raceId'].dropna().tolist())
+            max_index = int(existing[index_label].max()) if index_label and not existing.empty else None
+        elif self.store.exists(name):
+            existing_race_ids, max_index = load_key_index(self.store, name, index_label=index_label)
+            if name in self._appends:
+                rows, _ = self._appends[name]
+                existing_race_ids = existing_race_ids | set(rows['raceId'].tolist())
+                max_index = int(rows.index[-1]) if index_label else None
+        else:
+            existing_race_ids, max_index = set(), None
+
+        new_entries = new_data[~new_data['raceId'].isin(existing_race_ids)]
+        if new_entries.empty:
+            logging.info(f'No new entries found for the {name}')
+            return new_entries
+
+        first_index = 0 if max_index is None else max_index + 1
+        new_entries = new_entries.set_axis(range(first_index, first_index + len(new_entries)))
+        if name in self._tables:
+            data, _ = self._tables[name]
+            self._tables[name] = (pd.concat([data, new_entries]), index_label)
+        elif name in self._appends:
+            self._appends[name] = (pd.concat([self._appends[name][0], new_entries]), index_label)
+        else:
+            self._appends[name] = (new_entries, index_label)
+        logging.info(f'Staged new entries for the {name}: {set(new_entries["raceId"].to_list())}')
+        return new_entries
+
+    def write_file(self, filename, text):
+        """
+        Replaces a text file next to the tables on commit, e.g. the ingestion watermark.
+
+        Parameters:
+            filename (str): The filename, relative to the store root.
+            text (str): The content of the file.
+        """
+        self._files[filename] = text
+
+    @instrumented()
+    def commit(self):
+        """
+        Writes all pending changes, either all of them are written or none.
+
+        Dimension tables are written first, so the fact tables can be partitioned by season.
+        """
+        names = sorted(self._tables, key=lambda name: (name not in DIMENSION_TABLES, name))
+        if not names + list(self._appends) + list(self._files):
+            logging.info('Nothing to commit')
+            return
+
+        # A SQLite store writes its tables in one SQLite transaction, only the files need a backup
+        atomic = self.store.atomic() if isinstance(self.store, SqliteStore) else nullcontext()
+        paths = [] if isinstance(self.store, SqliteStore) else [self.store.path(name) for name in names + list(self._appends)]
+        paths += [os.path.join(self.store.root, filename) for filename in self._files]
+
+        self._backup(paths)
+        try:
+            with atomic:
+                for name in names:
+                    data, index_label = self._tables[name]
+                    self.store.write(name, data, index_label=index_label)
+                for name, (rows, index_label) in self._appends.items():
+                    self._append(name, rows, index_label)
+            for filename, text in self._files.items():
+                file_path = os.path.join(self.store.root, filename)
+                with open(file_path + '.tmp', 'w') as f:
+                    f.write(text)
+                os.replace(file_path + '.tmp', file_path)
+        except BaseException:
+            logging.error('The commit failed, rolling back the staging tables')
+            self._rollback()
+            raise
+        self._finish()
+        logging.info(f'Committed {names + list(self._appends) + list(self._files)}')
+
+        self._base.clear()
+        self._tables.clear()
+        self._appends.clear()
+        self._files.clear()
+
+    def _append(self, name, rows, index_label):
+        """
+        Appends staged rows to a stored table and updates its sidecar key index.
+        """
+        if self.store.keyed:
+            self.store.append(name, rows, index_label=index_label)
+            return
+        if not self.store.exists(name) or not self.store.columns(name):
+            self.store.write(name, rows, index_label=index_label)
+            existing_race_ids = set()
+        else:
+            existing_race_ids, _ = load_key_index(self.store, name, index_label=index_label)
+            if set(rows.columns) - set(self.store.columns(name)):
+                logging.info(f'Rewriting {name} to add the columns {sorted(set(rows.columns) - set(self.store.columns(name)))}')
+                existing_data = self.store.read(name, index_col=index_label)
+                self.store.write(name, pd.concat([existing_data, rows]), index_label=index_label)
+            else:
+                self.store.append(name, rows, index_label=index_label)
+        save_key_index(self.store, name, existing_race_ids | set(rows['raceId'].to_list()),
+                       int(rows.index[-1]) if index_label else None, index_label=index_label)
+
+    def _backup(self, paths):
+        """
+        Hard links the current files of the given paths into the backup and writes the journal.
+
+        Parquet files are never modified in place and CSV files are only appended to,
+        so a link and the original size are enough to restore a file.
+        """
+        os.makedirs(self._transaction_path(), exist_ok=True)
+        entries = []
+        for path in paths:
+            relative_path = os.path.relpath(path, self.store.root)
+            backup_path = self._transaction_path('backup', relative_path)
+            if os.path.isdir(path):
+                for directory, _, files in os.walk(path):
+                    backup_directory = os.path.join(backup_path, os.path.relpath(directory, path))
+                    os.makedirs(backup_directory, exist_ok=True)
+                    for file in files:
+                        _link_or_copy(os.path.join(directory, file), os.path.join(backup_directory, file))
+                entries.append({'path': relative_path, 'kind': 'directory'})
+            elif os.path.exists(path):
+                _link_or_copy(path, backup_path)
+                entries.append({'path': relative_path, 'kind': 'file', 'size': os.path.getsize(path)})
+            else:
+                entries.append({'path': relative_path, 'kind': 'missing'})
+
+        journal_path = self._transaction_path('journal.json')
+        with open(journal_path + '.tmp', 'w') as f:
+            json.dump(entries, f)
+        os.replace(journal_path + '.tmp', journal_path)
+
+    def _rollback(self):
+        """
+        Restores every path of the journal from the backup.
+        """
+        with open(self._transaction_path('journal.json')) as f:
+            entries = json.load(f)
+        for entry in entries:
+            path = os.path.join(self.store.root, entry['path'])
+            backup_path = self._transaction_path('backup', entry['path'])
+            for leftover in [path + '.tmp', path + '.old']:
+                if os.path.isdir(leftover):
+                    shutil.rmtree(leftover)
+                elif os.path.exists(leftover):
+                    os.remove(leftover)
+            if os.path.isdir(path) and entry['kind'] != 'file':
+                shutil.rmtree(path)
+            elif os.path.exists(path) and entry['kind'] == 'missing':
+                os.remove(path)
+            if entry['kind'] == 'directory':
+                os.replace(backup_path, path)
+            elif entry['kind'] == 'file':
+                os.replace(backup_path, path)
+                with open(path, 'rb+') as f:
+                    f.truncate(entry['size'])
+        self._finish()
+        logging.info(f'Rolled back {[entry["path"] for entry in entries]}')
+
+    def _finish(self):
+        """
+        Removes the journal and the backup, the journal first so a crash never leaves a partial backup to restore.
+        """
+        journal_path = self._transaction_path('journal.json')
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        if os.path.isdir(self._transaction_path()):
+            shutil.rmtree(self._transaction_path())
+
+    def recover(self):
+        """
+        Rolls back a commit that was interrupted before it finished.
+        """
+        if os.path.exists(self._transaction_path('journal.json')):
+            logging.warning(f'Found an interrupted commit in {self.store.root}, rolling it back')
+            self._rollback()
+        elif os.path.isdir(self._transaction_path()):
+            shutil.rmtree(self._transaction_path())
+
+def _link_or_copy(source, target):
+    """
+    Hard links a file, copying it when the filesystem does not support hard links.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Convert the staging tables between storage backends.')
+    parser.add_argument('--source', default='csv', choices=list(STORAGE_BACKENDS))
+    parser.add_argument('--target', default='parquet', choices=list(STORAGE_BACKENDS))
+    parser.add_argument('--root', default=None, help='The staging directory (default is ../Data/Staging).')
+    args = parser.parse_args()
+
+    convert_store(get_store(args.root, args.source), get_store(args.root, args.target))
@@ -0,0 +1,337 @@
+import numpy as np
+import pandas as pd
+from my_functions.update_functions import format_lap_times, update_standings
+
+RACE_POINTS = [25, 18, 15, 12, 10, 8, 6, 4, 2, 1]
+SPRINT_POINTS = [8, 7, 6, 5, 4, 3, 2, 1]
+
+def _season_lineups(seasons, drivers_per_race):
+    """
+    Picks the drivers and constructors of every season from rotating pools, so careers span several seasons.
+    """
+    driver_pool = drivers_per_race * 3
+    lineups = []
+    for season in range(seasons):
+        drivers = (np.arange(drivers_per_race) + season * 3) % driver_pool + 1
+        constructors = (np.arange(drivers_per_race) // 2 + season) % (drivers_per_race // 2 * 3) + 1
+        lineups.append((drivers, constructors))
+    return lineups, driver_pool
+
+def make_staging_tables(seasons, last_year=2023, drivers_per_race=20, seed=0):
+    """
+    Generates Ergast shaped staging tables with a realistic shape and size.
+
+    Every season has 17 to 24 rounds and, from 2021 on, six sprint weekends.
+    Results, qualifying and lap times are random but consistent with each other,
+    the standings are calculated from the results with update_standings.
+
+    Parameters:
+        seasons (int): The number of seasons, ending with last_year.
+        last_year (int): The last season (default is 2023).
+        drivers_per_race (int): The number of drivers in every race (default is 20).
+        seed (int): The seed of the random generator (default is 0).
+
+    Returns:
+        dict: The tables by name, in the column layout of the Ergast CSV files.
+    """
+    rng = np.random.default_rng(seed)
+    lineups, driver_pool = _season_lineups(seasons, drivers_per_race)
+    years = range(last_year - seasons + 1, last_year + 1)
+
+    races = []
+    for year in years:
+        rounds = int(rng.integers(17, 25))
+        circuits = rng.choice(np.arange(1, 36), rounds, replace=False)
+        for round_number, circuit in enumerate(circuits, start=1):
+            date = pd.Timestamp(f'{year}-03-01') + pd.Timedelta(days=14 * (round_number - 1))
+            races.append((year, round_number, int(circuit), f'Circuit {circuit} Grand Prix', date.strftime('%Y-%m-%d'), '\\N', 'http://'))
+    races = pd.DataFrame(races, columns=['year', 'round', 'circuitId', 'name', 'date', 'time', 'url'])
+    races.insert(0, 'raceId', np.arange(1, len(races) + 1))
+
+    drivers = pd.DataFrame({
+        'driverId': np.arange(1, driver_pool + 1),
+        'driverRef': [f'driver_{number}' for number in range(1, driver_pool + 1)],
+        'number': [str(number) if number % 3 == 0 else '\\N' for number in range(1, driver_pool + 1)],
+        'code': [f'D{number:02d}' for number in range(1, driver_pool + 1)],
+        'forename': 'First',
+        'surname': [f'Driver{number}' for number in range(1, driver_pool + 1)],
+        'dob': '1990-01-01',
+        'nationality': 'Unknown',
+        'url': 'http://'
+    })
+    constructor_pool = drivers_per_race // 2 * 3
+    constructors = pd.DataFrame({
+        'constructorId': np.arange(1, constructor_pool + 1),
+        'constructorRef': [f'team_{number}' for number in range(1, constructor_pool + 1)],
+        'name': [f'Team {number}' for number in range(1, constructor_pool + 1)],
+        'nationality': 'Unknown',
+        'url': 'http://'
+    })
+
+    # One row per driver per race, the lineup comes from the season of the race
+    season_index = (races['year'] - years[0]).to_numpy()
+    race_drivers = np.concatenate([lineups[season][0] for season in season_index])
+    race_constructors = np.concatenate([lineups[season][1] for season in season_index])
+    race_ids = np.repeat(races['raceId'].to_numpy(), drivers_per_race)
+    positions = np.concatenate([rng.permutation(drivers_per_race) + 1 for _ in range(len(races))])
+    grids = np.concatenate([rng.permutation(drivers_per_race) + 1 for _ in range(len(races))])
+    finished = positions <= drivers_per_race - 3
+    race_laps = np.repeat(rng.integers(50, 71, len(races)), drivers_per_race)
+    laps = np.where(finished, race_laps, (race_laps * rng.uniform(0.1, 0.9, len(race_ids))).astype(int))
+    points = np.where(positions <= len(RACE_POINTS), np.array(RACE_POINTS + [0] * drivers_per_race)[positions - 1], 0).astype(float)
+    winner_milliseconds = rng.integers(5_200_000, 5_800_000, len(race_ids))
+    gap_milliseconds = np.where(positions == 1, 0, rng.integers(1_000, 90_000, len(race_ids)))
+    fastest_seconds = rng.normal(88, 3, len(race_ids))
+
+    results = pd.DataFrame({
+        'resultId': np.arange(1, len(race_ids) + 1),
+        'raceId': race_ids,
+        'driverId': race_drivers,
+        'constructorId': race_constructors,
+        'number': race_drivers.astype(str),
+        'grid': grids,
+        'position': np.where(finished, positions.astype(str), '\\N'),
+        'positionText': np.where(finished, positions.astype(str), 'R'),
+        'positionOrder': positions,
+        'points': points,
+        'laps': laps,
+        'time': np.where(positions == 1, format_lap_times(winner_milliseconds / 1000),
+                         np.where(finished, np.char.add('+', np.char.mod('%.3f', gap_milliseconds / 1000)), '\\N')),
+        'milliseconds': np.where(finished, (winner_milliseconds + gap_milliseconds).astype(str), '\\N'),
+        'fastestLap': rng.integers(10, 50, len(race_ids)).astype(str),
+        'rank': np.concatenate([rng.permutation(drivers_per_race) + 1 for _ in range(len(races))]).astype(str),
+        'fastestLapTime': format_lap_times(fastest_seconds),
+        'fastestLapSpeed': np.char.mod('%.3f', rng.normal(210, 5, len(race_ids))),
+        'statusId': np.where(finished, 1, rng.integers(2, 140, len(race_ids)))
+    })
+
+    # Sprint weekends exist from 2021 on
+    sprint_races = races[(races['year'] >= 2021)].groupby('year').head(6)
+    sprint_rows = results[results['raceId'].isin(sprint_races['raceId'])]
+    sprint_positions = np.concatenate([rng.permutation(drivers_per_race) + 1 for _ in range(len(sprint_races))])
+    sprint_results = sprint_rows.assign(
+        resultId=np.arange(1, len(sprint_rows) + 1),
+        positionOrder=sprint_positions,
+        position=sprint_positions.astype(str),
+        positionText=sprint_positions.astype(str),
+        points=np.where(sprint_positions <= len(SPRINT_POINTS), np.array(SPRINT_POINTS + [0] * drivers_per_race)[sprint_positions - 1], 0).astype(float),
+        laps=np.repeat(rng.integers(17, 25, len(sprint_races)), drivers_per_race)
+    ).reset_index(drop=True)
+
+    qualifying_positions = np.concatenate([rng.permutation(drivers_per_race) + 1 for _ in range(len(races))])
+    q_seconds = rng.normal(80, 2, len(race_ids))
+    qualifying = pd.DataFrame({
+        'qualifyId': np.arange(1, len(race_ids) + 1),
+        'raceId': race_ids,
+        'driverId': race_drivers,
+        'constructorId': race_constructors,
+        'number': race_drivers,
+        'position': qualifying_positions,
+        'q1': format_lap_times(q_seconds),
+        'q2': np.where(qualifying_positions <= 15, format_lap_times(q_seconds - 0.3), '\\N'),
+        'q3': np.where(qualifying_positions <= 10, format_lap_times(q_seconds - 0.6), '\\N')
+    })
+
+    # Every driver drives the laps of their result, lap times vary around a race pace
+    lap_race_ids = np.repeat(race_ids, laps)
+    lap_driver_ids = np.repeat(race_drivers, laps)
+    lap_numbers = np.concatenate([np.arange(1, count + 1) for count in laps])
+    lap_seconds = np.repeat(rng.normal(90, 4, len(race_ids)), laps) + rng.gamma(2.0, 0.5, len(lap_race_ids))
+    lap_times = pd.DataFrame({
+        'raceId': lap_race_ids,
+        'driverId': lap_driver_ids,
+        'lap': lap_numbers,
+        'position': np.repeat(positions, laps),
+        'time': format_lap_times(lap_seconds),
+        'milliseconds': (lap_seconds * 1000).astype(np.int64)
+    })
+
+    driver_standings, constructor_standings = update_standings(results, sprint_results, races)
+    driver_standings = driver_standings.reset_index(drop=True)
+    driver_standings.insert(0, 'driverStandingsId', np.arange(1, len(driver_standings) + 1))
+    constructor_standings = constructor_standings.reset_index(drop=True)
+    constructor_standings.insert(0, 'constructorStandingsId', np.arange(1, len(constructor_standings) + 1))
+
+    return {
+        'races': races,
+        'drivers': drivers,
+        'constructors': constructors,
+        'results': results,
+        'sprint_results': sprint_results,
+        'qualifying': qualifying,
+        'lap_times': lap_times,
+        'driver_standings': driver_standings[['driverStandingsId', 'raceId', 'driverId', 'points', 'position', 'positionText', 'wins']],
+        'constructor_standings': constructor_standings[['constructorStandingsId', 'raceId', 'constructorId', 'points', 'position', 'positionText', 'wins']]
+    }
+
+class SyntheticSession:
+    """
+    A stand-in for a loaded fastf1 session with fastf1 shaped laps and results.
+
+    Attributes:
+        laps (pd.DataFrame): The laps, in the columns of fastf1.core.Laps.
+        results (pd.DataFrame): The results, in the columns of fastf1.core.SessionResults.
+        session_info (dict): The session info with the meeting details.
+    """
+
+    def __init__(self, laps, results, session_info):
+        """
+        Initializes the SyntheticSession class.
+
+        Parameters:
+            laps (pd.DataFrame): The laps.
+            results (pd.DataFrame): The results.
+            session_info (dict): The session info.
+        """
+        self._laps = laps
+        self._results = results
+        self.session_info = session_info
+
+    def load(self, **kwargs):
+        """
+        Does nothing, the data is generated up front.
+        """
+
+    @property
+    def laps(self):
+        return self._laps.copy()
+
+    @property
+    def results(self):
+        return self._results.copy()
+
+class SyntheticEvent(dict):
+    """
+    A stand-in for a fastf1 event, a mapping of the schedule columns that returns synthetic sessions.
+    """
+
+    def __init__(self, row, sessions):
+        """
+        Initializes the SyntheticEvent class.
+
+        Parameters:
+            row (dict): The schedule columns of the event.
+            sessions (dict): The SyntheticSession of every session type.
+        """
+        super().__init__(row)
+        self.sessions = sessions
+
+    def get_session(self, racetype):
+        """
+        Retrieves a session of the event.
+
+        Parameters:
+            racetype (str): The session type.
+
+        Returns:
+            SyntheticSession: The session.
+        """
+        return self.sessions[racetype]
+
+def make_fastf1_season(year, drivers, constructors, rounds=24, new_drivers=2, seed=0):
+    """
+    Generates the schedule and the race and qualifying sessions of a fastf1 season.
+
+    The lineup is taken from the end of the given dimension tables plus a few
+    drivers that are not in them yet, so dimension updates have work to do.
+
+    Parameters:
+        year (int): The season.
+        drivers (pd.DataFrame): The drivers dimension table.
+        constructors (pd.DataFrame): The constructors dimension table.
+        rounds (int): The number of rounds (default is 24).
+        new_drivers (int): The number of drivers missing from the drivers table (default is 2).
+        seed (int): The seed of the random generator (default is 0).
+
+    Returns:
+        tuple: The schedule dataframe and the list of SyntheticEvent objects in round order.
+    """
+    rng = np.random.default_rng(seed)
+    driver_refs = list(drivers['driverRef'].iloc[-(20 - new_drivers):]) + [f'rookie_{year}_{number}' for number in range(new_drivers)]
+    team_refs = list(constructors['constructorRef'].iloc[-10:])
+    lineup = pd.DataFrame({
+        'DriverNumber': [str(number) for number in range(1, 21)],
+        'BroadcastName': [ref.upper() for ref in driver_refs],
+        'Abbreviation': [f'A{number:02d}' for number in range(1, 21)],
+        'DriverId': driver_refs,
+        'TeamName': [f'Team {ref}' for ref in np.repeat(team_refs, 2)],
+        'TeamColor': 'ffffff',
+        'TeamId': np.repeat(team_refs, 2),
+        'FirstName': 'First',
+        'LastName': [ref.title() for ref in driver_refs],
+        'FullName': [f'First {ref.title()}' for ref in driver_refs],
+        'HeadshotUrl': '',
+        'CountryCode': 'XXX'
+    })
+
+    schedule = pd.DataFrame({
+        'RoundNumber': np.arange(1, rounds + 1),
+        'Country': 'Country',
+        'Location': [f'Location {number}' for number in range(1, rounds + 1)],
+        'EventName': [f'Synthetic {number} Grand Prix' for number in range(1, rounds + 1)],
+        'EventDate': pd.to_datetime([pd.Timestamp(f'{year}-03-01') + pd.Timedelta(days=14 * number) for number in range(rounds)]),
+        'EventFormat': 'conventional',
+        'Session1': 'Practice 1', 'Session2': 'Practice 2', 'Session3': 'Practice 3', 'Session4': 'Qualifying', 'Session5': 'Race',
+        'Circuit_ShortName': [f'Circuit {number}' for number in range(1, rounds + 1)]
+    })
+
+    events = []
+    for row in schedule.to_dict('records'):
+        positions = rng.permutation(20) + 1
+        finished = positions <= 17
+        winner = pd.Timedelta(seconds=float(rng.uniform(5200, 5800)))
+        gaps = pd.to_timedelta(np.where(positions == 1, 0, rng.uniform(1, 90, 20)), unit='s')
+        q_times = pd.to_timedelta(rng.normal(80, 2, 20), unit='s')
+        results = lineup.assign(
+            Position=positions.astype(float),
+            ClassifiedPosition=np.where(finished, positions.astype(str), 'R'),
+            GridPosition=(rng.permutation(20) + 1).astype(float),
+            Q1=q_times,
+            Q2=q_times.where(positions <= 15),
+            Q3=q_times.where(positions <= 10),
+            Time=pd.Series(gaps).where(positions != 1, winner).where(finished).to_numpy(),
+            Status=np.where(finished, 'Finished', 'Retired'),
+            Points=np.where(positions <= 10, np.array(RACE_POINTS + [0] * 10)[positions - 1], 0).astype(float)
+        )
+
+        race_laps = int(rng.integers(50, 71))
+        driven = np.where(finished, race_laps, rng.integers(1, race_laps, 20))
+        lap_seconds = np.repeat(rng.normal(90, 3, 20), driven) + rng.gamma(2.0, 0.5, driven.sum())
+        lap_times = pd.Series(pd.to_timedelta(lap_seconds, unit='s'))
+        # Some laps have no time, e.g. the first lap or laps behind the safety car
+        lap_times[rng.random(len(lap_times)) < 0.03] = pd.NaT
+        laps = pd.DataFrame({
+            'Time': pd.to_timedelta(np.cumsum(lap_seconds), unit='s'),
+            'Driver': np.repeat(lineup['Abbreviation'].to_numpy(), driven),
+            'DriverNumber': np.repeat(lineup['DriverNumber'].to_numpy(), driven),
+            'LapTime': lap_times,
+            'LapNumber': np.concatenate([np.arange(1, count + 1) for count in driven]).astype(float),
+            'Stint': 1.0,
+            'PitOutTime': pd.NaT,
+            'PitInTime': pd.NaT,
+            'Sector1Time': lap_times * 0.3,
+            'Sector2Time': lap_times * 0.4,
+            'Sector3Time': lap_times * 0.3,
+            'SpeedI1': rng.normal(250, 10, len(lap_seconds)),
+            'SpeedI2': rng.normal(260, 10, len(lap_seconds)),
+            'SpeedFL': rng.normal(280, 10, len(lap_seconds)),
+            'SpeedST': rng.normal(300, 10, len(lap_seconds)),
+            'IsPersonalBest': False,
+            'Compound': 'MEDIUM',
+            'TyreLife': np.concatenate([np.arange(1, count + 1) for count in driven]).astype(float),
+            'FreshTyre': True,
+            'Team': np.repeat(lineup['TeamName'].to_numpy(), driven),
+            'TrackStatus': '1',
+            'Position': np.repeat(positions, driven).astype(float),
+            'Deleted': False,
+            'IsAccurate': True
+        })
+
+        session_info = {'Meeting': {'Name': row['EventName'], 'Location': row['Location'],
+                                    'Country': {'Name': row['Country'], 'Code': 'XXX'}, 'Circuit': {'ShortName': row['Circuit_ShortName']}}}
+        sessions = {
+            'R': SyntheticSession(laps, results, session_info),
+            'Qualifying': SyntheticSession(laps.iloc[0:0], results, session_info)
+        }
+        events.append(SyntheticEvent(row, sessions))
+    return schedule, events
@@ -0,0 +1,525 @@
+import hashlib
+import importlib
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
+from my_functions.prediction import LogisticPodiumModel
+from my_functions.sequence_dataset import SequenceDataset
+
+LSTM_FACTORY = 'my_functions.tuning:sequence_lstm_model'
+BASELINE_FACTORY = 'my_functions.tuning:sequence_logistic_model'
+
+# The grid searched when none is given, the LSTM grid is the param_grid of the training notebook
+DEFAULT_GRIDS = {
+    LSTM_FACTORY: {'neurons': [20], 'dropout_rate': [0.3], 'optimizer': ['rmsprop'], 'batch_size': [8], 'epochs': [5]},
+    BASELINE_FACTORY: {'lookback': [1, 3, 5], 'l2': [0.1, 1.0, 10.0]}
+}
+
+class SequenceLSTMModel:
+    """
+    The LSTM of the training notebook, create_model with its fit and predict_proba, fed from the batches of a SequenceDataset.
+
+    Any model built by a factory of the search has the same two methods, fit and
+    predict_proba, both taking a SequenceDataset and the scaler of the fold, so
+    a model can stream the batches of the dataset instead of copying it. Like
+    the RandomOverSampler of the notebook the podium sequences are drawn again
+    until both classes are equally frequent, only their positions are repeated.
+    Requires Keras, which is imported when the model is built.
+
+    Attributes:
+        neurons (int): The units of both LSTM layers.
+        dropout_rate (float): The dropout after both LSTM layers.
+        optimizer (str): The Keras optimizer.
+        batch_size (int): The number of sequences per batch.
+        epochs (int): The maximum number of epochs, training stops early when the loss stops improving for 3 epochs.
+        oversample (bool): Balance the classes like the notebook.
+        seed (int): The seed of the oversampling and the shuffling.
+    """
+
+    def __init__(self, neurons=20, dropout_rate=0.3, optimizer='rmsprop', batch_size=8, epochs=5, oversample=True, seed=42):
+        """
+        Initializes the SequenceLSTMModel class.
+
+        Parameters:
+            neurons (int, optional): The units of both LSTM layers (default is 20).
+            dropout_rate (float, optional): The dropout after both LSTM layers (default is 0.3).
+            optimizer (str, optional): The Keras optimizer (default is 'rmsprop').
+            batch_size (int, optional): The number of sequences per batch (default is 8).
+            epochs (int, optional): The maximum number of epochs (default is 5).
+            oversample (bool, optional): Balance the classes like the notebook (default is True).
+            seed (int, optional): The seed of the oversampling and the shuffling (default is 42).
+        """
+        try:
+            import keras  # noqa: F401
+        except ImportError as e:
+            raise ImportError(f"The LSTM model requires Keras, install it with 'pip install tensorflow' or tune the baseline with --model {BASELINE_FACTORY}.") from e
+        self.neurons = neurons
+        self.dropout_rate = dropout_rate
+        self.optimizer = optimizer
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.oversample = oversample
+        self.seed = seed
+
+    def _build(self, window, features):
+        """
+        Builds and compiles the network of create_model.
+        """
+        from keras import Input, Sequential
+        from keras.layers import LSTM, Dense, Dropout
+        model = Sequential([
+            Input(shape=(window, features)),
+            LSTM(self.neurons, return_sequences=True),
+            Dropout(self.dropout_rate),
+            LSTM(self.neurons),
+            Dropout(self.dropout_rate),
+            Dense(1, activation='sigmoid')
+        ])
+        model.compile(optimizer=self.optimizer, loss='binary_crossentropy', metrics=['accuracy'])
+        return model
+
+    def _oversampled(self, dataset):
+        """
+        Repeats the positions of randomly drawn sequences of the minority class until both classes are equally frequent.
+        """
+        labels = dataset.labels
+        minority = 1.0 if (labels == 1).sum() < (labels == 0).sum() else 0.0
+        positions = np.flatnonzero(labels == minority)
+        missing = len(labels) - 2 * len(positions)
+        if not self.oversample or missing <= 0 or len(positions) == 0:
+            return dataset
+        extra = np.random.default_rng(self.seed).choice(positions, size=missing, replace=True)
+        return dataset.subset(np.concatenate([np.arange(len(labels)), extra]))
+
+    def fit(self, dataset, scaler=None):
+        """
+        Fits the model.
+
+        Parameters:
+            dataset (SequenceDataset): The training sequences.
+            scaler (tuple, optional): The minimum and range from SequenceDataset.fit_scaler (default is None).
+
+        Returns:
+            SequenceLSTMModel: The fitted model.
+        """
+        from keras.callbacks import EarlyStopping
+        train = self._oversampled(dataset)
+
+        def batches():
+            # Keras draws steps_per_epoch batches per epoch from one endless generator, every epoch is shuffled again
+            epoch = 0
+            while True:
+                yield from train.batches(self.batch_size, shuffle=True, seed=self.seed + epoch, scaler=scaler)
+                epoch += 1
+
+        self.model_ = self._build(dataset.window, len(dataset.features))
+        self.model_.fit(batches(), steps_per_epoch=-(-len(train) // self.batch_size), epochs=self.epochs,
+                        callbacks=[EarlyStopping(monitor='loss', patience=3)], shuffle=False, verbose=0)
+        return self
+
+    def predict_proba(self, dataset, scaler=None):
+        """
+        Predicts the podium probabilities.
+
+        Parameters:
+            dataset (SequenceDataset): The sequences to score.
+            scaler (tuple, optional): The minimum and range from SequenceDataset.fit_scaler (default is None).
+
+        Returns:
+            np.ndarray: The probability of no podium and of a podium per sequence.
+        """
+        parts = [np.asarray(self.model_.predict_on_batch(sequences)).reshape(-1)
+                 for sequences, _ in dataset.batches(max(self.batch_size, 1024), scaler=scaler)]
+        probability = np.concatenate(parts) if parts else np.empty(0, dtype='float32')
+        return np.column_stack([1 - probability, probability])
+
+def sequence_lstm_model(params):
+    """
+    Builds the notebook's LSTM of a configuration.
+
+    Parameters:
+        params (dict): The keyword arguments of SequenceLSTMModel, e.g. the notebook's neurons, dropout_rate, optimizer, batch_size and epochs.
+
+    Returns:
+        SequenceLSTMModel: The unfitted model.
+    """
+    return SequenceLSTMModel(**params)
+
+class SequenceLogisticModel:
+    """
+    A logistic regression on the last races of every sequence, the fallback model of the hyperparameter search.
+
+    It needs no Keras and fits in seconds, so it is tuned when Keras is not
+    installed and it serves as a baseline the LSTM has to beat.
+
+    Attributes:
+        lookback (int): The number of last races of a sequence the regression sees.
+        l2 (float): The L2 penalty of the weights.
+        batch_size (int): The number of sequences copied at a time.
+    """
+
+    def __init__(self, lookback=1, l2=1.0, batch_size=4096):
+        """
+        Initializes the SequenceLogisticModel class.
+
+        Parameters:
+            lookback (int, optional): The number of last races of a sequence the regression sees (default is 1).
+            l2 (float, optional): The L2 penalty of the weights (default is 1.0).
+            batch_size (int, optional): The number of sequences copied at a time (default is 4096).
+        """
+        self.lookback = lookback
+        self.l2 = l2
+        self.batch_size = batch_size
+
+    def _matrix(self, dataset, scaler):
+        """
+        Flattens the last races of every sequence into one row.
+        """
+        lookback = min(self.lookback, dataset.window)
+        parts = [sequences[:, -lookback:, :].reshape(len(sequences), -1) for sequences, _ in dataset.batches(self.batch_size, scaler=scaler)]
+        return np.concatenate(parts) if parts else np.empty((0, lookback * len(dataset.features)), dtype='float32')
+
+    def fit(self, dataset, scaler=None):
+        """
+        Fits the model.
+
+        Parameters:
+            dataset (SequenceDataset): The training sequences.
+            scaler (tuple, optional): The minimum and range from SequenceDataset.fit_scaler (default is None).
+
+        Returns:
+            SequenceLogisticModel: The fitted model.
+        """
+        self.model_ = LogisticPodiumModel(self.l2).fit(self._matrix(dataset, scaler), dataset.labels)
+        return self
+
+    def predict_proba(self, dataset, scaler=None):
+        """
+        Predicts the podium probabilities.
+
+        Parameters:
+            dataset (SequenceDataset): The sequences to score.
+            scaler (tuple, optional): The minimum and range from SequenceDataset.fit_scaler (default is None).
+
+        Returns:
+            np.ndarray: The probability of no podium and of a podium per sequence.
+        """
+        return self.model_.predict_proba(self._matrix(dataset, scaler))
+
+def sequence_logistic_model(params):
+    """
+    Builds the baseline model of a configuration.
+
+    Parameters:
+        params (dict): The keyword arguments of SequenceLogisticModel.
+
+    Returns:
+        SequenceLogisticModel: The unfitted model.
+    """
+    return SequenceLogisticModel(**params)
+
+def default_factory():
+    """
+    Retrieves the model factory tuned by default.
+
+    Returns:
+        str: The notebook's LSTM when Keras and its backend are installed, the logistic baseline otherwise.
+    """
+    # Only looked up, importing Keras here would load its backend before the worker processes are forked
+    backend = os.environ.get('KERAS_BACKEND', 'tensorflow')
+    if importlib.util.find_spec('keras') is None or importlib.util.find_spec(backend) is None:
+        logging.warning('Keras or its backend is not installed, tuning the logistic baseline instead of the LSTM')
+        return BASELINE_FACTORY
+    return LSTM_FACTORY
+
+def load_factory(path):
+    """
+    Imports a model factory, a function building an unfitted model from the parameters of a configuration.
+
+    Parameters:
+        path (str): The factory as 'module:function'.
+
+    Returns:
+        callable: The factory.
+    """
+    module, _, function = path.partition(':')
+    if not function:
+        raise ValueError(f"Expected the model factory as 'module:function', got '{path}'.")
+    return getattr(importlib.import_module(module), function)
+
+def expand_grid(grid):
+    """
+    Expands a parameter grid into its configurations, like GridSearchCV.
+
+    Parameters:
+        grid (dict): The values to try per parameter.
+
+    Returns:
+        list: The parameters of every configuration.
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def podium_precision(predictions, ties='min'):
+    """
+    Calculates the precision of predicting the three most likely drivers of every race on the podium, the notebook's top 3 evaluation.
+
+    Parameters:
+        predictions (pd.DataFrame): The raceId, target and predicted probability of every sequence.
+        ties (str): The rank method for tied probabilities, 'min' puts every driver tied for third on the podium like the
+            notebook, 'first' breaks ties by row order so exactly three drivers per race are predicted (default is 'min').
+
+    Returns:
+        tuple: The precision over all races and a Series with the precision per raceId.
+    """
+    predicted = predictions.groupby('raceId')['probability'].rank(method=ties, ascending=False) <= 3
+    hits = predicted & (predictions['target'] == 1)
+    per_race = hits.groupby(predictions['raceId']).sum() / predicted.groupby(predictions['raceId']).sum()
+    precision = hits.sum() / predicted.sum() if predicted.any() else np.nan
+    return float(precision), per_race
+
+# The dataset and folds of a worker, opened once per process
+_WORKER = {}
+
+def open_worker_dataset(directory):
+    """
+    Memory-maps the saved dataset in a worker, the pages are shared with every other worker.
+
+    Parameters:
+        directory (str): The directory of the dataset saved by SequenceDataset.save.
+    """
+    _WORKER['dataset'] = SequenceDataset.load(directory, mmap=True)
+    _WORKER['folds'] = {}
+
+def evaluate_fold(factory, params, fold, n_splits):
+    """
+    Fits a configuration on the training races of a fold and scores its test races.
+
+    Parameters:
+        factory (str): The model factory as 'module:function'.
+        params (dict): The parameters of the configuration.
+        fold (int): The fold, 0 for the earliest test races.
+        n_splits (int): The number of folds.
+
+    Returns:
+        dict: The precision, the precision per raceId, the number of sequences and the seconds of the fold.
+    """
+    if n_splits not in _WORKER['folds']:
+        _WORKER['folds'][n_splits] = list(_WORKER['dataset'].time_series_splits(n_splits))
+    train, test = _WORKER['folds'][n_splits][fold]
+
+    start = time.perf_counter()
+    scaler = train.fit_scaler()
+    model = load_factory(factory)(params).fit(train, scaler)
+    predictions = test.to_frame().assign(probability=model.predict_proba(test, scaler)[:, 1])
+    precision, per_race = podium_precision(predictions)
+    return {
+        'precision': precision,
+        'race_precision': {str(race_id): value for race_id, value in per_race.items()},
+        'train_sequences': len(train),
+        'test_sequences': len(test),
+        'seconds': time.perf_counter() - start
+    }
+
+class FoldCache:
+    """
+    A class keeping the result of every evaluated fold as a JSON file so an interrupted search resumes.
+
+    Attributes:
+        path (str): The directory of the results.
+        fingerprint (str): The fingerprint of the dataset, results of other data are never reused.
+        factory (str): The model factory as 'module:function'.
+        n_splits (int): The number of folds.
+    """
+
+    def __init__(self, path, fingerprint, factory, n_splits):
+        """
+        Initializes the FoldCache class.
+
+        Parameters:
+            path (str): The directory of the results.
+            fingerprint (str): The fingerprint of the dataset.
+            factory (str): The model factory as 'module:function'.
+            n_splits (int): The number of folds.
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.factory = factory
+        self.n_splits = n_splits
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, params, fold):
+        """
+        Retrieves the file of a fold of a configuration.
+        """
+        description = {'dataset': self.fingerprint, 'factory': self.factory, 'params': params, 'n_splits': self.n_splits, 'fold': fold}
+        key = hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return os.path.join(self.path, f'{key}.json')
+
+    def read(self, params, fold):
+        """
+        Reads the result of a fold.
+
+        Parameters:
+            params (dict): The parameters of the configuration.
+            fold (int): The fold.
+
+        Returns:
+            dict: The result, None if the fold was not evaluated yet.
+        """
+        file = self._file(params, fold)
+        if not os.path.exists(file):
+            return None
+        with open(file) as f:
+            return json.load(f)
+
+    def write(self, params, fold, result):
+        """
+        Writes the result of a fold, replacing the file at once so an interruption never leaves half a result.
+
+        Parameters:
+            params (dict): The parameters of the configuration.
+            fold (int): The fold.
+            result (dict): The result from evaluate_fold.
+        """
+        file = self._file(params, fold)
+        with open(f'{file}.tmp', 'w') as f:
+            json.dump(result, f)
+        os.replace(f'{file}.tmp', file)
+
+def trails_best(results, index, margin):
+    """
+    Checks whether a configuration trails the best configuration over its finished folds by more than a margin.
+
+    Parameters:
+        results (list): The results per fold of every configuration.
+        index (int): The position of the configuration.
+        margin (float): The precision a configuration may trail the best one by.
+
+    Returns:
+        bool: True if the configuration should be abandoned.
+    """
+    folds = set(results[index])
+    if not folds:
+        return False
+
+    def mean_precision(fold_results):
+        return np.nanmean([fold_results[fold]['precision'] for fold in folds])
+
+    others = [mean_precision(fold_results) for position, fold_results in enumerate(results) if position != index and folds <= set(fold_results)]
+    return bool(others) and mean_precision(results[index]) < max(others) - margin
+
+def walk_forward_search(dataset_path, grid, factory=LSTM_FACTORY, n_splits=3, workers=None, cache_path=None, abandon_margin=None):
+    """
+    Evaluates every configuration of a grid on walk-forward folds across a pool of processes.
+
+    The workers memory-map the saved dataset instead of receiving a copy. Every
+    finished fold is cached, a rerun only evaluates the missing folds. With an
+    abandon margin the folds of a configuration run in order and a configuration
+    trailing the best one over its finished folds by more than the margin gets
+    no further folds.
+
+    Parameters:
+        dataset_path (str): The directory of the dataset saved by SequenceDataset.save.
+        grid (dict): The values to try per parameter.
+        factory (str, optional): The model factory as 'module:function' (default is LSTM_FACTORY).
+        n_splits (int, optional): The number of walk-forward folds (default is 3).
+        workers (int, optional): The number of processes, 1 evaluates in this process (default is None, one per CPU).
+        cache_path (str, optional): The directory of the fold results (default is None, a .tuning_cache next to the dataset).
+        abandon_margin (float, optional): The precision a configuration may trail the best one by (default is None, never abandon).
+
+    Returns:
+        tuple: The summary per configuration and the precision per race of every evaluated fold as dataframes.
+    """
+    configs = expand_grid(grid)
+    cache = FoldCache(cache_path or os.path.join(os.path.dirname(os.path.abspath(dataset_path)), '.tuning_cache'),
+                      SequenceDataset.saved_fingerprint(dataset_path), factory, n_splits)
+
+    # A rerun only evaluates the folds missing from the cache
+    results = []
+    for params in configs:
+        cached = {fold: cache.read(params, fold) for fold in range(n_splits)}
+        results.append({fold: result for fold, result in cached.items() if result is not None})
+    cached_folds = sum(len(fold_results) for fold_results in results)
+    logging.info(f'Searching {len(configs)} configurations on {n_splits} folds, {cached_folds} folds cached')
+
+    status = ['complete' if len(fold_results) == n_splits else 'pending' for fold_results in results]
+    folds_in_flight = n_splits if abandon_margin is None else 1
+    if workers == 1:
+        open_worker_dataset(dataset_path)
+        pool = ThreadPoolExecutor(max_workers=1)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=open_worker_dataset, initargs=(dataset_path,))
+
+    running = {}
+    with pool:
+        while True:
+            for index, params in enumerate(configs):
+                if status[index] != 'pending':
+                    continue
+                if abandon_margin is not None and trails_best(results, index, abandon_margin):
+                    status[index] = 'abandoned'
+                    logging.info(f'Abandoned {params} after {len(results[index])} folds')
+                    continue
+                submitted = {fold for position, fold in running.values() if position == index}
+                for fold in range(n_splits):
+                    if len(submitted) >= folds_in_flight:
+                        break
+                    if fold not in results[index] and fold not in submitted:
+                        running[pool.submit(evaluate_fold, factory, params, fold, n_splits)] = (index, fold)
+                        submitted.add(fold)
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, fold = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f'Could not evaluate fold {fold} of {configs[index]}: {e}')
+                    status[index] = 'failed'
+                    continue
+                cache.write(configs[index], fold, result)
+                results[index][fold] = result
+                logging.info(f"Fold {fold} of {configs[index]}: precision {result['precision']:.3f} in {result['seconds']:.1f}s")
+                if len(results[index]) == n_splits:
+                    status[index] = 'complete'
+
+    return search_report(configs, results, status, n_splits)
+
+def search_report(configs, results, status, n_splits):
+    """
+    Summarizes the results of a search.
+
+    Parameters:
+        configs (list): The parameters of every configuration.
+        results (list): The results per fold of every configuration.
+        status (list): Whether every configuration is complete, abandoned or failed.
+        n_splits (int): The number of folds.
+
+    Returns:
+        tuple: The summary per configuration, best mean precision first, and the precision per race of every evaluated fold.
+    """
+    summary = []
+    races = []
+    for params, fold_results, config_status in zip(configs, results, status):
+        race_precision = [value for result in fold_results.values() for value in result['race_precision'].values()]
+        row = {'params': json.dumps(params, sort_keys=True), 'status': config_status, 'folds': len(fold_results)}
+        row.update({f'precision_fold_{fold}': fold_results[fold]['precision'] if fold in fold_results else np.nan for fold in range(n_splits)})
+        row['mean_precision'] = np.nanmean([result['precision'] for result in fold_results.values()]) if fold_results else np.nan
+        row['mean_race_precision'] = np.nanmean(race_precision) if race_precision else np.nan
+        row['seconds'] = sum(result['seconds'] for result in fold_results.values())
+        summary.append(row)
+        for fold, result in fold_results.items():
+            races.extend({'params': row['params'], 'fold': fold, 'raceId': int(race_id), 'precision': value}
+                         for race_id, value in result['race_precision'].items())
+
+    summary = pd.DataFrame(summary).sort_values('mean_precision', ascending=False, ignore_index=True)
+    return summary, pd.DataFrame(races, columns=['params', 'fold', 'raceId', 'precision'])
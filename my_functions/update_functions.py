@@ -1,9 +1,38 @@
+import json
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
 import fastf1 as ff1
 import logging
 import os
 import numpy as np
+from my_functions.instrumentation import instrumented
+from my_functions.snapshots import (SNAPSHOT_LAP_COLUMNS, distill_session, get_snapshot_path, read_schedule_snapshot, read_session_snapshot,
+                                    snapshots_available, write_schedule_snapshot, write_session_snapshot)
+from my_functions.storage import drop_missing_keys, get_store, load_key_index, save_key_index, table_name
+
+SESSION_NAMES = {
+    'FP1': 'Practice 1',
+    'FP2': 'Practice 2',
+    'FP3': 'Practice 3',
+    'Q': 'Qualifying',
+    'S': 'Sprint',
+    'SS': 'Sprint Shootout',
+    'SQ': 'Sprint Qualifying',
+    'R': 'Race'
+}
+
+LAP_TIME_COLUMNS = ['raceId', 'driverId', 'lap', 'position', 'time', 'milliseconds']
+
+# The lap columns the update uses, checkpoints of loaded sessions only keep these
+LAP_CHECKPOINT_COLUMNS = SNAPSHOT_LAP_COLUMNS
+
+LOAD_PROFILES = {
+    'laps_results': {'laps': True, 'telemetry': False, 'weather': False, 'messages': False},
+    'with_weather': {'laps': True, 'telemetry': False, 'weather': True, 'messages': False},
+    'with_messages': {'laps': True, 'telemetry': False, 'weather': True, 'messages': True},
+    'full': {'laps': True, 'telemetry': True, 'weather': True, 'messages': True}
+}
 
 def extract_important_info(session_info):
     """
@@ -35,21 +64,24 @@ def get_paths():
     staging_path = os.path.normpath(os.path.join(current_dir, '..', 'Data', 'Staging'))
     return cache_path, staging_path
 
-def calculate_total_times(group):
+def calculate_total_times(results):
     """
-    Calculates the total times for a group of lap times.
+    Calculates the total race times of the drivers.
+
+    The time of the race winner is broadcast to every driver of the same race and
+    the gap of every other driver is added to it. Races without a classified P1
+    get missing times.
 
     Parameters:
-        group (pd.DataFrame): The dataframe containing lap times.
+        results (pd.DataFrame): The dataframe containing the race results with raceId, Position and Time.
 
     Returns:
         pd.DataFrame: The updated dataframe with total times calculated.
     """
-    first_driver_time = group.loc[group['Position'] == 1, 'Time'].values[0]
-    group['milliseconds'] = group['Time'].apply(
-        lambda x: first_driver_time if first_driver_time == x else first_driver_time + x
-    )
-    return group
+    results = results.copy()
+    leader_time = results['Time'].where(results['Position'] == 1).groupby(results['raceId']).transform('first')
+    results['milliseconds'] = leader_time.where(results['Time'] == leader_time, leader_time + results['Time'])
+    return results
 
 def enable_cache():
     """
@@ -58,6 +90,57 @@ def enable_cache():
     cache_path, _ = get_paths()
     ff1.Cache.enable_cache(cache_path)
 
+_DIMENSION_CACHE = {}
+
+def _dimension_cache_key(store, name):
+    """
+    Retrieves the key of a table in the dimension cache, a SQLite store keeps every table in one file.
+    """
+    return store.path(name), table_name(name)
+
+@instrumented(fields=lambda arguments: {'table': arguments['name']})
+def load_dimension_table(name, store=None):
+    """
+    Loads a dimension table through the process level dimension cache.
+
+    The table is only read from disk when it is not cached yet or when its file
+    changed since it was cached, which is detected by the modification time and size.
+
+    Parameters:
+        name (str): The table name, e.g. 'drivers'.
+        store (CsvStore or ParquetStore, optional): The store holding the table (default is None, the staging store).
+
+    Returns:
+        pd.DataFrame: A copy of the dimension table.
+    """
+    if store is None:
+        store = get_store()
+    signature = store.signature(name)
+    cached = _DIMENSION_CACHE.get(_dimension_cache_key(store, name))
+    if cached is None or cached['signature'] != signature:
+        cached = {'signature': signature, 'table': store.read(name), 'lookups': None}
+        _DIMENSION_CACHE[_dimension_cache_key(store, name)] = cached
+    return cached['table'].copy()
+
+def refresh_dimension_table(name, table, store=None):
+    """
+    Replaces a cached dimension table after a new version of it was written.
+
+    Parameters:
+        name (str): The table name, e.g. 'drivers'.
+        table (pd.DataFrame): The table that was written.
+        store (CsvStore or ParquetStore, optional): The store holding the table (default is None, the staging store).
+    """
+    if store is None:
+        store = get_store()
+    _DIMENSION_CACHE[_dimension_cache_key(store, name)] = {'signature': store.signature(name), 'table': table.copy(), 'lookups': None}
+
+def clear_dimension_cache():
+    """
+    Empties the dimension cache.
+    """
+    _DIMENSION_CACHE.clear()
+
 def load_dimension_tables():
     """
     Loads the dimension tables from the staging path.
@@ -65,81 +148,536 @@ def load_dimension_tables():
     Returns:
         tuple: A tuple containing the drivers, constructors, and races dataframes.
     """
-    _, staging_path = get_paths()
-    drivers = pd.read_csv(os.path.join(staging_path, 'drivers.csv'), on_bad_lines='skip', header=0, delimiter=',')
-    constructors = pd.read_csv(os.path.join(staging_path, 'constructors.csv'), on_bad_lines='skip', header=0, delimiter=',')
-    races = pd.read_csv(os.path.join(staging_path, 'races.csv'), on_bad_lines='skip', header=0, delimiter=',')
+    store = get_store()
+    drivers = load_dimension_table('drivers', store)
+    constructors = load_dimension_table('constructors', store)
+    races = load_dimension_table('races', store)
     return drivers, constructors, races
 
-def ff1_retriever(year, racetype='R'):
+def get_dimension_lookups():
+    """
+    Retrieves the lookup indexes of the dimension tables.
+
+    The indexes are built once per version of the dimension tables and are
+    cached together with them.
+
+    Returns:
+        dict: A dictionary with the lookup series 'driverId' and 'number' (by driverRef),
+              'constructorId' (by constructorRef) and 'raceId' (by name and year).
+    """
+    store = get_store()
+    load_dimension_tables()
+    drivers_cache = _DIMENSION_CACHE[_dimension_cache_key(store, 'drivers')]
+    constructors_cache = _DIMENSION_CACHE[_dimension_cache_key(store, 'constructors')]
+    races_cache = _DIMENSION_CACHE[_dimension_cache_key(store, 'races')]
+
+    for name, cached in [('drivers', drivers_cache), ('constructors', constructors_cache), ('races', races_cache)]:
+        if cached['lookups'] is None:
+            cached['lookups'] = build_dimension_lookups(name, cached['table'])
+
+    return {**drivers_cache['lookups'], **constructors_cache['lookups'], **races_cache['lookups']}
+
+def build_dimension_lookups(name, table):
+    """
+    Builds the lookup indexes of one dimension table.
+
+    Parameters:
+        name (str): The table name, 'drivers', 'constructors' or 'races'.
+        table (pd.DataFrame): The dimension table.
+
+    Returns:
+        dict: The lookup series of the table, see get_dimension_lookups.
+    """
+    if name == 'drivers':
+        drivers = table.drop_duplicates(subset='driverRef').set_index('driverRef')
+        return {'driverId': drivers['driverId'], 'number': drivers['number']}
+    if name == 'constructors':
+        constructors = table.drop_duplicates(subset='constructorRef').set_index('constructorRef')
+        return {'constructorId': constructors['constructorId']}
+    if name == 'races':
+        races = table.drop_duplicates(subset=['name', 'year']).set_index(['name', 'year'])
+        return {'raceId': races['raceId']}
+    raise ValueError(f"Unknown dimension table '{name}'.")
+
+def lookup_race_ids(race_lookup, names, years):
+    """
+    Looks up the raceId of every (name, year) pair.
+
+    Parameters:
+        race_lookup (pd.Series): The 'raceId' lookup from get_dimension_lookups.
+        names (pd.Series): The race names.
+        years (pd.Series): The race years.
+
+    Returns:
+        np.ndarray: The raceIds, missing where the race is unknown.
+    """
+    keys = pd.MultiIndex.from_arrays([names, years])
+    return race_lookup.reindex(keys).to_numpy()
+
+def load_watermark(staging_path=None):
+    """
+    Loads the ingestion watermark stored next to the staging tables.
+
+    Parameters:
+        staging_path (str, optional): The path to the staging directory (default is None).
+
+    Returns:
+        dict: A dictionary mapping season to session type to the list of ingested rounds.
+    """
+    if staging_path is None:
+        _, staging_path = get_paths()
+    watermark_path = os.path.join(staging_path, 'ingestion_watermark.json')
+    if not os.path.exists(watermark_path):
+        return {}
+    with open(watermark_path) as f:
+        return json.load(f)
+
+def save_watermark(watermark, staging_path=None):
+    """
+    Saves the ingestion watermark next to the staging tables.
+
+    Parameters:
+        watermark (dict): The watermark as returned by load_watermark.
+        staging_path (str, optional): The path to the staging directory (default is None).
+    """
+    if staging_path is None:
+        _, staging_path = get_paths()
+    watermark_path = os.path.join(staging_path, 'ingestion_watermark.json')
+    temp_path = watermark_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(watermark, f, indent=2, sort_keys=True)
+    os.replace(temp_path, watermark_path)
+
+def get_ingested_rounds(year, racetype, staging_path=None):
+    """
+    Retrieves the rounds of a season and session type that are already staged.
+
+    Parameters:
+        year (int): The season.
+        racetype (str): The session type.
+        staging_path (str, optional): The path to the staging directory (default is None).
+
+    Returns:
+        set: The ingested round numbers.
+    """
+    watermark = load_watermark(staging_path)
+    return set(watermark.get(str(year), {}).get(racetype, []))
+
+def mark_ingested(year, racetype, rounds, staging_path=None):
+    """
+    Records rounds of a season and session type as staged.
+
+    Only call this after the staging tables of the session type have been written.
+
+    Parameters:
+        year (int): The season.
+        racetype (str): The session type.
+        rounds (iterable): The round numbers that were staged.
+        staging_path (str, optional): The path to the staging directory (default is None).
+    """
+    watermark = record_ingested(load_watermark(staging_path), year, racetype, rounds)
+    save_watermark(watermark, staging_path)
+    logging.info(f'Marked {racetype} rounds of {year} as ingested: {watermark[str(year)][racetype]}')
+
+def record_ingested(watermark, year, racetype, rounds):
+    """
+    Adds rounds of a season and session type to a watermark without saving it.
+
+    Parameters:
+        watermark (dict): The watermark as returned by load_watermark, updated in place.
+        year (int): The season.
+        racetype (str): The session type.
+        rounds (iterable): The round numbers that were staged.
+
+    Returns:
+        dict: The updated watermark.
+    """
+    season = watermark.setdefault(str(year), {})
+    ingested = set(season.get(racetype, [])) | {int(round_number) for round_number in rounds}
+    season[racetype] = sorted(ingested)
+    return watermark
+
+def clear_watermark(year=None, racetype=None, staging_path=None):
+    """
+    Removes rounds from the ingestion watermark so they are loaded again.
+
+    Parameters:
+        year (int, optional): The season to clear (default is None, all seasons).
+        racetype (str, optional): The session type to clear (default is None, all session types).
+        staging_path (str, optional): The path to the staging directory (default is None).
+    """
+    watermark = load_watermark(staging_path)
+    seasons = [str(year)] if year is not None else list(watermark)
+    for season in seasons:
+        if racetype is None:
+            watermark.pop(season, None)
+        elif season in watermark:
+            watermark[season].pop(racetype, None)
+    save_watermark(watermark, staging_path)
+
+def staged_rounds(fetched, staged, racetype, lookups=None):
+    """
+    Finds the fetched rounds whose rows made it into the staged data.
+
+    Rows of races missing from the races dimension are dropped while staging, their
+    rounds must stay out of the watermark so the next update fetches them again.
+
+    Parameters:
+        fetched (pd.DataFrame): The session results as loaded, with year, RoundNumber and race_name.
+        staged (pd.DataFrame): The rows staged from them, with raceId.
+        racetype (str): The session type, for the warning.
+        lookups (dict, optional): The dimension lookups (default is None, those of the staged dimension tables).
+
+    Returns:
+        pd.DataFrame: The year and RoundNumber of every staged round.
+    """
+    if lookups is None:
+        lookups = get_dimension_lookups()
+
+    rounds = fetched[['year', 'RoundNumber', 'race_name']].drop_duplicates(subset=['year', 'RoundNumber'])
+    race_ids = pd.Series(lookup_race_ids(lookups['raceId'], rounds['race_name'], rounds['year']), index=rounds.index)
+    kept = race_ids.isin(set(staged['raceId']))
+    for dropped in rounds[~kept].itertuples(index=False):
+        logging.warning(f'{racetype} round {dropped.RoundNumber} of {dropped.year} ({dropped.race_name}) was not staged, '
+                        f'it is left out of the watermark and fetched again by the next update')
+    return rounds.loc[kept, ['year', 'RoundNumber']]
+
+def get_load_options(profile):
+    """
+    Retrieves the fastf1 load options of a named load profile.
+
+    Parameters:
+        profile (str): The name of the profile, one of LOAD_PROFILES.
+
+    Returns:
+        dict: The keyword arguments for session.load.
+    """
+    if profile not in LOAD_PROFILES:
+        raise ValueError(f"Unknown load profile '{profile}', expected one of {', '.join(LOAD_PROFILES)}.")
+    return LOAD_PROFILES[profile]
+
+@instrumented(fields=lambda arguments: {'round': int(arguments['event']['RoundNumber']), 'session': arguments['racetype']})
+def load_event_session(event, racetype='R', profile='laps_results', snapshot_path=None):
+    """
+    Loads a single session of an event and attaches the event information.
+
+    With a snapshot path the session is reduced to the columns the update uses
+    and saved as a snapshot, later updates read the snapshot instead of fastf1.
+
+    Parameters:
+        event (fastf1.events.Event): The event to load the session for.
+        racetype (str): The type of race (default is 'R' for race).
+        profile (str): The load profile that decides which data fastf1 parses (default is 'laps_results').
+        snapshot_path (str, optional): The directory of the session snapshots (default is None, no snapshot).
+
+    Returns:
+        tuple: A tuple containing dataframes for the session laps and results.
+    """
+    session = event.get_session(racetype)
+    session.load(**get_load_options(profile))
+    session_laps = session.laps
+    session_results = session.results
+    session_info = session.session_info
+    session_date = event['EventDate']
+
+    session_laps['year'] = session_date.year
+    session_results['year'] = session_date.year
+    session_results['RoundNumber'] = event['RoundNumber']
+
+    session_laps = session_laps.merge(session_results[['Abbreviation', 'DriverId']], how='left', left_on='Driver', right_on='Abbreviation')
+
+    important_info = extract_important_info(session_info)
+    for key, value in important_info.items():
+        session_laps[key] = value
+        session_results[key] = value
+
+    if snapshot_path is not None:
+        session_laps, session_results = distill_session(pd.DataFrame(session_laps), pd.DataFrame(session_results))
+        write_session_snapshot(snapshot_path, session_date.year, event['RoundNumber'], racetype, session_laps, session_results)
+    return pd.DataFrame(session_laps), pd.DataFrame(session_results)
+
+def checkpoint_file(checkpoint_path, year, round_number, racetype):
+    """
+    Retrieves the path of the checkpoint of a loaded session.
+
+    Parameters:
+        checkpoint_path (str): The directory holding the checkpoints.
+        year (int): The season.
+        round_number (int): The round.
+        racetype (str): The session type.
+
+    Returns:
+        str: The path of the pickle file.
+    """
+    return os.path.join(checkpoint_path, str(year), f'{int(round_number):02d}_{racetype}.pkl')
+
+def load_event_session_checkpointed(event, racetype, profile, checkpoint_path, snapshot_path=None):
+    """
+    Loads a session of an event and saves it as a checkpoint right away.
+
+    The laps are reduced to LAP_CHECKPOINT_COLUMNS to keep the checkpoints small.
+
+    Parameters:
+        event (fastf1.events.Event): The event to load the session for.
+        racetype (str): The type of race.
+        profile (str): The load profile that decides which data fastf1 parses.
+        checkpoint_path (str): The directory holding the checkpoints.
+        snapshot_path (str, optional): The directory of the session snapshots (default is None, no snapshot).
+
+    Returns:
+        tuple: A tuple containing dataframes for the session laps and results.
+    """
+    laps, results = load_event_session(event, racetype, profile, snapshot_path)
+    laps = laps[[column for column in LAP_CHECKPOINT_COLUMNS if column in laps.columns]]
+
+    file_path = checkpoint_file(checkpoint_path, event['EventDate'].year, event['RoundNumber'], racetype)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    pd.to_pickle((laps, results), file_path + '.tmp')
+    os.replace(file_path + '.tmp', file_path)
+    return laps, results
+
+def event_has_session(event, racetype):
+    """
+    Checks whether an event has a session of the given type.
+
+    Parameters:
+        event (fastf1.events.Event): The event to check.
+        racetype (str): The session name or abbreviation, e.g. 'R', 'Qualifying' or 'Sprint'.
+
+    Returns:
+        bool: True if the event schedule contains the session.
+    """
+    session_name = SESSION_NAMES.get(racetype.upper(), racetype)
+    session_names = [str(event[f'Session{number}']).casefold() for number in range(1, 6)]
+    if session_name.casefold() in session_names:
+        return True
+    # The sprint race was called 'Sprint Qualifying' in the 2021 and 2022 schedules
+    return session_name == 'Sprint' and 'sprint qualifying' in session_names and event['EventDate'].year in (2021, 2022)
+
+def resolve_snapshot_path(snapshots):
+    """
+    Retrieves the directory of the session snapshots when they are used.
+
+    Parameters:
+        snapshots (bool): Whether to use the session snapshots.
+
+    Returns:
+        str: The snapshots directory, None if snapshots are off or pyarrow is not installed.
+    """
+    if not snapshots:
+        return None
+    if not snapshots_available():
+        logging.info('Session snapshots need pyarrow, every session is loaded with fastf1')
+        return None
+    return get_snapshot_path()
+
+def get_event_schedule(year, snapshots=True):
+    """
+    Retrieves the event schedule of a season, from its snapshot when the season was complete when it was saved.
+
+    Parameters:
+        year (int): The season.
+        snapshots (bool): Whether to use the schedule snapshot (default is True).
+
+    Returns:
+        fastf1.events.EventSchedule: The schedule.
+    """
+    snapshot_path = resolve_snapshot_path(snapshots)
+    if snapshot_path is not None:
+        schedule = read_schedule_snapshot(snapshot_path, year)
+        if schedule is not None:
+            return schedule
+    schedule = ff1.get_event_schedule(year)
+    if snapshot_path is not None:
+        write_schedule_snapshot(snapshot_path, year, schedule)
+    return schedule
+
+@instrumented(fields=lambda arguments: {'year': arguments['year']})
+def ff1_multi_retriever(year, racetypes=('R', 'Qualifying', 'Sprint'), workers=None, executor='thread', skip_ingested=True, schedule=None, profile='laps_results', checkpoint_path=None, snapshots=True):
+    """
+    Retrieves lap and race data for several session types in one pass over the schedule.
+
+    Every past event is visited once and each requested session it has is loaded.
+    Session types an event does not have, like Sprint on a regular weekend, are
+    skipped without loading. Sessions are loaded one after another by default.
+    When workers is given the sessions are loaded concurrently in a thread or
+    process pool, the frames are still concatenated in round order. A session
+    that fails to load is logged with its round and skipped. Rounds recorded in
+    the ingestion watermark are not loaded again unless skip_ingested is False.
+    With a checkpoint path every session is saved as soon as it is loaded and
+    sessions with a checkpoint are read from it instead of being loaded again.
+    Sessions with a snapshot are read from it without fastf1, every session
+    loaded from fastf1 gets a snapshot. Both hold only the columns the update
+    uses, whatever the load profile.
+
+    Parameters:
+        year (int): The year for which to retrieve data.
+        racetypes (iterable): The session types to retrieve (default is race, qualifying and sprint).
+        workers (int, optional): The number of sessions to load at the same time (default is None, sequential).
+        executor (str): The kind of worker pool, 'thread' or 'process' (default is 'thread').
+        skip_ingested (bool): Whether to skip rounds in the ingestion watermark (default is True).
+        schedule (fastf1.events.EventSchedule, optional): The already loaded schedule of the year (default is None).
+        profile (str): The load profile that decides which data fastf1 parses (default is 'laps_results').
+        checkpoint_path (str, optional): The directory holding the session checkpoints (default is None, no checkpoints).
+        snapshots (bool): Whether to read and write the session snapshots (default is True).
+
+    Returns:
+        dict: A dictionary mapping each session type to a tuple of laps and results dataframes.
+    """
+    # Fail on an unknown profile before any session is loaded
+    get_load_options(profile)
+    enable_cache()
+    snapshot_path = resolve_snapshot_path(snapshots)
+    if schedule is None:
+        schedule = get_event_schedule(year, snapshots)
+    current_date = datetime.now()
+    ingested_rounds = {racetype: get_ingested_rounds(year, racetype) if skip_ingested else set() for racetype in racetypes}
+
+    loaded = {racetype: {} for racetype in racetypes}
+    tasks = []
+    snapshot_hits = 0
+    for round_number in schedule['RoundNumber']:
+        if round_number < 1:
+            continue
+        event = schedule.get_event_by_round(round_number)
+        if event['EventDate'] > current_date:
+            continue
+        for racetype in racetypes:
+            if round_number in ingested_rounds[racetype] or not event_has_session(event, racetype):
+                continue
+            if snapshot_path is not None:
+                snapshot = read_session_snapshot(snapshot_path, year, round_number, racetype)
+                if snapshot is not None:
+                    loaded[racetype][round_number] = snapshot
+                    snapshot_hits += 1
+                    continue
+            if checkpoint_path is not None and os.path.exists(checkpoint_file(checkpoint_path, year, round_number, racetype)):
+                loaded[racetype][round_number] = pd.read_pickle(checkpoint_file(checkpoint_path, year, round_number, racetype))
+                continue
+            tasks.append((event, racetype))
+    if checkpoint_path is not None:
+        resumed = sum(len(sessions) for sessions in loaded.values())
+        logging.info(f'Resuming {year} from {resumed} checkpointed sessions, {len(tasks)} sessions left to load')
+    elif snapshot_path is not None:
+        logging.info(f'Read {snapshot_hits} sessions of {year} from snapshots, {len(tasks)} sessions left to load')
+
+    # With checkpoints or snapshots every session is saved by the worker that loaded it
+    if checkpoint_path is None:
+        load, load_arguments = load_event_session, (profile, snapshot_path)
+    else:
+        load, load_arguments = load_event_session_checkpointed, (profile, checkpoint_path, snapshot_path)
+
+    if workers is None or workers <= 1:
+        for event, racetype in tasks:
+            try:
+                loaded[racetype][event['RoundNumber']] = load(event, racetype, *load_arguments)
+            except Exception as e:
+                logging.warning(f"Could not load {racetype} session of {year} round {event['RoundNumber']} ({event['EventName']}): {e}")
+    else:
+        if executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=workers)
+        elif executor == 'process':
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=enable_cache)
+        else:
+            raise ValueError(f"Unknown executor '{executor}', expected 'thread' or 'process'.")
+
+        with pool:
+            futures = {pool.submit(load, event, racetype, *load_arguments): (event, racetype) for event, racetype in tasks}
+            for future in as_completed(futures):
+                event, racetype = futures[future]
+                try:
+                    loaded[racetype][event['RoundNumber']] = future.result()
+                except Exception as e:
+                    logging.warning(f"Could not load {racetype} session of {year} round {event['RoundNumber']} ({event['EventName']}): {e}")
+
+    retrieved = {}
+    for racetype, sessions in loaded.items():
+        laps_frames = [sessions[round_number][0] for round_number in sorted(sessions)]
+        results_frames = [sessions[round_number][1] for round_number in sorted(sessions)]
+        laps_total = pd.concat(laps_frames, ignore_index=True) if laps_frames else pd.DataFrame()
+        results_total = pd.concat(results_frames, ignore_index=True) if results_frames else pd.DataFrame()
+        retrieved[racetype] = (laps_total, results_total)
+    return retrieved
+
+def ff1_retriever(year, racetype='R', workers=None, executor='thread', skip_ingested=True, profile='laps_results', snapshots=True):
     """
     Retrieves lap and race data for a given year and race type.
 
     Parameters:
         year (int): The year for which to retrieve data.
         racetype (str): The type of race (default is 'R' for race).
+        workers (int, optional): The number of sessions to load at the same time (default is None, sequential).
+        executor (str): The kind of worker pool, 'thread' or 'process' (default is 'thread').
+        skip_ingested (bool): Whether to skip rounds in the ingestion watermark (default is True).
+        profile (str): The load profile that decides which data fastf1 parses (default is 'laps_results').
+        snapshots (bool): Whether to read and write the session snapshots (default is True).
 
     Returns:
         tuple: A tuple containing dataframes for laps and results.
     """
-    enable_cache()
-    schedule = ff1.get_event_schedule(year)
-    laps_total = pd.DataFrame()
-    results_total = pd.DataFrame()
-    current_date = datetime.now()
+    return ff1_multi_retriever(year, [racetype], workers=workers, executor=executor, skip_ingested=skip_ingested, profile=profile, snapshots=snapshots)[racetype]
 
-    for index, round in enumerate(schedule['EventName']):
-        try:
-            event = schedule.get_event_by_round(index)
-            event_time = event['EventDate']
-            if event_time <= current_date:
-                session = event.get_session(racetype)
-                session.load()
-                session_laps = session.laps
-                session_results = session.results
-                session_info = session.session_info
-                session_date = event_time
-                
-                session_laps['year'] = session_date.year
-                session_results['year'] = session_date.year
-
-                session_laps = session_laps.merge(session_results[['Abbreviation', 'DriverId']], how='left', left_on='Driver', right_on='Abbreviation')
-                
-                important_info = extract_important_info(session_info)
-                for key, value in important_info.items():
-                    session_laps[key] = value
-                    session_results[key] = value
-
-                laps_total = pd.concat([laps_total, session_laps], ignore_index=True)
-                results_total = pd.concat([results_total, session_results], ignore_index=True)
-        except:
-            pass
-    return laps_total, results_total
-
-def add_new_entries(filename, new_data, staging_path=None, index_label=None):
+@instrumented(fields=lambda arguments: {'table': table_name(arguments['filename'])})
+def add_new_entries(filename, new_data, staging_path=None, index_label=None, mode='append'):
     """
     Adds new entries to the specified file.
 
+    In append mode the raceIds of the file are looked up in its sidecar key index
+    and only the rows of new races are appended, so the cost depends on the new
+    rows instead of the size of the file. The file is rewritten instead when the
+    new data has columns the file does not have yet. A keyed store upserts every
+    row by its natural key instead.
+
     Parameters:
         filename (str): The filename of the file to be updated.
         new_data (pd.DataFrame): The new data entries to be added.
         staging_path (str, optional): The path to the staging directory (default is None).
         index_label (str, optional): The label for the index column (default is None).
+        mode (str): 'append' to only write the new rows or 'rewrite' to rewrite the whole file (default is 'append').
     """
-    if staging_path is None:
-        _, staging_path = get_paths()
-    file_path = os.path.join(staging_path, filename)
-    existing_data = pd.read_csv(file_path, on_bad_lines='skip', header=0, delimiter=',', index_col=index_label)
-    new_entries = new_data[~new_data['raceId'].isin(existing_data['raceId'])]
-    
+    if mode not in ('append', 'rewrite'):
+        raise ValueError(f"Unknown mode '{mode}', expected 'append' or 'rewrite'.")
+    store = get_store(staging_path)
+    new_data = drop_missing_keys(new_data, filename)
+
+    if store.keyed and mode == 'append':
+        # Rows are upserted by their natural key, rows of stored races replace the stored ones
+        new_entries = store.match_keys(filename, new_data, index_label=index_label)
+        if not new_entries.empty:
+            store.append(filename, new_entries, index_label=index_label)
+            logging.info(f'Upserted entries for the {filename}: {set(new_entries["raceId"].to_list())}')
+        else:
+            logging.info(f'No new entries found for the {filename}')
+        return
+
+    if mode == 'append':
+        new_columns = set(new_data.columns) - set(store.columns(filename))
+        if new_columns:
+            logging.info(f'Rewriting {filename} to add the columns {sorted(new_columns)}')
+            mode = 'rewrite'
+
+    if mode == 'append':
+        existing_race_ids, max_index = load_key_index(store, filename, index_label=index_label)
+        new_entries = new_data[~new_data['raceId'].isin(existing_race_ids)]
+        if not new_entries.empty:
+            first_index = 0 if max_index is None else max_index + 1
+            new_entries = new_entries.set_axis(range(first_index, first_index + len(new_entries)))
+            store.append(filename, new_entries, index_label=index_label)
+            save_key_index(store, filename, existing_race_ids | set(new_entries['raceId'].to_list()),
+                           int(new_entries.index[-1]) if index_label else None, index_label=index_label)
+    else:
+        existing_data = store.read(filename, index_col=index_label)
+        new_entries = new_data[~new_data['raceId'].isin(existing_data['raceId'])]
+        if not new_entries.empty:
+            updated_data = pd.concat([existing_data, new_entries], ignore_index=True).reset_index(drop=True)
+            store.write(filename, updated_data, index_label=index_label)
+
     if not new_entries.empty:
-        updated_data = pd.concat([existing_data, new_entries], ignore_index=True).reset_index(drop=True)
-        updated_data.to_csv(file_path, header=True, index=True if index_label else False, index_label=index_label)
         entry_list = set(new_entries['raceId'].to_list())
         logging.info(f'Added new entries for the {filename}: {entry_list}')
     else:
         logging.info(f'No new entries found for the {filename}')
-        
+
 class Dim_Updater:
     """
     A class used to update dimension tables.
@@ -157,10 +695,14 @@ class Dim_Updater:
         """
         self.dim_table = dim_table
 
-    def add_new_entries(self, new_data, match_column, filename, id_column, entity_name, rename_dict, required_columns):
+    @instrumented(fields=lambda arguments: {'table': arguments['entity_name']})
+    def add_new_entries(self, new_data, match_column, filename, id_column, entity_name, rename_dict, required_columns, write=True):
         """
         Adds new entries to the dimension table.
 
+        New keys are found with a hash anti-join of the match columns against the
+        existing table.
+
         Parameters:
             new_data (pd.DataFrame): The new data to be added.
             match_column (list): The column(s) to match for existing data.
@@ -169,6 +711,7 @@ class Dim_Updater:
             entity_name (str): The name of the entity.
             rename_dict (dict): The dictionary to rename columns.
             required_columns (list): The list of required columns in the new data.
+            write (bool): Whether to write the updated table to the staging store (default is True).
 
         Returns:
             pd.DataFrame: The updated dimension table.
@@ -183,10 +726,9 @@ class Dim_Updater:
             new_data = new_data[required_columns]
             new_data = new_data.rename(columns=rename_dict)
             
-            existing_combinations = set(tuple(x) for x in self.dim_table[match_column].dropna().to_records(index=False))
-            new_data_combinations = set(tuple(x) for x in new_data[match_column].to_records(index=False))
-            new_combinations = new_data_combinations - existing_combinations
-            new_entries = new_data[new_data.apply(lambda x: tuple(x[match_column]) in new_combinations, axis=1)]
+            existing_keys = pd.MultiIndex.from_frame(self.dim_table[match_column].dropna())
+            new_keys = pd.MultiIndex.from_frame(new_data[match_column])
+            new_entries = new_data[~new_keys.isin(existing_keys)]
             new_entries = new_entries.drop_duplicates(subset=match_column)
 
             if new_entries.empty:
@@ -199,22 +741,22 @@ class Dim_Updater:
 
             logging.info(f"New entries appended successfully for {entity_name}.")
 
-            current_dir = os.getcwd()
-            staging_path = os.path.join(current_dir, '..', 'Data', 'Staging')
-            staging_path = os.path.normpath(staging_path)
-
-            updated_table.to_csv(os.path.join(staging_path, f'{filename}.csv'), header=True, index=False)
+            if write:
+                store = get_store()
+                store.write(filename, updated_table)
+                refresh_dimension_table(filename, updated_table, store)
             return updated_table
         except Exception as e:
             logging.error(f"An error occurred in {entity_name}: {str(e)}")
             raise
 
-    def update_drivers(self, new_data):
+    def update_drivers(self, new_data, write=True):
         """
         Updates the drivers dimension table with new data.
 
         Parameters:
             new_data (pd.DataFrame): The new driver data.
+            write (bool): Whether to write the updated table to the staging store (default is True).
 
         Returns:
             pd.DataFrame: The updated drivers dimension table.
@@ -225,14 +767,16 @@ class Dim_Updater:
                                     entity_name='drivers',
                                     rename_dict={'DriverId': 'driverRef', 'DriverNumber': 'number', 'Abbreviation': 'code', 'FirstName': 'forename', 'LastName': 'surname'},
                                     required_columns=['DriverId', 'DriverNumber', 'Abbreviation', 'FirstName', 'LastName'],
-                                    filename='drivers')
+                                    filename='drivers',
+                                    write=write)
 
-    def update_constructors(self, new_data):
+    def update_constructors(self, new_data, write=True):
         """
         Updates the constructors dimension table with new data.
 
         Parameters:
             new_data (pd.DataFrame): The new constructor data.
+            write (bool): Whether to write the updated table to the staging store (default is True).
 
         Returns:
             pd.DataFrame: The updated constructors dimension table.
@@ -243,14 +787,16 @@ class Dim_Updater:
                                     entity_name='constructors',
                                     rename_dict={'TeamId': 'constructorRef', 'TeamName': 'name'},
                                     required_columns=['TeamId', 'TeamName'],
-                                    filename='constructors')
+                                    filename='constructors',
+                                    write=write)
 
-    def update_races(self, new_data):
+    def update_races(self, new_data, write=True):
         """
         Updates the races dimension table with new data.
 
         Parameters:
             new_data (pd.DataFrame): The new race data.
+            write (bool): Whether to write the updated table to the staging store (default is True).
 
         Returns:
             pd.DataFrame: The updated races dimension table.
@@ -264,39 +810,115 @@ class Dim_Updater:
                                     entity_name='races',
                                     rename_dict={'RoundNumber': 'round', 'EventName': 'name', 'Circuit_ShortName': 'CircuitId'},
                                     required_columns=['RoundNumber', 'EventName', 'EventDate', 'year', 'Circuit_ShortName'],
-                                    filename='races')
+                                    filename='races',
+                                    write=write)
+
+@instrumented()
+def update_dimension_tables(drivers_data=None, constructors_data=None, races_data=None, write=True):
+    """
+    Updates the drivers, constructors and races dimension tables in one call.
+
+    All new entries are determined first and every changed table is written
+    once, which keeps backfills of many seasons at a single write per table.
+
+    Parameters:
+        drivers_data (pd.DataFrame, optional): The new driver data, e.g. fastf1 results (default is None).
+        constructors_data (pd.DataFrame, optional): The new constructor data, e.g. fastf1 results (default is None).
+        races_data (pd.DataFrame, optional): The new race data, e.g. a fastf1 event schedule (default is None).
+        write (bool): Whether to write the changed tables to the staging store (default is True).
+
+    Returns:
+        tuple: A tuple containing the updated drivers, constructors, and races dataframes.
+    """
+    store = get_store()
+    drivers, constructors, races = load_dimension_tables()
+    updated_tables = {}
+    if drivers_data is not None and not drivers_data.empty:
+        updated_tables['drivers'] = (drivers, Dim_Updater(drivers).update_drivers(drivers_data, write=False))
+    if constructors_data is not None and not constructors_data.empty:
+        updated_tables['constructors'] = (constructors, Dim_Updater(constructors).update_constructors(constructors_data, write=False))
+    if races_data is not None and not races_data.empty:
+        updated_tables['races'] = (races, Dim_Updater(races).update_races(races_data, write=False))
+
+    for name, (table, updated_table) in updated_tables.items():
+        if write and len(updated_table) != len(table):
+            store.write(name, updated_table)
+            refresh_dimension_table(name, updated_table, store)
+
+    return tuple(updated_tables[name][1] if name in updated_tables else table
+                 for name, table in [('drivers', drivers), ('constructors', constructors), ('races', races)])
+
+def format_lap_times(seconds):
+    """
+    Formats lap times in seconds as 'm:ss.sss' strings.
 
-def update_laps(laps):
+    Parameters:
+        seconds (np.ndarray): The lap times in seconds, without missing values.
+
+    Returns:
+        np.ndarray: The formatted lap times.
+    """
+    minutes = (seconds // 60).astype(np.int64).astype(str)
+    return np.char.add(np.char.add(minutes, ':'), np.char.mod('%06.3f', seconds % 60))
+
+def compact_lap_table(laps):
+    """
+    Converts a lap table to its compact representation.
+
+    Only the lap_times columns are kept, with int32 milliseconds, int16 lap and
+    position and categorical raceId and driverId keys.
+
+    Parameters:
+        laps (pd.DataFrame): The lap table with the lap_times columns.
+
+    Returns:
+        pd.DataFrame: The compact lap table.
+    """
+    return laps[LAP_TIME_COLUMNS].astype({
+        'raceId': 'Int32',
+        'driverId': 'Int32',
+        'lap': 'int16',
+        'position': 'Int16',
+        'milliseconds': 'int32'
+    }).astype({'raceId': 'category', 'driverId': 'category'})
+
+@instrumented()
+def update_laps(laps, lookups=None):
     """
     Updates the laps data.
 
     Parameters:
         laps (pd.DataFrame): The laps data to be updated.
+        lookups (dict, optional): The dimension lookups (default is None, those of the staged dimension tables).
 
     Returns:
         tuple: A tuple containing updated laps, fastest laps, and laps driven dataframes.
+               The updated laps are returned in the compact lap table representation.
     """
-    laps.rename(columns={'DriverId': 'driverRef',
-                         'race_name': 'name',
-                         'LapNumber': 'lap',
-                         'Position': 'position'},
-                         inplace=True)
-    laps = laps.astype({'lap': 'int64'})
-
-    dim_driver, _, dim_races = load_dimension_tables()
-
-    laps = laps.merge(dim_driver[['driverRef', 'driverId', 'number']], 
-                      how='left', 
-                      on='driverRef'
-                      ).merge(dim_races[['name', 'year', 'raceId']], 
-                              how='left',
-                              on=['name', 'year'])
-
-    laps['total_seconds'] = laps['LapTime'].dt.total_seconds()
-    laps['time'] = laps['total_seconds'].apply(lambda x: f"{int(x // 60)}:{(x % 60):06.3f}" if pd.notna(x) else np.nan)
-    laps['milliseconds'] = laps['total_seconds'].apply(lambda x: int(x * 1000) if pd.notna(x) else np.nan)
-    laps.drop(['total_seconds', 'LapTime'], axis=1, inplace=True)
-    laps.dropna(axis=0, subset='milliseconds', inplace=True)
+    laps = laps.rename(columns={'DriverId': 'driverRef',
+                                'race_name': 'name',
+                                'LapNumber': 'lap',
+                                'Position': 'position'})
+
+    # Laps without a lap time are dropped
+    seconds = laps['LapTime'].dt.total_seconds()
+    laps = laps[seconds.notna()].reset_index(drop=True)
+    seconds = seconds[seconds.notna()].to_numpy()
+
+    if lookups is None:
+        lookups = get_dimension_lookups()
+
+    laps = pd.DataFrame({
+        'raceId': lookup_race_ids(lookups['raceId'], laps['name'], laps['year']),
+        'driverId': laps['driverRef'].map(lookups['driverId']).to_numpy(),
+        'lap': laps['lap'].to_numpy(dtype=np.int64),
+        'position': laps['position'].to_numpy(),
+        'time': format_lap_times(seconds),
+        'milliseconds': (seconds * 1000).astype(np.int64)
+    })
+    # Laps of races missing from the races dimension or of unknown drivers are dropped
+    laps = laps[laps['raceId'].notna() & laps['driverId'].notna()].reset_index(drop=True)
+
     fastest_laps = laps.loc[laps.groupby(['raceId', 'driverId'])['milliseconds'].idxmin()]
 
     # Rename columns for merging later
@@ -310,9 +932,10 @@ def update_laps(laps):
     # Add a rank column based on fastestLapTime within each race
     fastest_laps['rank'] = fastest_laps.groupby('raceId')['fastestLapTime'].rank(method='min')
 
-    return laps, fastest_laps, laps_driven
+    return compact_lap_table(laps), fastest_laps, laps_driven
 
-def update_results(results, fastest_laps, laps_driven):
+@instrumented()
+def update_results(results, fastest_laps, laps_driven, lookups=None):
     """
     Updates the race results data.
 
@@ -320,21 +943,25 @@ def update_results(results, fastest_laps, laps_driven):
         results (pd.DataFrame): The race results data.
         fastest_laps (pd.DataFrame): The fastest laps data.
         laps_driven (pd.DataFrame): The laps driven data.
+        lookups (dict, optional): The dimension lookups (default is None, those of the staged dimension tables).
 
     Returns:
         pd.DataFrame: The updated race results data.
     """
-    dim_driver, dim_constructors, dim_races = load_dimension_tables()
-
-    results = results.merge(dim_driver[['driverRef', 'driverId', 'number']], how='left', left_on='DriverId', right_on='driverRef')
-    results = results.merge(dim_constructors[['constructorRef', 'constructorId']], how='left', left_on='TeamId', right_on='constructorRef')
-    results = results.merge(dim_races[['name', 'year', 'raceId']], left_on=['race_name', 'year'], right_on=['name', 'year'])
+    if lookups is None:
+        lookups = get_dimension_lookups()
+
+    results = results.assign(driverId=results['DriverId'].map(lookups['driverId']),
+                             constructorId=results['TeamId'].map(lookups['constructorId']),
+                             raceId=lookup_race_ids(lookups['raceId'], results['race_name'], results['year']))
+    # Results of races missing from the races dimension are dropped
+    results = results[results['raceId'].notna()].astype({'raceId': 'int64'})
     results = results.merge(fastest_laps[['raceId', 'driverId', 'fastestLap', 'rank', 'fastestLapTime']],
                             on=['raceId', 'driverId'], how='left')
     results = results.merge(laps_driven, on=['raceId', 'driverId'])
 
-    # Apply the calculation within each raceId group
-    results = results.groupby('raceId').apply(calculate_total_times)
+    # Add the winner's time to the gaps of every race at once
+    results = calculate_total_times(results)
 
     # Convert 'Total Time' to milliseconds
     results['milliseconds'] = results['milliseconds'].dt.total_seconds() * 1000
@@ -352,21 +979,26 @@ def update_results(results, fastest_laps, laps_driven):
     
     return results
 
-def update_qualifying(Q_results):
+@instrumented()
+def update_qualifying(Q_results, lookups=None):
     """
     Updates the qualifying results data.
 
     Parameters:
         Q_results (pd.DataFrame): The qualifying results data.
+        lookups (dict, optional): The dimension lookups (default is None, those of the staged dimension tables).
 
     Returns:
         pd.DataFrame: The updated qualifying results data.
     """
-    dim_driver, dim_constructors, dim_races = load_dimension_tables()
+    if lookups is None:
+        lookups = get_dimension_lookups()
 
-    Q_results = Q_results.merge(dim_driver[['driverRef', 'driverId', 'number']], how='left', left_on='DriverId', right_on='driverRef')
-    Q_results = Q_results.merge(dim_constructors[['constructorRef', 'constructorId']], how='left', left_on='TeamId', right_on='constructorRef')
-    Q_results = Q_results.merge(dim_races[['name', 'year', 'raceId']], left_on=['race_name', 'year'], right_on=['name', 'year'])
+    Q_results = Q_results.assign(driverId=Q_results['DriverId'].map(lookups['driverId']),
+                                 constructorId=Q_results['TeamId'].map(lookups['constructorId']),
+                                 raceId=lookup_race_ids(lookups['raceId'], Q_results['race_name'], Q_results['year']))
+    # Results of races missing from the races dimension are dropped
+    Q_results = Q_results[Q_results['raceId'].notna()].astype({'raceId': 'int64'})
 
     Q_results = Q_results[['raceId', 'driverId', 'constructorId', 'DriverNumber', 'Position', 'Q1', 'Q2', 'Q3']]
     Q_results = Q_results.rename(columns={'DriverNumber': 'number',
@@ -376,9 +1008,9 @@ def update_qualifying(Q_results):
                                           'Q3': 'q3'})
     return Q_results
 
-def update_standings(results, sprint_results, races):
+def combine_race_and_sprint_results(results, sprint_results, races):
     """
-    Updates the driver and constructor standings.
+    Combines race and sprint results in round order for the standings calculation.
 
     Parameters:
         results (pd.DataFrame): The race results data.
@@ -386,24 +1018,28 @@ def update_standings(results, sprint_results, races):
         races (pd.DataFrame): The races data.
 
     Returns:
-        tuple: A tuple containing updated driver standings and constructor standings dataframes.
+        pd.DataFrame: The race and sprint results with win, Type and the race columns, sorted by year and round.
     """
-    results['win'] = results['positionOrder'].apply(lambda x: 1 if x == 1 else 0)
-    sprint_results['win'] = sprint_results['positionOrder'].apply(lambda x: 1 if x == 1 else 0)
-
-    results['Type'] = 'Race'
-    sprint_results['Type'] = 'Sprint'
+    results = results.assign(win=(results['positionOrder'] == 1).astype(int), Type='Race')
+    sprint_results = sprint_results.assign(win=(sprint_results['positionOrder'] == 1).astype(int), Type='Sprint')
 
     results = pd.concat([results, sprint_results], ignore_index=True)
     results = results.merge(races, how='left', on='raceId')
 
-    # Sort results to ensure cumulative sum respects the round order
-    results.sort_values(by=['year', 'round'], inplace=True)
+    # Sort results to ensure cumulative sum respects the round order, the stable
+    # sort keeps the race of a round before its sprint
+    return results.sort_values(by=['year', 'round'], kind='stable')
 
-    # Create cumulative sum of points and wins per driver per year up to the current round
-    results['cumulative_points'] = results.groupby(['driverId', 'year'])['points'].cumsum()
-    results['cumulative_wins'] = results.groupby(['driverId', 'year', 'Type'])['win'].cumsum()
+def standings_from_cumulative(results):
+    """
+    Builds the driver and constructor standings from cumulative points and wins.
+
+    Parameters:
+        results (pd.DataFrame): The combined results with cumulative_points and cumulative_wins.
 
+    Returns:
+        tuple: A tuple containing driver standings and constructor standings dataframes.
+    """
     # Filter only Race wins for the cumulative wins calculation
     results = results[results['Type'] == 'Race']
 
@@ -421,3 +1057,232 @@ def update_standings(results, sprint_results, races):
 
     driverpoint_df.drop(axis=1, columns='constructorId', inplace=True)
     return driverpoint_df, constructorpoints_df
+
+@instrumented()
+def update_standings(results, sprint_results, races):
+    """
+    Updates the driver and constructor standings.
+
+    This is the full rebuild over the complete history, see update_standings_incremental
+    for rolling the persisted standings forward.
+
+    Parameters:
+        results (pd.DataFrame): The race results data.
+        sprint_results (pd.DataFrame): The sprint race results data.
+        races (pd.DataFrame): The races data.
+
+    Returns:
+        tuple: A tuple containing updated driver standings and constructor standings dataframes.
+    """
+    results = combine_race_and_sprint_results(results, sprint_results, races)
+
+    # Create cumulative sum of points and wins per driver per year up to the current round
+    results['cumulative_points'] = results.groupby(['driverId', 'year'])['points'].cumsum()
+    results['cumulative_wins'] = results.groupby(['driverId', 'year', 'Type'])['win'].cumsum()
+
+    return standings_from_cumulative(results)
+
+@instrumented()
+def update_standings_incremental(results, sprint_results, races, driver_standings):
+    """
+    Rolls the driver and constructor standings forward from the persisted standings.
+
+    Races without driver standings are new. The cumulative points and wins of every
+    driver are seeded with their last persisted standing of the season plus the
+    persisted sprint points that came after it, and only the new race and sprint
+    rows are accumulated on top. The result is identical to the rows of the new
+    races in update_standings.
+
+    Parameters:
+        results (pd.DataFrame): The race results data, at least of the seasons with new races.
+        sprint_results (pd.DataFrame): The sprint race results data, at least of the seasons with new races.
+        races (pd.DataFrame): The races data.
+        driver_standings (pd.DataFrame): The persisted driver standings, at least of the seasons with new races.
+
+    Returns:
+        tuple: A tuple containing the driver standings and constructor standings dataframes of the new races.
+    """
+    known_race_ids = driver_standings['raceId']
+    new_results = results[~results['raceId'].isin(known_race_ids)]
+    new_sprint_results = sprint_results[~sprint_results['raceId'].isin(known_race_ids)]
+    combined = combine_race_and_sprint_results(new_results, new_sprint_results, races)
+    if combined.empty:
+        return standings_from_cumulative(combined.assign(cumulative_points=0.0, cumulative_wins=0))
+
+    race_rounds = races[['raceId', 'year', 'round']]
+    seasons = combined['year'].unique()
+
+    # Last persisted standing of every driver in the seasons being rolled forward
+    last_standings = (driver_standings[['raceId', 'driverId', 'points', 'wins']]
+                      .merge(race_rounds, on='raceId')
+                      .query('year in @seasons')
+                      .sort_values(['year', 'round'], kind='stable')
+                      .groupby(['driverId', 'year'], as_index=False)
+                      .last())
+
+    # Persisted sprint points from the round of the last standing onwards are not part of it yet
+    persisted_sprints = (sprint_results[sprint_results['raceId'].isin(known_race_ids)][['raceId', 'driverId', 'points']]
+                         .merge(race_rounds, on='raceId')
+                         .query('year in @seasons')
+                         .merge(last_standings[['driverId', 'year', 'round']], on=['driverId', 'year'], how='left', suffixes=('', '_standing')))
+    persisted_sprints = persisted_sprints[~(persisted_sprints['round'] < persisted_sprints['round_standing'])]
+    sprint_seed = persisted_sprints.groupby(['driverId', 'year'], as_index=False)['points'].sum()
+
+    seeds = (last_standings[['driverId', 'year', 'points', 'wins']]
+             .merge(sprint_seed, on=['driverId', 'year'], how='outer', suffixes=('', '_sprint'))
+             .fillna({'points': 0, 'wins': 0, 'points_sprint': 0}))
+    seeds['seed_points'] = seeds['points'] + seeds['points_sprint']
+    combined = combined.merge(seeds[['driverId', 'year', 'seed_points', 'wins']].rename(columns={'wins': 'seed_wins'}),
+                              on=['driverId', 'year'], how='left').fillna({'seed_points': 0, 'seed_wins': 0})
+    combined['seed_wins'] = combined['seed_wins'].astype(int)
+
+    # Accumulate the new rows on top of the seeds
+    combined['cumulative_points'] = combined['seed_points'] + combined.groupby(['driverId', 'year'])['points'].cumsum()
+    combined['cumulative_wins'] = combined.groupby(['driverId', 'year', 'Type'])['win'].cumsum()
+    combined.loc[combined['Type'] == 'Race', 'cumulative_wins'] += combined['seed_wins']
+
+    return standings_from_cumulative(combined)
+
+def backfill_season(year, racetypes, checkpoint_path, workers=None, profile='laps_results', snapshots=True):
+    """
+    Loads the not yet ingested sessions of a season with a checkpoint after every session.
+
+    Runs in a worker process of the backfill, an interrupted season resumes from its checkpoints.
+
+    Parameters:
+        year (int): The season.
+        racetypes (list): The session types to load.
+        checkpoint_path (str): The directory holding the checkpoints.
+        workers (int, optional): The number of sessions of the season to load at the same time (default is None, sequential).
+        profile (str): The load profile that decides which data fastf1 parses (default is 'laps_results').
+        snapshots (bool): Whether to read and write the session snapshots (default is True).
+
+    Returns:
+        tuple: The event schedule and a dictionary mapping each session type to a tuple of laps and results dataframes.
+    """
+    enable_cache()
+    schedule = get_event_schedule(year, snapshots)
+    sessions = ff1_multi_retriever(year, racetypes, workers=workers, executor='thread', schedule=schedule,
+                                   profile=profile, checkpoint_path=checkpoint_path, snapshots=snapshots)
+    return schedule, sessions
+
+def refresh_snapshots(year, racetypes, rounds=None, workers=None, profile='laps_results'):
+    """
+    Loads sessions from fastf1 again and replaces their snapshots, the staging tables are not changed.
+
+    A session that fails to load keeps its old snapshot.
+
+    Parameters:
+        year (int): The season.
+        racetypes (list): The session types to refresh.
+        rounds (list, optional): The rounds to refresh (default is None, every past round).
+        workers (int, optional): The number of sessions to load at the same time (default is None, sequential).
+        profile (str): The load profile that decides which data fastf1 parses (default is 'laps_results').
+
+    Returns:
+        int: The number of refreshed sessions.
+    """
+    snapshot_path = resolve_snapshot_path(True)
+    if snapshot_path is None:
+        raise ImportError("Session snapshots require pyarrow, install it with 'pip install pyarrow'.")
+    enable_cache()
+    schedule = ff1.get_event_schedule(year)
+    write_schedule_snapshot(snapshot_path, year, schedule)
+
+    tasks = []
+    for round_number in schedule['RoundNumber']:
+        if round_number < 1 or (rounds is not None and round_number not in rounds):
+            continue
+        event = schedule.get_event_by_round(round_number)
+        if event['EventDate'] > datetime.now():
+            continue
+        tasks.extend((event, racetype) for racetype in racetypes if event_has_session(event, racetype))
+
+    refreshed = 0
+    with ThreadPoolExecutor(max_workers=workers or 1) as pool:
+        futures = {pool.submit(load_event_session, event, racetype, profile, snapshot_path): (event, racetype) for event, racetype in tasks}
+        for future in as_completed(futures):
+            event, racetype = futures[future]
+            try:
+                future.result()
+                refreshed += 1
+            except Exception as e:
+                logging.warning(f"Could not refresh {racetype} session of {year} round {event['RoundNumber']} ({event['EventName']}): {e}")
+    return refreshed
+
+def stage_sessions(transaction, sessions, schedule, standings='incremental', watermark=None):
+    """
+    Stages loaded sessions of one or more seasons in a staging transaction.
+
+    The dimension tables are updated in memory and the lookups come from them, so
+    nothing is read back from Staging. Every table gets at most one write when the
+    transaction commits, whatever the number of seasons.
+
+    Parameters:
+        transaction (StagingTransaction): The transaction the changes are staged in.
+        sessions (dict): A dictionary mapping each session type to a tuple of laps and results dataframes.
+        schedule (pd.DataFrame): The event schedules of the seasons.
+        standings (str): 'incremental' to roll the persisted standings forward, 'full' to rebuild them (default is 'incremental').
+        watermark (dict, optional): The ingestion watermark to extend (default is None, the one in Staging).
+
+    Returns:
+        dict: The updated ingestion watermark, also staged in the transaction.
+    """
+    empty = (pd.DataFrame(), pd.DataFrame())
+    R_laps, R_results = sessions.get('R', empty)
+    _, Q_results = sessions.get('Qualifying', empty)
+    Sprint_laps, Sprint_results = sessions.get('Sprint', empty)
+
+    def record_rounds(racetype, results, staged):
+        # Only the rounds that made it into the staged rows, dropped rounds are fetched again
+        for year, rounds in staged_rounds(results, staged, racetype, lookups).groupby('year')['RoundNumber']:
+            record_ingested(watermark, year, racetype, rounds)
+
+    # Add new drivers, constructors and races, the lookups come from the updated tables in memory
+    drivers_data = R_results if not R_results.empty else None
+    dimensions = dict(zip(['drivers', 'constructors', 'races'], update_dimension_tables(drivers_data, drivers_data, schedule, write=False)))
+    lookups = {}
+    for name, table in dimensions.items():
+        if len(table) != len(transaction.read(name)):
+            transaction.write(name, table)
+        lookups.update(build_dimension_lookups(name, table))
+
+    if watermark is None:
+        watermark = load_watermark(transaction.store.root)
+
+    if not Q_results.empty:
+        qualifying = update_qualifying(Q_results, lookups)
+        transaction.add_new_entries('qualifying', qualifying)
+        record_rounds('Qualifying', Q_results, qualifying)
+
+    if not R_results.empty:
+        laps, fastest_laps, laps_driven = update_laps(R_laps, lookups)
+        results = update_results(R_results, fastest_laps, laps_driven, lookups)
+        transaction.add_new_entries('results', results, index_label='resultId')
+        transaction.add_new_entries('lap_times', laps)
+        record_rounds('R', R_results, results)
+
+    if not Sprint_results.empty:
+        _, fastest_laps, laps_driven = update_laps(Sprint_laps, lookups)
+        sprint_results = update_results(Sprint_results, fastest_laps, laps_driven, lookups)
+        transaction.add_new_entries('sprint_results', sprint_results, index_label='resultId')
+        record_rounds('Sprint', Sprint_results, sprint_results)
+
+    # The standings are computed from the results in memory instead of reading them back from Staging
+    races = transaction.read('races')
+    if standings == 'incremental':
+        # Standings restart every season, so only the seasons with new results are needed to roll them forward
+        years = sorted(set(R_results.get('year', [])) | set(Sprint_results.get('year', [])))
+        results = transaction.read('results', index_col='resultId', years=years)
+        sprint_results = transaction.read('sprint_results', index_col='resultId', years=years)
+        driver_standings = transaction.read('driver_standings', index_col='driverStandingsId', years=years)
+        driverpoint_df, constructorpoints_df = update_standings_incremental(results, sprint_results, races, driver_standings)
+    else:
+        results = transaction.read('results', index_col='resultId')
+        sprint_results = transaction.read('sprint_results', index_col='resultId')
+        driverpoint_df, constructorpoints_df = update_standings(results, sprint_results, races)
+
+    transaction.add_new_entries('driver_standings', driverpoint_df, index_label='driverStandingsId')
+    transaction.add_new_entries('constructor_standings', constructorpoints_df, index_label='constructorStandingsId')
+    transaction.write_file('ingestion_watermark.json', json.dumps(watermark, indent=2, sort_keys=True))
+    return watermark
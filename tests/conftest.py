@@ -0,0 +1,22 @@
+import pytest
+from my_functions.preparation_stages import preparation_graph
+from my_functions.storage import CsvStore
+from my_functions.synthetic_data import make_staging_tables
+
+@pytest.fixture(scope='session')
+def staging_tables():
+    """
+    Synthetic staging tables of four seasons, the last two with sprint weekends.
+    """
+    return make_staging_tables(seasons=4, last_year=2022, drivers_per_race=12, seed=7)
+
+@pytest.fixture(scope='session')
+def prepared_data(staging_tables, tmp_path_factory):
+    """
+    The prepared data of the synthetic staging tables.
+    """
+    root = tmp_path_factory.mktemp('prepared')
+    store = CsvStore(str(root / 'Staging'))
+    for name, table in staging_tables.items():
+        store.write(name, table)
+    return preparation_graph(store, str(root / '.stage_cache')).run('skills')
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import pandas as pd
+import pytest
+from my_functions.preparation_stages import preparation_graph, write_prepared_data
+from my_functions.prediction import PodiumPredictor, save_model, train_podium_model
+from my_functions.storage import CsvStore
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def service_root(staging_tables, tmp_path_factory):
+    """
+    A Data directory with the staging tables, the prepared data and a trained model, and a working directory next to it.
+    """
+    root = tmp_path_factory.mktemp('service')
+    staging = CsvStore(str(root / 'Data' / 'Staging'))
+    for name, table in staging_tables.items():
+        staging.write(name, table)
+    prepared = CsvStore(str(root / 'Data' / 'Prepared'))
+    data = write_prepared_data(preparation_graph(staging, str(root / 'Data' / 'Prepared' / '.stage_cache')), prepared)
+    save_model(train_podium_model(data), str(root / 'Data' / 'Models' / 'podium_model.pkl'))
+    (root / 'w').mkdir()
+    return root
+
+@pytest.fixture
+def predictor(service_root):
+    return PodiumPredictor(CsvStore(str(service_root / 'Data' / 'Staging')), CsvStore(str(service_root / 'Data' / 'Prepared')),
+                           str(service_root / 'Data' / 'Models' / 'podium_model.pkl'))
+
+@pytest.fixture
+def requests(staging_tables):
+    """
+    The fields of the last two races.
+    """
+    results = staging_tables['results']
+    race_ids = sorted(results['raceId'].unique())[-2:]
+    return results[results['raceId'].isin(race_ids)][['raceId', 'driverId', 'grid']].reset_index(drop=True)
+
+def test_predict_batch_puts_three_drivers_per_race_on_the_podium(predictor, requests):
+    # A second entry of the third most likely driver ties with it for the last podium place
+    third = predictor.predict_batch(requests).groupby('raceId').nth(2)
+    requests = pd.concat([requests, third[['raceId', 'driverId', 'grid']]], ignore_index=True)
+
+    predictions = predictor.predict_batch(requests)
+
+    assert len(predictions) == len(requests)
+    assert predictions.groupby('raceId')['predicted_podium'].sum().eq(3).all()
+    for _, race in predictions.groupby('raceId'):
+        assert race.loc[race['predicted_podium'], 'podium_probability'].min() >= race.loc[~race['predicted_podium'], 'podium_probability'].max()
+
+def test_predict_scores_the_field_of_a_race(predictor, requests):
+    race = requests[requests['raceId'] == requests['raceId'].max()]
+
+    predictions = predictor.predict(int(race['raceId'].iloc[0]), dict(zip(race['driverId'], race['grid'])))
+
+    assert sorted(predictions['driverId']) == sorted(race['driverId'])
+    assert predictions['predicted_podium'].sum() == 3
+    assert predictions['podium_probability'].is_monotonic_decreasing
+
+def test_batch_mode_writes_the_predictions_as_json(service_root, predictor, requests):
+    requests.to_csv(service_root / 'requests.csv', index=False)
+    env = {key: value for key, value in os.environ.items() if key != 'F1_STORAGE_BACKEND'}
+
+    process = subprocess.run([sys.executable, os.path.join(REPO, 'f1_podium_service.py'), '--batch', str(service_root / 'requests.csv')],
+                             cwd=service_root / 'w', env={**env, 'PYTHONPATH': REPO}, capture_output=True, text=True, check=True)
+
+    output = pd.DataFrame(json.loads(process.stdout)['predictions'])
+    expected = predictor.predict_batch(requests)
+    assert list(output.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(output, expected, check_dtype=False)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+from my_functions.preparation_functions import (SKILL_FEATURE_COLUMNS, GroupedAccumulator, SkillFeatureState, average_lap_times,
+                                                incremental_skill_features, overtakes_per_track, skill_features)
+
+def race_data(staging_tables):
+    """
+    One row per driver per race with the race columns and grid_end_diff, like the merged preparation data.
+    """
+    data = staging_tables['results'].merge(staging_tables['races'][['raceId', 'year', 'round', 'circuitId']], on='raceId')
+    data['grid_end_diff'] = (data['positionOrder'] - data['grid']).abs()
+    data['grid_end_diff_overtakes'] = (data['positionOrder'] - data['grid']).clip(lower=0)
+    data['grid_end_diff_defense'] = (data['positionOrder'] - data['grid']).clip(upper=0)
+    return data
+
+def overtakes_per_track_loop(data):
+    """
+    The original per season loop overtakes_per_track replaced.
+    """
+    df_overtakes = pd.DataFrame()
+    for year in sorted(data['year'].unique()):
+        previous_years_data = data[data['year'] < year].copy()
+        previous_years_data['overtakes_per_track'] = previous_years_data.groupby('circuitId')['grid_end_diff'].transform('mean')
+        previous_years_data = previous_years_data[["overtakes_per_track", "circuitId"]].drop_duplicates()
+        previous_years_data['year'] = year
+        df_overtakes = pd.concat([df_overtakes, previous_years_data], ignore_index=True)
+    return df_overtakes
+
+def test_overtakes_per_track_matches_loop(staging_tables):
+    data = race_data(staging_tables)
+
+    merged = data.merge(overtakes_per_track(data), on=['circuitId', 'year'], how='left')
+    expected = data.merge(overtakes_per_track_loop(data), on=['circuitId', 'year'], how='left')
+
+    assert merged['overtakes_per_track'].notna().any()
+    pd.testing.assert_series_equal(merged['overtakes_per_track'], expected['overtakes_per_track'])
+
+def split_at_race(data, race_id):
+    return data[data['raceId'] <= race_id], data[data['raceId'] > race_id]
+
+def test_skill_feature_state_update_matches_full_history(staging_tables):
+    data = race_data(staging_tables)
+    full = skill_features(data)
+    earlier, new = split_at_race(data, data['raceId'].quantile(0.8))
+
+    state = SkillFeatureState.from_history(earlier)
+    first = state.update(new[new['raceId'] <= new['raceId'].min() + 2])
+    second = state.update(new[new['raceId'] > new['raceId'].min() + 2])
+
+    updated = pd.concat([first, second]).sort_values(['driverId', 'raceId'])
+    expected = full[full['raceId'].isin(new['raceId'])]
+    np.testing.assert_allclose(updated[SKILL_FEATURE_COLUMNS].to_numpy(), expected[SKILL_FEATURE_COLUMNS].to_numpy())
+    pd.testing.assert_frame_equal(state.drivers.sort_index(), SkillFeatureState.from_history(data).drivers.sort_index(), check_dtype=False)
+
+def test_skill_feature_state_rejects_known_races(staging_tables):
+    data = race_data(staging_tables)
+    state = SkillFeatureState.from_history(data)
+
+    with pytest.raises(ValueError):
+        state.update(data[data['raceId'] == data['raceId'].max()])
+
+def test_incremental_skill_features_match_full_history(staging_tables):
+    data = race_data(staging_tables)
+    full = skill_features(data)
+    earlier, _ = split_at_race(data, data['raceId'].quantile(0.8))
+    previous = full[full['raceId'].isin(earlier['raceId'])]
+
+    output = incremental_skill_features(data, SkillFeatureState.from_history(earlier), previous)
+
+    assert list(output.columns) == list(full.columns)
+    pd.testing.assert_frame_equal(output.drop(columns=SKILL_FEATURE_COLUMNS), full.drop(columns=SKILL_FEATURE_COLUMNS))
+    np.testing.assert_allclose(output[SKILL_FEATURE_COLUMNS].to_numpy(), full[SKILL_FEATURE_COLUMNS].to_numpy())
+
+def test_incremental_skill_features_detect_rewritten_history(staging_tables):
+    data = race_data(staging_tables)
+    earlier, new = split_at_race(data, data['raceId'].quantile(0.8))
+    state = SkillFeatureState.from_history(earlier)
+    previous = skill_features(earlier)
+
+    # Only the history of the drivers of the new races is checked against the state
+    racing = earlier.index[earlier['driverId'].isin(new['driverId'])][0]
+    retired = earlier.index[~earlier['driverId'].isin(new['driverId'])][0]
+    rewritten = data.copy()
+    rewritten.loc[racing, 'grid_end_diff_overtakes'] += 1
+    unchecked = data.copy()
+    unchecked.loc[retired, 'grid_end_diff_overtakes'] += 1
+    dropped = data.drop(index=retired)
+
+    assert state.new_race_rows(rewritten) is None
+    assert incremental_skill_features(rewritten, state, previous) is None
+    assert state.new_race_rows(unchecked) is not None
+    assert incremental_skill_features(dropped, state, previous) is None
+
+@pytest.mark.parametrize('chunks', [1, 7])
+def test_grouped_accumulator_matches_groupby(staging_tables, chunks):
+    lap_times = staging_tables['lap_times'].sample(frac=1.0, random_state=3)
+    lap_times['milliseconds'] = lap_times['milliseconds'].astype(float)
+    # Missing lap times and a key with a single lap
+    lap_times.iloc[::50, lap_times.columns.get_loc('milliseconds')] = np.nan
+    lap_times = pd.concat([lap_times, pd.DataFrame({'raceId': [0], 'driverId': [0], 'milliseconds': [90000.0]})], ignore_index=True)
+
+    accumulator = GroupedAccumulator(['raceId', 'driverId'], 'milliseconds').consume(lap_times.iloc[rows] for rows in np.array_split(np.arange(len(lap_times)), chunks))
+
+    grouped = lap_times.groupby(['raceId', 'driverId'])['milliseconds']
+    pd.testing.assert_series_equal(accumulator.count().sort_index(), grouped.count(), check_names=False, check_dtype=False)
+    pd.testing.assert_series_equal(accumulator.mean().sort_index(), grouped.mean(), check_names=False)
+    pd.testing.assert_series_equal(accumulator.variance().sort_index(), grouped.var(), check_names=False)
+    pd.testing.assert_series_equal(accumulator.variance(ddof=0).sort_index(), grouped.var(ddof=0), check_names=False)
+
+def test_average_lap_times_streams_chunks(staging_tables):
+    lap_times = staging_tables['lap_times']
+    chunks = (lap_times.iloc[start:start + 1000] for start in range(0, len(lap_times), 1000))
+
+    expected = lap_times.groupby(['raceId', 'driverId'], as_index=False)['milliseconds'].mean().rename(columns={'milliseconds': 'laptime_avg'})
+    pd.testing.assert_frame_equal(average_lap_times(chunks).sort_values(['raceId', 'driverId']).reset_index(drop=True), expected)
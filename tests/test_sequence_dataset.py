@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from my_functions.prediction import MODEL_FEATURES, TARGET
+from my_functions.sequence_dataset import SequenceDataset
+
+WINDOW = 5
+
+def reshape_for_lstm(X, sequence_length=20):
+    """
+    The copying reshape of the training notebook.
+    """
+    X_lstm = []
+    for i in range(0, len(X) - sequence_length + 1):
+        X_lstm.append(X[i:i + sequence_length])
+    return np.array(X_lstm)
+
+def reshape_target(y, sequence_length=20):
+    """
+    The target reshape of the training notebook.
+    """
+    y_lstm = []
+    for i in range(sequence_length - 1, len(y)):
+        y_lstm.append(y[i])
+    return np.array(y_lstm)
+
+@pytest.fixture(scope='module')
+def dataset(prepared_data):
+    return SequenceDataset.from_prepared(prepared_data, window=WINDOW)
+
+def notebook_sequences(prepared_data):
+    """
+    The notebook's copied sequences and targets, built per driver.
+    """
+    rows = prepared_data.dropna(subset=MODEL_FEATURES + [TARGET]).sort_values(['driverId', 'year', 'round'], kind='stable')
+    sequences, targets = [], []
+    for _, driver in rows.groupby('driverId', sort=True):
+        if len(driver) >= WINDOW:
+            sequences.append(reshape_for_lstm(driver[MODEL_FEATURES].to_numpy(dtype='float32'), WINDOW))
+            targets.append(reshape_target(driver[TARGET].to_numpy(dtype='float32'), WINDOW))
+    return np.concatenate(sequences), np.concatenate(targets)
+
+def test_windows_match_the_notebook_reshape(dataset):
+    np.testing.assert_array_equal(dataset.windows, reshape_for_lstm(dataset.values, WINDOW))
+
+def test_batches_match_the_notebook_sequences(prepared_data, dataset):
+    expected_sequences, expected_targets = notebook_sequences(prepared_data)
+
+    batches = list(dataset.batches(batch_size=64))
+    sequences = np.concatenate([batch for batch, _ in batches])
+    targets = np.concatenate([target for _, target in batches])
+
+    assert len(dataset) == len(expected_sequences) > 0
+    np.testing.assert_array_equal(sequences, expected_sequences)
+    np.testing.assert_array_equal(targets, expected_targets)
+    np.testing.assert_array_equal(targets, dataset.labels)
+
+def test_no_window_spans_two_drivers(dataset):
+    sequences, _ = dataset.batch(np.arange(len(dataset)))
+    drivers = sequences[:, :, MODEL_FEATURES.index('driverId')]
+
+    assert (drivers == drivers[:, :1]).all()
+
+def test_batch_scales_with_the_scaler(dataset):
+    scaler = dataset.fit_scaler()
+    sequences, _ = dataset.batch(np.arange(len(dataset)), scaler)
+
+    assert sequences.min() >= 0 and sequences.max() <= 1
+    np.testing.assert_allclose(sequences * scaler[1] + scaler[0], dataset.batch(np.arange(len(dataset)))[0], rtol=1e-5, atol=1e-3)
+
+@pytest.mark.parametrize('n_splits', [2, 3])
+def test_time_series_splits_never_train_on_test_races(dataset, n_splits):
+    folds = list(dataset.time_series_splits(n_splits))
+
+    assert len(folds) == n_splits
+    for train, test in folds:
+        # The last race of a sequence is the race it predicts, every other race of a window is before it
+        train_races = train.race_numbers[train.end_rows]
+        test_races = test.race_numbers[test.end_rows]
+        assert len(train) and len(test)
+        assert train_races.max() < test_races.min()
+        assert not np.isin(train.race_ids[train.end_rows], test.race_ids[test.end_rows]).any()
+    assert all(previous.race_numbers[previous.end_rows].max() < following.race_numbers[following.end_rows].min()
+               for (_, previous), (_, following) in zip(folds, folds[1:]))
+
+def test_save_and_load_round_trip_with_mmap(dataset, tmp_path):
+    fingerprint = dataset.save(str(tmp_path / 'sequences'))
+
+    loaded = SequenceDataset.load(str(tmp_path / 'sequences'), mmap=True)
+
+    assert SequenceDataset.saved_fingerprint(str(tmp_path / 'sequences')) == fingerprint
+    assert isinstance(loaded.values, np.memmap) and not loaded.values.flags.writeable
+    assert loaded.window == dataset.window and loaded.features == dataset.features
+    positions = np.arange(len(dataset))
+    for actual, expected in zip(loaded.batch(positions, dataset.fit_scaler()), dataset.batch(positions, dataset.fit_scaler())):
+        np.testing.assert_array_equal(actual, expected)
+    assert loaded.save(str(tmp_path / 'again')) == fingerprint
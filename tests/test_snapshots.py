@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+import my_functions.update_functions as update_functions
+from my_functions.snapshots import get_snapshot_path, invalidate_snapshots, list_snapshots
+from my_functions.storage import CsvStore
+from my_functions.synthetic_data import make_fastf1_season
+
+pytest.importorskip('pyarrow')
+
+YEAR = 2023
+
+class Schedule(pd.DataFrame):
+    """
+    The schedule of a synthetic season, get_event_by_round returns its synthetic events like a fastf1 schedule.
+    """
+    _metadata = ['events']
+
+    def get_event_by_round(self, round_number):
+        return self.events[round_number - 1]
+
+@pytest.fixture
+def season(staging_tables, tmp_path, monkeypatch):
+    """
+    A working directory next to a Data directory with the staging tables, and a synthetic season whose session loads are counted.
+    """
+    store = CsvStore(str(tmp_path / 'Data' / 'Staging'))
+    for name, table in staging_tables.items():
+        store.write(name, table)
+    (tmp_path / 'w').mkdir()
+    monkeypatch.chdir(tmp_path / 'w')
+    monkeypatch.setattr(update_functions, 'enable_cache', lambda: None)
+
+    frame, events = make_fastf1_season(YEAR, staging_tables['drivers'], staging_tables['constructors'], rounds=3, seed=1)
+    schedule = Schedule(frame)
+    schedule.events = events
+    loads = []
+    for event in events:
+        for racetype, session in event.sessions.items():
+            original = session.load
+            session.load = lambda original=original, key=(event['RoundNumber'], racetype), **kwargs: (loads.append(key), original(**kwargs))
+    return store, schedule, loads
+
+def retrieve(schedule):
+    return update_functions.ff1_multi_retriever(YEAR, ['R', 'Qualifying'], schedule=schedule)
+
+def test_sessions_are_snapshotted_and_listed(season):
+    _, schedule, loads = season
+
+    retrieve(schedule)
+
+    snapshots = list_snapshots(get_snapshot_path(), YEAR)
+    assert len(loads) == 6
+    assert sorted(zip(snapshots['round'], snapshots['session'])) == sorted(loads)
+    # The synthetic qualifying sessions have results but no laps
+    assert (snapshots['results'] > 0).all() and (snapshots.loc[snapshots['session'] == 'R', 'laps'] > 0).all()
+
+def test_snapshots_are_restored_after_the_staging_tables_change(season):
+    store, schedule, loads = season
+    first = retrieve(schedule)
+    update_functions.mark_ingested(YEAR, 'R', [1, 2, 3])
+    update_functions.mark_ingested(YEAR, 'Qualifying', [1, 2, 3])
+
+    # The staged rounds are rolled back, the next update has to stage the season again without fastf1
+    races = store.read('races')
+    store.write('races', races[races['year'] < races['year'].max()])
+    update_functions.clear_watermark(YEAR)
+    loads.clear()
+    restored = retrieve(schedule)
+
+    assert loads == []
+    for racetype in ['R', 'Qualifying']:
+        for expected, actual in zip(first[racetype], restored[racetype]):
+            pd.testing.assert_frame_equal(actual, expected)
+    assert len(restored['R'][0]) > 0 and len(restored['Qualifying'][1]) > 0
+
+def test_invalidated_snapshots_are_loaded_again(season):
+    _, schedule, loads = season
+    retrieve(schedule)
+    loads.clear()
+
+    assert invalidate_snapshots(get_snapshot_path(), YEAR, rounds=[2], racetypes=['R']) == 1
+    retrieve(schedule)
+
+    assert loads == [(2, 'R')]
+    assert len(list_snapshots(get_snapshot_path(), YEAR)) == 6
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+from my_functions.update_functions import update_standings, update_standings_incremental
+
+def sort_standings(standings, key):
+    return standings.sort_values(['raceId', key]).reset_index(drop=True)
+
+@pytest.mark.parametrize('persisted_rounds', [0, 3, 8])
+def test_incremental_standings_match_full_rebuild(staging_tables, persisted_rounds):
+    races = staging_tables['races']
+    results = staging_tables['results']
+    sprint_results = staging_tables['sprint_results']
+
+    # A driver of the last season misses a race before and after the persisted rounds and a sprint
+    last_year = races['year'].max()
+    season = races[races['year'] == last_year].set_index('round')['raceId']
+    driver_id = results.loc[results['raceId'] == season[1], 'driverId'].iloc[0]
+    missed = results['driverId'].eq(driver_id) & results['raceId'].isin([season[2], season[5]])
+    results = results[~missed]
+    sprint_results = sprint_results[~(sprint_results['driverId'].eq(driver_id) & sprint_results['raceId'].eq(season[4]))]
+    assert races[races['raceId'].isin(sprint_results['raceId'])]['year'].eq(last_year).any()
+
+    full_drivers, full_constructors = update_standings(results, sprint_results, races)
+    persisted_race_ids = races.loc[(races['year'] < last_year) | (races['round'] <= persisted_rounds), 'raceId']
+    persisted = full_drivers[full_drivers['raceId'].isin(persisted_race_ids)]
+
+    drivers, constructors = update_standings_incremental(results, sprint_results, races, persisted)
+
+    expected_drivers = full_drivers[~full_drivers['raceId'].isin(persisted_race_ids)]
+    expected_constructors = full_constructors[~full_constructors['raceId'].isin(persisted_race_ids)]
+    assert not drivers.empty
+    pd.testing.assert_frame_equal(sort_standings(drivers, 'driverId'), sort_standings(expected_drivers, 'driverId'), check_dtype=False)
+    pd.testing.assert_frame_equal(sort_standings(constructors, 'constructorId'), sort_standings(expected_constructors, 'constructorId'), check_dtype=False)
+
+def test_incremental_standings_without_new_races(staging_tables):
+    races = staging_tables['races']
+    full_drivers, _ = update_standings(staging_tables['results'], staging_tables['sprint_results'], races)
+
+    drivers, constructors = update_standings_incremental(staging_tables['results'], staging_tables['sprint_results'], races, full_drivers)
+
+    assert drivers.empty and constructors.empty
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from my_functions.preparation_functions import (average_lap_times, join_staging_tables, merge_tables, race_calendar_features,
+                                                rename_staging_tables)
+from my_functions.storage import CsvStore, SqliteStore, StagingTransaction, load_key_index
+from my_functions.update_functions import add_new_entries
+
+def test_sqlite_join_matches_merge_tables(staging_tables, tmp_path):
+    store = SqliteStore(str(tmp_path))
+    for name, table in staging_tables.items():
+        store.write(name, table)
+
+    races = race_calendar_features(store.read('races'))
+    laps_gr = average_lap_times(store.read('lap_times', columns=['raceId', 'driverId', 'milliseconds']))
+    tables = rename_staging_tables(*(store.read(name) for name in ['results', 'driver_standings', 'constructor_standings', 'drivers', 'constructors']))
+
+    joined = join_staging_tables(store, races, laps_gr)
+    expected = merge_tables(tables, races, laps_gr)
+
+    assert any(column.endswith('_x') for column in expected.columns)
+    pd.testing.assert_frame_equal(joined, expected)
+    store.close()
+
+def test_add_new_entries_skips_rows_without_race(staging_tables, tmp_path, monkeypatch):
+    monkeypatch.delenv('F1_STORAGE_BACKEND', raising=False)
+    lap_times = staging_tables['lap_times']
+    last_race = lap_times['raceId'].max()
+    CsvStore(str(tmp_path)).write('lap_times', lap_times[lap_times['raceId'] != last_race])
+
+    # A lap of a race missing from the races dimension has no raceId
+    new_laps = lap_times[lap_times['raceId'] == last_race].copy()
+    orphan = new_laps.iloc[:1].assign(raceId=np.nan)
+    new_data = pd.concat([new_laps, orphan], ignore_index=True)
+
+    for _ in range(2):
+        add_new_entries('lap_times.csv', new_data, staging_path=str(tmp_path))
+
+    store = CsvStore(str(tmp_path))
+    stored = store.read('lap_times')
+    assert stored['raceId'].notna().all()
+    assert len(stored) == len(lap_times)
+    keys, _ = load_key_index(store, 'lap_times')
+    assert keys == set(lap_times['raceId'])
+
+def test_transaction_skips_rows_without_race(staging_tables, tmp_path):
+    results = staging_tables['results']
+    last_race = results['raceId'].max()
+    store = CsvStore(str(tmp_path))
+    store.write('results', results[results['raceId'] != last_race])
+
+    new_results = results[results['raceId'] == last_race]
+    transaction = StagingTransaction(store)
+    transaction.add_new_entries('results', pd.concat([new_results, new_results.iloc[:1].assign(raceId=np.nan)]))
+    transaction.commit()
+
+    assert len(store.read('results')) == len(results)
+    assert load_key_index(store, 'results')[0] == set(results['raceId'])
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from my_functions import tuning
+from my_functions.sequence_dataset import SequenceDataset
+from my_functions.tuning import podium_precision
+
+@pytest.fixture
+def tied_predictions():
+    return pd.DataFrame({
+        'raceId': [1, 1, 1, 1, 1, 2, 2, 2, 2],
+        'probability': [0.5, 0.5, 0.5, 0.5, 0.1, 0.9, 0.8, 0.7, 0.6],
+        'target': [1, 0, 0, 1, 1, 1, 1, 0, 0]
+    })
+
+def test_podium_precision_matches_the_notebook_on_ties(tied_predictions):
+    precision, per_race = podium_precision(tied_predictions)
+
+    notebook = tied_predictions.groupby('raceId')['probability'].rank(method='min', ascending=False) <= 3
+    assert precision == (notebook & tied_predictions['target'].eq(1)).sum() / notebook.sum() == 4 / 7
+    assert per_race.to_dict() == {1: 2 / 4, 2: 2 / 3}
+
+def test_podium_precision_breaks_ties_by_row_order(tied_predictions):
+    precision, per_race = podium_precision(tied_predictions, ties='first')
+
+    assert precision == 3 / 6
+    assert per_race.to_dict() == {1: 1 / 3, 2: 2 / 3}
+
+def test_default_factory_falls_back_to_the_baseline_without_keras(monkeypatch):
+    monkeypatch.setattr(tuning.importlib.util, 'find_spec', lambda name: None)
+
+    assert tuning.default_factory() == tuning.BASELINE_FACTORY
+
+def test_lstm_model_scores_every_sequence():
+    pytest.importorskip('keras')
+    rng = np.random.default_rng(0)
+    rows, window = 60, 4
+    values = rng.random((rows, 3), dtype='float32')
+    target = (rng.random(rows) < 0.2).astype('float32')
+    dataset = SequenceDataset(values, target, np.arange(rows), np.full(rows, 2020), np.arange(rows), window,
+                              np.arange(rows - window + 1), ['a', 'b', 'c'])
+
+    model = tuning.sequence_lstm_model({'neurons': 4, 'batch_size': 16, 'epochs': 1})
+    assert model._oversampled(dataset).labels.mean() == 0.5
+    probabilities = model.fit(dataset, dataset.fit_scaler()).predict_proba(dataset, dataset.fit_scaler())
+
+    assert probabilities.shape == (len(dataset), 2)
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1, rtol=1e-6)
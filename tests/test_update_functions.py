@@ -0,0 +1,27 @@
+import pandas as pd
+from my_functions.synthetic_data import make_fastf1_season
+from my_functions.update_functions import Dim_Updater, build_dimension_lookups, load_event_session, update_laps
+
+def test_update_laps_drops_laps_of_unknown_races(staging_tables):
+    drivers, constructors, races = staging_tables['drivers'], staging_tables['constructors'], staging_tables['races']
+    year = int(races['year'].max()) + 1
+    schedule, events = make_fastf1_season(year, drivers, constructors, rounds=3, seed=3)
+    sessions = [load_event_session(event, 'R') for event in events]
+    laps = [session_laps for session_laps, _ in sessions]
+    results = sessions[0][1]
+
+    # The last round is missing from the races dimension
+    drivers = Dim_Updater(drivers).update_drivers(results, write=False)
+    constructors = Dim_Updater(constructors).update_constructors(results, write=False)
+    races = Dim_Updater(races).update_races(schedule.iloc[:2].copy(), write=False)
+    lookups = {**build_dimension_lookups('drivers', drivers), **build_dimension_lookups('constructors', constructors),
+               **build_dimension_lookups('races', races)}
+
+    lap_times, fastest_laps, laps_driven = update_laps(pd.concat(laps, ignore_index=True), lookups)
+
+    known = set(races.loc[races['year'] == year, 'raceId'])
+    assert len(known) == 2
+    for table in [lap_times, fastest_laps, laps_driven]:
+        assert table['raceId'].notna().all() and table['driverId'].notna().all()
+        assert set(table['raceId'].astype(int)) == known
+    assert len(lap_times) == sum(round_laps['LapTime'].notna().sum() for round_laps in laps[:2])